@@ -10,6 +10,8 @@ from flask import Flask, render_template, request, redirect, url_for, flash, ses
 from functools import wraps
 from werkzeug.exceptions import Forbidden
 import tempfile
+import time
+import click
 
 # Custom password hashing functions compatible with Python 3.9+
 # These functions replicate Werkzeug's format but avoid the hmac.new() digestmod issue.
@@ -110,6 +112,10 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev_key_please_change_in_production')
 app.config['DATABASE'] = os.path.join(app.root_path, 'database.db')
 
+# SQLite connection pool settings
+from config import Config
+app.config.from_mapping({key: value for key, value in vars(Config).items() if key.startswith(('SQLITE_', 'SSE_', 'EVENTS_', 'JOBS_', 'FEEDS_'))})
+
 # Security enhancements
 @app.after_request
 def add_security_headers(response):
@@ -125,6 +131,17 @@ app.config['WTF_CSRF_TIME_LIMIT'] = 3600  # 1 hour CSRF token validity
 
 # Import helper functions
 from helpers import get_db, close_db, login_required, role_required, get_current_user
+from availability import AvailabilityIndex
+from conflicts import recompute_conflicts
+from migrations import migrate, schema_version
+from jobs import JobError, enqueue, job_accepted, job_handler, runner as job_runner
+from client_index import parse_aliases, set_client_aliases, client_aliases
+from feed_sync import claim_due_feeds, scheduler as feed_scheduler
+from ics_writer import vevent_cache
+from subscriptions import feed_body_cache
+
+vevent_cache.size = app.config['EVENTS_ICS_CACHE_SIZE']
+feed_body_cache.size = app.config['EVENTS_SUBSCRIPTION_CACHE_SIZE']
 
 # Database initialization function (uses get_db)
 def init_db():
@@ -134,6 +151,9 @@ def init_db():
     with app.app_context():
         with app.open_resource('schema.sql') as f:
             db.executescript(f.read().decode('utf8'))
+    # schema.sql is the baseline; bring the fresh schema up to the latest version
+    db.execute('PRAGMA user_version = 0')
+    migrate(db)
 
 @app.cli.command('init-db')
 def init_db_command():
@@ -141,6 +161,59 @@ def init_db_command():
     init_db()
     print('Database initialized')
 
+@app.cli.command('migrate-db')
+def migrate_db_command():
+    """Upgrade the database schema in place"""
+    db = get_db()
+    applied = migrate(db)
+    for version, description in applied:
+        print(f'Applied migration {version}: {description}')
+    print(f'Database schema is at version {schema_version(db)}')
+
+@app.cli.command('recompute-conflicts')
+@click.option('--start', default=None, help='First date to recompute (YYYY-MM-DD); defaults to the whole calendar')
+@click.option('--end', default=None, help='Last date to recompute (YYYY-MM-DD)')
+def recompute_conflicts_command(start, end):
+    """Rebuild event_conflicts and has_conflicts flags for a date range"""
+    started = datetime.now()
+    summary = recompute_conflicts(get_db(), start, end)
+    elapsed = (datetime.now() - started).total_seconds()
+    print(f"Recomputed conflicts for {summary['events']} events in {elapsed:.2f}s: "
+          f"{summary['conflicted_events']} events in conflict, "
+          f"{summary['added']} rows added, {summary['removed']} rows removed")
+
+@app.cli.command('run-jobs')
+@click.option('--workers', default=2, show_default=True, help='Number of worker threads')
+def run_jobs_command(workers):
+    """Run queued background jobs until interrupted"""
+    print(f'Running background jobs with {workers} worker(s); press Ctrl+C to stop')
+    job_runner.start(app, workers)
+    feed_scheduler.start(app)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        feed_scheduler.stop()
+        job_runner.stop()
+
+@app.cli.command('sync-feeds')
+@click.option('--all', 'sync_all', is_flag=True, help='Sync every auto-sync feed, not only the due ones')
+def sync_feeds_command(sync_all):
+    """Sync due calendar feeds now (concurrently), without the job queue"""
+    from blueprints.calendar_bp import sync_calendar_feeds
+    db = get_db()
+    if sync_all:
+        feed_ids = [row[0] for row in db.execute('SELECT id FROM calendar_feeds WHERE auto_sync = 1 ORDER BY id')]
+    else:
+        feed_ids = claim_due_feeds(db, app.config['FEEDS_SYNC_MINUTES'])
+    for feed_id, result in sync_calendar_feeds(feed_ids).items():
+        if isinstance(result, Exception):
+            print(f'Feed {feed_id}: failed: {result}')
+        else:
+            print(f"Feed {feed_id}: {result['status']}, {result['changed']} changed, {result['removed']} removed "
+                  f"(fetch {result['fetch_ms']} ms, apply {result['apply_ms']} ms)")
+    print(f'Checked {len(feed_ids)} feed(s)')
+
 # Register close_db with the application
 app.teardown_appcontext(close_db)
 
@@ -639,6 +712,7 @@ def new_client():
         zip_code = request.form.get('zip', '')
         preferences = request.form.get('preferences', '')
         notes = request.form.get('notes', '')
+        aliases = parse_aliases(request.form.get('aliases', ''))
 
         error = None
         if not name:
@@ -646,11 +720,9 @@ def new_client():
         elif not color:
             error = 'Color is required'
 
-        if error is not None:
-            flash(error, 'danger')
-        else:
+        if error is None:
             db = get_db()
-            db.execute(
+            cursor = db.execute(
                 '''INSERT INTO clients
                    (name, color, contact_person, email, phone, address, city, state, zip,
                     preferences, notes, created_at, created_by)
@@ -658,9 +730,14 @@ def new_client():
                 (name, color, contact_person, email, phone, address, city, state, zip_code,
                  preferences, notes, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), session.get('user_id'))
             )
-            db.commit()
-            flash('Client created successfully', 'success')
-            return redirect(url_for('clients'))
+            error = set_client_aliases(db, cursor.lastrowid, aliases)
+            if error is None:
+                db.commit()
+                flash('Client created successfully', 'success')
+                return redirect(url_for('clients'))
+            db.rollback()
+
+        flash(error, 'danger')
 
     return render_template('new_client.html')
 
@@ -741,6 +818,7 @@ def edit_client(client_id):
         zip_code = request.form.get('zip', '')
         preferences = request.form.get('preferences', '')
         notes = request.form.get('notes', '')
+        aliases = parse_aliases(request.form.get('aliases', ''))
 
         error = None
         if not name:
@@ -748,9 +826,7 @@ def edit_client(client_id):
         elif not color:
             error = 'Color is required'
 
-        if error is not None:
-            flash(error, 'danger')
-        else:
+        if error is None:
             db.execute(
                 '''UPDATE clients SET
                    name = ?, color = ?, contact_person = ?, email = ?, phone = ?,
@@ -759,11 +835,16 @@ def edit_client(client_id):
                 (name, color, contact_person, email, phone, address, city, state,
                  zip_code, preferences, notes, client_id) # Removed trailing comma
             )
-            db.commit()
-            flash('Client updated successfully', 'success')
-            return redirect(url_for('view_client', client_id=client_id))
+            error = set_client_aliases(db, client_id, aliases)
+            if error is None:
+                db.commit()
+                flash('Client updated successfully', 'success')
+                return redirect(url_for('view_client', client_id=client_id))
+            db.rollback()
+
+        flash(error, 'danger')
 
-    return render_template('edit_client.html', client=client)
+    return render_template('edit_client.html', client=client, aliases=client_aliases(db, client_id))
 
 @app.route('/clients/<int:client_id>/delete', methods=['POST'])
 @login_required
@@ -785,6 +866,7 @@ def delete_client(client_id):
 
     # Delete related records first to maintain referential integrity
     db.execute('DELETE FROM client_communications WHERE client_id = ?', (client_id,))
+    db.execute('DELETE FROM client_aliases WHERE client_id = ?', (client_id,))
 
     # No need to delete events/invoices here due to the check above,
     # but if cascading delete was desired, it would happen here.
@@ -942,11 +1024,24 @@ def delete_category(category_id):
 def equipment():
     """List all equipment items"""
     db = get_db()
-    equipment = db.execute(
-        '''SELECT e.*,
-           (SELECT COUNT(*) FROM equipment_assignments WHERE equipment_id = e.id) as assignment_count
-           FROM equipment e ORDER BY e.name'''
+    equipment_rows = db.execute(
+        '''SELECT e.*, COUNT(ea.id) as assignment_count
+           FROM equipment e
+           LEFT JOIN equipment_assignments ea ON ea.equipment_id = e.id
+           GROUP BY e.id
+           ORDER BY e.name'''
     ).fetchall()
+
+    # Units committed to events running today
+    today = datetime.now().strftime('%Y-%m-%d')
+    availability = AvailabilityIndex.load(db, today, today)
+    equipment = []
+    for row in equipment_rows:
+        item = dict(row)
+        item['in_use'] = availability.in_use(row['id'], today)
+        item['available'] = availability.free(row['id'], today)
+        equipment.append(item)
+
     return render_template('equipment.html', equipment=equipment)
 
 @app.route('/equipment/new', methods=['GET', 'POST'])
@@ -991,11 +1086,18 @@ def edit_equipment(equipment_id):
     if equipment_item is None:
         abort(404)
 
-    # Get current assignments count for validation
-    assignments_count = db.execute(
-        'SELECT COUNT(*) FROM equipment_assignments WHERE equipment_id = ?',
+    # Peak number of units committed to current and upcoming events, for validation
+    today = datetime.now().strftime('%Y-%m-%d')
+    last_day = db.execute(
+        '''SELECT MAX(COALESCE(e.end_date, e.event_date))
+           FROM equipment_assignments ea JOIN events e ON e.event_id = ea.event_id
+           WHERE ea.equipment_id = ? AND e.status != 'cancelled' ''',
         (equipment_id,)
     ).fetchone()[0]
+    assignments_count = 0
+    if last_day and last_day >= today:
+        availability = AvailabilityIndex.load(db, today, last_day)
+        assignments_count = availability.in_use(equipment_id, today, last_day)
 
     if request.method == 'POST':
         name = request.form['name']
@@ -1812,32 +1914,71 @@ def generate_invoice_pdf(invoice_id):
         flash('PDF generation is not available on this server.', 'danger')
         return redirect(url_for('view_invoice', invoice_id=invoice_id))
 
+    # ?background=1 renders the PDF in a job; it is then served from /jobs/<id>/output
+    if request.args.get('background'):
+        db = get_db(write=True)
+        if not db.execute('SELECT 1 FROM invoices WHERE id = ?', (invoice_id,)).fetchone():
+            abort(404)
+        job_id = enqueue(db, 'invoice_pdf', {'invoice_id': invoice_id}, session.get('user_id'))
+        return job_accepted(job_id, 'The invoice PDF is being generated',
+                            url_for('view_invoice', invoice_id=invoice_id))
+
+    pdf_file = render_invoice_pdf(invoice_id)
+    if pdf_file is None: abort(404)
+
+    # Send the PDF file as a response
+    return Response(pdf_file, mimetype='application/pdf', headers={
+        'Content-Disposition': f'inline; filename=invoice_{invoice_id}.pdf'
+    })
+
+
+@job_handler('invoice_pdf')
+def run_invoice_pdf_job(job):
+    """Background version of generate_invoice_pdf"""
+    invoice_id = job.payload['invoice_id']
+    if not weasyprint_available:
+        raise JobError('PDF generation is not available on this server.')
+    pdf_file = render_invoice_pdf(invoice_id)
+    if pdf_file is None:
+        raise JobError(f'Invoice {invoice_id} not found')
+    job.set_output(pdf_file, 'application/pdf', f'invoice_{invoice_id}.pdf')
+    return {'invoice_id': invoice_id, 'size': len(pdf_file)}
+
+
+def invoice_pdf_html(invoice_id):
+    """The HTML an invoice PDF is rendered from, or None when the invoice does not exist"""
     db = get_db()
     invoice = db.execute(
-        '''SELECT i.*, c.name as client_name, c.address as client_address,
-                  c.city as client_city, c.state as client_state, c.zip as client_zip,
-                  e.event_name, e.event_date
+        '''SELECT i.*, e.event_name as event_title, e.event_date, e.drop_off_time,
+                  e.pickup_time as pick_up_time, e.event_location as location,
+                  c.name as client_name, c.address as client_address,
+                  c.city as client_city, c.state as client_state, c.zip as client_zip
            FROM invoices i
            JOIN clients c ON i.client_id = c.id
            LEFT JOIN events e ON i.event_id = e.event_id
-           WHERE i.invoice_id = ?''', (invoice_id,)
+           WHERE i.id = ?''', (invoice_id,)
     ).fetchone()
-    if not invoice: abort(404)
-
-    invoice_items = db.execute(
-        'SELECT * FROM invoice_items WHERE invoice_id = ?', (invoice_id,)
+    if not invoice: return None
+
+    # The equipment booked for the invoiced event is listed as its line items
+    equipment_items = db.execute(
+        '''SELECT ea.quantity, eq.name, eq.description
+           FROM equipment_assignments ea
+           JOIN equipment eq ON ea.equipment_id = eq.id
+           WHERE ea.event_id = ?''', (invoice['event_id'],)
     ).fetchall()
 
-    # Render HTML template for the PDF
-    html_content = render_template('invoice_pdf.html', invoice=invoice, items=invoice_items)
+    return render_template('invoice_pdf.html', invoice=invoice, equipment_items=equipment_items,
+                           generated_date=datetime.now().strftime('%Y-%m-%d'))
 
-    # Generate PDF using WeasyPrint
-    pdf_file = HTML(string=html_content).write_pdf()
 
-    # Send the PDF file as a response
-    return Response(pdf_file, mimetype='application/pdf', headers={
-        'Content-Disposition': f'inline; filename=invoice_{invoice_id}.pdf'
-    })
+def render_invoice_pdf(invoice_id):
+    """Render an invoice as PDF bytes, or None when it does not exist"""
+    html_content = invoice_pdf_html(invoice_id)
+    if html_content is None: return None
+
+    # Generate PDF using WeasyPrint
+    return HTML(string=html_content).write_pdf()
 
 
 # --- Register Blueprints ---
@@ -1846,13 +1987,23 @@ try:
     from blueprints.calendar_bp import calendar_bp
     from blueprints.locations_bp import locations_bp
     from blueprints.tasks_bp import tasks_bp
+    from blueprints.jobs_bp import jobs_bp
     app.register_blueprint(calendar_bp)
     app.register_blueprint(locations_bp)
     app.register_blueprint(tasks_bp)
+    app.register_blueprint(jobs_bp)
     print("Blueprints registered successfully.")
 except ImportError as e:
     print(f"Warning: Could not import or register blueprints: {e}")
 
+# --- Upgrade the database schema on startup ---
+try:
+    with app.app_context():
+        for version, description in migrate(get_db()):
+            print(f"Applied migration {version}: {description}")
+except sqlite3.Error as e:
+    print(f"Warning: Could not migrate the database schema: {e}")
+
 
 if __name__ == '__main__':
     # Use a different port if default 5000 is taken
@@ -0,0 +1,184 @@
+# Equipment Availability Engine
+#
+# Every equipment item gets a capacity timeline built from (day, delta) events:
+# an assignment adds its quantity on the event's first day and releases it the
+# day after the event ends.  Prefix sums over the sorted change points give the
+# number of units committed on any day, and a sparse table over those levels
+# answers "peak usage between D1 and D2" with two binary searches.
+# Every occurrence of a recurring series holds its master's assignments, so
+# a series can only be given the units free on all of its occurrences.
+from bisect import bisect_right
+from collections import defaultdict
+
+from helpers import epoch_day, day_to_iso, overlap_condition
+from recurrence import (single_condition, window_condition, series_columns, default_window, expand_series,
+                        occurrence_days, horizon_day)
+
+
+def occurrence_windows(start_date, end_date=None, pattern=None, until_date=None):
+    """(start_day, end_day) of each occurrence of an event being saved.
+
+    A single event has one window.  Open-ended series are checked up to
+    horizon_day(), as far as the calendar expands them.
+    """
+    start_day = epoch_day(start_date)
+    span = max(0, epoch_day(end_date) - start_day) if end_date else 0
+    if not pattern:
+        return [(start_day, start_day + span)]
+    until_day = epoch_day(until_date) if until_date else max(horizon_day(), start_day)
+    return [(day, day + span) for day in occurrence_days(start_day, span, pattern, until_day, start_day, until_day)]
+
+
+class CapacityTimeline:
+    """Committed units over time for a single equipment item"""
+
+    def __init__(self, deltas):
+        self.days = sorted(deltas)
+
+        # Prefix sums: units committed from days[i] until the next change point
+        levels = []
+        running = 0
+        for day in self.days:
+            running += deltas[day]
+            levels.append(running)
+
+        # Sparse table for O(1) range-maximum queries over the levels
+        self.table = [levels]
+        width = 1
+        while width * 2 <= len(levels):
+            previous = self.table[-1]
+            self.table.append([max(previous[i], previous[i + width])
+                               for i in range(len(previous) - width)])
+            width *= 2
+
+    def _range_max(self, low, high):
+        """Maximum level between change point indexes low and high (inclusive)"""
+        span = (high - low + 1).bit_length() - 1
+        row = self.table[span]
+        return max(row[low], row[high - (1 << span) + 1])
+
+    def peak(self, start_day, end_day):
+        """Highest number of units committed on any day in [start_day, end_day]"""
+        low = bisect_right(self.days, start_day) - 1
+        high = bisect_right(self.days, end_day) - 1
+        if high < 0:
+            return 0
+        if low < 0:
+            # Nothing committed on start_day itself; look at the later change points
+            return max(0, self._range_max(0, high))
+        return self._range_max(low, high)
+
+
+class AvailabilityIndex:
+    """Time-windowed availability for the whole equipment catalogue"""
+
+    def __init__(self, capacity, assignments):
+        """Build the index.
+
+        ``capacity`` maps equipment id to total quantity and ``assignments``
+        is an iterable of ``(equipment_id, start_day, end_day, quantity)``
+        with inclusive day numbers.
+        """
+        self.capacity = dict(capacity)
+
+        deltas = defaultdict(lambda: defaultdict(int))
+        for equipment_id, start_day, end_day, quantity in assignments:
+            deltas[equipment_id][start_day] += quantity
+            deltas[equipment_id][end_day + 1] -= quantity
+
+        self.timelines = {equipment_id: CapacityTimeline(changes)
+                          for equipment_id, changes in deltas.items()}
+
+    @classmethod
+    def load(cls, db, start_date=None, end_date=None, exclude_event_id=None):
+        """Load capacities and assignments of non-cancelled events.
+
+        When a window is given only assignments overlapping it are read, so
+        queries must stay inside [start_date, end_date].
+        """
+        cursor = db.cursor()
+        cursor.row_factory = None
+        capacity = cursor.execute('SELECT id, quantity FROM equipment').fetchall()
+
+        # Events with unparseable dates have no start_day and cannot be placed on the timeline
+        query = f'''
+            SELECT ea.equipment_id, e.start_day, MAX(e.start_day, e.end_day), ea.quantity
+            FROM events e
+            JOIN equipment_assignments ea ON ea.event_id = e.event_id
+            WHERE e.status != 'cancelled' AND e.start_day IS NOT NULL AND {single_condition()}
+        '''
+        params = []
+        window = default_window()
+        if start_date and end_date:
+            window = (epoch_day(start_date), epoch_day(end_date))
+            condition, condition_params = overlap_condition(db, *window)
+            query += ' AND ' + condition
+            params.extend(condition_params)
+        if exclude_event_id is not None:
+            query += ' AND e.event_id != ?'
+            params.append(exclude_event_id)
+
+        assignments = [(equipment_id, start_day, end_day, quantity or 0)
+                       for equipment_id, start_day, end_day, quantity in cursor.execute(query, params)]
+
+        # Occurrences of recurring series in the window
+        condition, params = window_condition(*window)
+        query = f'''
+            SELECT {series_columns()}, ea.equipment_id, ea.quantity
+            FROM events e
+            JOIN equipment_assignments ea ON ea.event_id = e.event_id
+            WHERE e.status != 'cancelled' AND {condition}
+        '''
+        if exclude_event_id is not None:
+            query += ' AND e.event_id != ?'
+            params.append(exclude_event_id)
+        rows = cursor.execute(query, params).fetchall()
+        if rows:
+            # One row per series for the expansion, then its assignments per occurrence
+            held = defaultdict(list)
+            masters = {}
+            for row in rows:
+                masters.setdefault(row[0], row)
+                held[row[0]].append((row[6], row[7] or 0))
+            for master, day in expand_series(db, list(masters.values()), *window):
+                end_day = day + max(master[3] or 0, 0)
+                assignments.extend((equipment_id, day, end_day, quantity)
+                                   for equipment_id, quantity in held[master[0]])
+
+        return cls(capacity, assignments)
+
+    @classmethod
+    def load_windows(cls, db, windows, exclude_event_id=None):
+        """Load the index for the span of occurrence_windows"""
+        return cls.load(db, day_to_iso(windows[0][0]), day_to_iso(max(end for _, end in windows)),
+                        exclude_event_id=exclude_event_id)
+
+    def in_use(self, equipment_id, start_date, end_date=None):
+        """Peak number of units of an item committed between start_date and end_date"""
+        timeline = self.timelines.get(int(equipment_id))
+        if timeline is None:
+            return 0
+        try:
+            start_day = epoch_day(start_date)
+            end_day = epoch_day(end_date) if end_date else start_day
+        except (TypeError, ValueError):
+            return 0
+        return timeline.peak(start_day, max(start_day, end_day))
+
+    def free(self, equipment_id, start_date, end_date=None):
+        """Units of an item free for the whole of [start_date, end_date]"""
+        total = self.capacity.get(int(equipment_id), 0)
+        return max(0, total - self.in_use(equipment_id, start_date, end_date))
+
+    def free_all(self, start_date, end_date=None):
+        """Free units for every equipment item over [start_date, end_date]"""
+        return {equipment_id: self.free(equipment_id, start_date, end_date)
+                for equipment_id in self.capacity}
+
+    def free_during(self, equipment_id, windows):
+        """Units of an item free for every one of the (start_day, end_day) windows"""
+        total = self.capacity.get(int(equipment_id), 0)
+        timeline = self.timelines.get(int(equipment_id))
+        if timeline is None:
+            return total
+        return max(0, total - max((timeline.peak(start, end) for start, end in windows), default=0))
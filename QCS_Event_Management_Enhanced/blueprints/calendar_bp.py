@@ -1,12 +1,13 @@
 # Calendar and Event API Routes Blueprint
 import sqlite3
-from flask import Blueprint, jsonify, request, abort, url_for, redirect, flash, make_response, session, render_template, Response
-from datetime import datetime, timedelta
-import ics  # Requires pip install ics
-import requests
-from io import StringIO
+from flask import Blueprint, jsonify, request, abort, url_for, redirect, flash, make_response, session, render_template, Response, current_app, stream_with_context
+from datetime import date, datetime, timedelta
+from urllib.parse import quote
+from werkzeug.http import is_resource_modified
 import uuid
-import csv
+import json
+import queue
+import time
 
 # Sample ICS data for populating the database
 ICS_EVENTS = """BEGIN:VCALENDAR
@@ -160,10 +161,34 @@ except (ImportError, OSError):
     print("WeasyPrint not available. PDF generation will be disabled.")
 
 # Import helpers from the new helpers module
-from helpers import get_db, login_required, role_required
+from helpers import get_db, login_required, role_required, get_current_user
+from conflicts import check_event_conflicts, recompute_conflicts, refresh_event_conflicts
+from revisions import current_revision, events_etag
+from event_bus import bus as event_bus
+from event_feed import (event_feed_filters, fetch_event_feed, count_event_feed, stream_event_feed,
+                        fetch_series_feed, serialize_event_feed, event_url_template, json_response)
+from recurrence import parse_event_id, time_shift, shift_series, split_series, RECURRENCE_PATTERNS
+from availability import AvailabilityIndex, occurrence_windows
+from csv_import import parse_csv_rows, import_csv_events
+from client_index import client_index
+from ics_reader import read_vevents, IcsError
+from ics_writer import stream_calendar
+from exporters import get_exporter, export_formats, export_columns, export_batches
+from subscriptions import (SUBSCRIPTION_COLUMNS, subscription_filters, create_subscription, find_subscription,
+                           subscription_validators, subscription_body)
+from jobs import JobError, enqueue, job_accepted, job_handler
+from feed_sync import (FEED_STATUS_COLUMNS, FeedHTTPError, fetch_feeds, diff_feed, record_feed_events,
+                       record_feed_status)
 import tempfile
 from flask import send_file
 
+# Map ICS status to database status
+ICS_STATUSES = {
+    'CONFIRMED': 'confirmed',
+    'TENTATIVE': 'booked',
+    'CANCELLED': 'cancelled'
+}
+
 # Calendar view route
 @calendar_bp.route('/calendar')
 @login_required
@@ -186,11 +211,21 @@ def calendar():
     # Get locations for quick add
     locations = db.execute('SELECT * FROM locations WHERE is_active = 1').fetchall()
     
+    # The user's subscription feeds; the newest fills the subscribe links
+    subscriptions = _user_subscriptions(db)
+    links = subscriptions[0]['links'] if subscriptions else {}
+    
     return render_template('calendar.html', 
                            events=events, 
                            clients=clients,
                            categories=categories,
-                           locations=locations)
+                           locations=locations,
+                           export_calendar_enabled=True,
+                           subscriptions=subscriptions,
+                           ics_subscribe_url=links.get('url', ''),
+                           google_calendar_url=links.get('google', '#'),
+                           outlook_calendar_url=links.get('outlook', '#'),
+                           apple_calendar_url=links.get('webcal', '#'))
 
 # Export calendar as ICS
 @calendar_bp.route('/export-calendar/<format>')
@@ -198,397 +233,427 @@ def calendar():
 def export_calendar(format):
     """Export calendar in various formats"""
     if format == 'ics':
-        # Create a new calendar
-        calendar = ics.Calendar()
-        
-        # Get all events
+        # The calendar is streamed straight from the cursor; unchanged events come from the VEVENT cache
         db = get_db()
-        events = db.execute(
-            '''SELECT e.*, c.name as client_name, l.name as location_name, 
-                      l.address as location_address
-               FROM events e
-               LEFT JOIN clients c ON e.client_id = c.id
-               LEFT JOIN locations l ON e.location_id = l.id
-               WHERE e.status != 'cancelled' '''
-        ).fetchall()
-        
-        # Add each event to the calendar
-        for event in events:
-            # Use existing ics_uid or generate a new one
-            cal_event = ics.Event(uid=event['ics_uid'] or str(uuid.uuid4()))
-            cal_event.name = event['event_name']
-            
-            # Set event start
-            start_str = f"{event['event_date']}T{event['drop_off_time'] or '09:00:00'}"
-            cal_event.begin = datetime.strptime(start_str, '%Y-%m-%dT%H:%M:%S')
-            
-            # Set event end
-            if event['end_date']:
-                end_str = f"{event['end_date']}T{event['pickup_time'] or '17:00:00'}"
-                cal_event.end = datetime.strptime(end_str, '%Y-%m-%dT%H:%M:%S')
-            else:
-                end_str = f"{event['event_date']}T{event['pickup_time'] or '17:00:00'}"
-                cal_event.end = datetime.strptime(end_str, '%Y-%m-%dT%H:%M:%S')
-            
-            # Add description and location
-            description_parts = []
-            if event['client_name']:
-                description_parts.append(f"Client: {event['client_name']}")
-            if event['notes']:
-                description_parts.append(event['notes'])
-            
-            cal_event.description = "\n".join(description_parts)
-            
-            # Set location
-            location_parts = []
-            if event['event_location']:
-                location_parts.append(event['event_location'])
-            elif event['location_name']:
-                location_parts.append(event['location_name'])
-                if event['location_address']:
-                    location_parts.append(event['location_address'])
-            
-            if location_parts:
-                cal_event.location = ", ".join(location_parts)
-            
-            # Add status
-            if event['status'] == 'booked':
-                cal_event.status = 'CONFIRMED'
-            elif event['status'] == 'cancelled':
-                cal_event.status = 'CANCELLED'
-            else:
-                cal_event.status = 'TENTATIVE'
-            
-            # Add URL
-            cal_event.url = url_for('calendar.view_event', event_id=event['event_id'], _external=True)
-            
-            # Add to calendar
-            calendar.events.add(cal_event)
-        
-        # Return as attachment
-        response = make_response(str(calendar))
-        response.headers['Content-Type'] = 'text/calendar'
+        chunks = stream_calendar(db, event_url_template(external=True),
+                                 batch_size=current_app.config.get('EVENTS_STREAM_BATCH_SIZE', 500))
+        response = Response(stream_with_context(chunks), mimetype='text/calendar')
         response.headers['Content-Disposition'] = 'attachment; filename=calendar.ics'
         return response
     
-    # Other formats could be added here (JSON, XML, etc.)
-    abort(400)
+    # Everything else goes through the exporter registry (CSV, JSON Lines, XLSX)
+    exporter = get_exporter(format)
+    if exporter is None:
+        abort(400, description=f"Unknown export format; use ics or {', '.join(export_formats())}")
+    try:
+        columns = export_columns(request.args.get('columns'))
+    except ValueError as e:
+        abort(400, description=str(e))
+    
+    batches = export_batches(get_db(), columns, current_app.config.get('EVENTS_STREAM_BATCH_SIZE', 500))
+    response = Response(stream_with_context(exporter.render(batches, columns)), mimetype=exporter.mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=events.{exporter.extension}'
+    return response
+
+def _subscription_links(subscription):
+    """Feed URL of a subscription and the add-calendar links of the common calendar apps"""
+    url = url_for('calendar.subscription_feed', token=subscription['token'], _external=True)
+    webcal = 'webcal://' + url.split('://', 1)[1]
+    return {
+        'url': url,
+        'webcal': webcal,
+        'google': f"https://calendar.google.com/calendar/r?cid={quote(webcal, safe='')}",
+        'outlook': f"https://outlook.live.com/calendar/0/addfromweb?url={quote(url, safe='')}"
+                   f"&name={quote(subscription['name'], safe='')}",
+    }
+
+def _user_subscriptions(db):
+    """Subscriptions the current user may see (admins see all), newest first"""
+    user = get_current_user()
+    if user is None:
+        return []
+    if user['role'] == 'admin':
+        rows = db.execute(f'SELECT {SUBSCRIPTION_COLUMNS} FROM calendar_subscriptions ORDER BY id DESC')
+    else:
+        rows = db.execute(f'SELECT {SUBSCRIPTION_COLUMNS} FROM calendar_subscriptions '
+                          'WHERE user_id = ? ORDER BY id DESC', (user['id'],))
+    return [dict(row, links=_subscription_links(row)) for row in rows]
+
+# Filtered ICS feed polled by calendar apps
+@calendar_bp.route('/subscriptions/<token>.ics')
+def subscription_feed(token):
+    """Serve a subscription feed; the token in the URL authenticates the caller.
+
+    Polls are answered from the subscription row: unchanged feeds get a 304
+    and changed ones the body cached for the current revision.
+    """
+    db = get_db()
+    subscription = find_subscription(db, token)
+    if subscription is None:
+        abort(404)
+    
+    today = date.today()
+    url_template = event_url_template(external=True)
+    etag, last_modified = subscription_validators(subscription, url_template, today)
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        body = subscription_body(db, subscription, url_template, etag, today,
+                                 current_app.config.get('EVENTS_STREAM_BATCH_SIZE', 500))
+        response = Response(body, mimetype='text/calendar')
+    else:
+        response = Response(status=304)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@calendar_bp.route('/calendar-subscriptions', methods=['POST'])
+@login_required
+def new_subscription():
+    """Create a subscription feed from the filters in the form (or JSON body)"""
+    db = get_db()
+    form = request.get_json(silent=True) or request.form
+    try:
+        filters = subscription_filters(db, form, get_current_user())
+    except ValueError as e:
+        if request.is_json:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        flash(str(e), 'danger')
+        return redirect(url_for('calendar.calendar'))
+    
+    token = create_subscription(db, session.get('user_id'), filters)
+    db.commit()
+    links = _subscription_links(find_subscription(db, token))
+    if request.is_json:
+        return jsonify({'success': True, 'name': filters['name'], **links}), 201
+    flash(f"Subscription '{filters['name']}' created: {links['url']}", 'success')
+    return redirect(url_for('calendar.calendar'))
+
+@calendar_bp.route('/api/calendar-subscriptions')
+@login_required
+def api_subscriptions():
+    """List the current user's subscription feeds (all feeds for admins)"""
+    return jsonify(_user_subscriptions(get_db()))
+
+@calendar_bp.route('/calendar-subscriptions/<int:subscription_id>/delete', methods=['POST'])
+@login_required
+def delete_subscription(subscription_id):
+    """Revoke a subscription feed; its URL stops working immediately"""
+    db = get_db()
+    user = get_current_user()
+    subscription = db.execute('SELECT user_id FROM calendar_subscriptions WHERE id = ?',
+                              (subscription_id,)).fetchone()
+    if subscription is None:
+        abort(404)
+    if user['role'] != 'admin' and subscription['user_id'] != user['id']:
+        abort(403)
+    db.execute('DELETE FROM calendar_subscriptions WHERE id = ?', (subscription_id,))
+    db.commit()
+    if request.is_json or request.accept_mimetypes.best == 'application/json':
+        return jsonify({'success': True})
+    flash('Subscription revoked', 'success')
+    return redirect(url_for('calendar.calendar'))
 
 # Import calendar from ICS file or URL
 @calendar_bp.route('/import-calendar', methods=['POST'])
 @login_required
 @role_required('admin', 'staff')
 def import_calendar():
-    """Import calendar from ICS file or URL"""
+    """Import calendar from ICS file or URL.
+
+    With background=1 the import is queued as a job and the response (202
+    JSON for API clients, otherwise a redirect) returns immediately.
+    """
     import_type = request.form.get('import_type', 'ics_file')
     category_id = request.form.get('category_id')
+    background = bool(request.form.get('background'))
     
     try:
-        calendar = None
+        payload = {'import_type': import_type, 'category_id': category_id}
+        source = None
         
-        if import_type == 'ics_file':
+        if import_type in ('ics_file', 'csv_file'):
             # Import from uploaded file
-            if 'ics_file' not in request.files:
-                flash('No file selected', 'danger')
-                return redirect(url_for('calendar_bp.calendar'))
-            
-            file = request.files['ics_file']
-            if file.filename == '':
-                flash('No file selected', 'danger')
-                return redirect(url_for('calendar_bp.calendar'))
-            
-            # Parse ICS file
-            ics_content = file.read().decode('utf-8')
-            calendar = ics.Calendar(ics_content)
-
-        elif import_type == 'csv_file':
-            if 'csv_file' not in request.files:
-                flash('No file selected', 'danger')
-                return redirect(url_for('calendar.calendar'))
-
-            file = request.files['csv_file']
-            if file.filename == '':
+            file = request.files.get(import_type)
+            if file is None or file.filename == '':
                 flash('No file selected', 'danger')
                 return redirect(url_for('calendar.calendar'))
-            
-            # Process CSV file
-            try:
-                # Read the CSV file in-memory
-                stream = StringIO(file.stream.read().decode("UTF8"), newline=None)
-                csv_reader = csv.DictReader(stream)
-                
-                db = get_db()
-                imported_count = 0
-                
-                # Get client and category maps
-                clients = db.execute("SELECT id, name FROM clients").fetchall()
-                client_map = {client['name'].lower(): client['id'] for client in clients}
-
-                categories = db.execute("SELECT id, name FROM event_categories").fetchall()
-                category_map = {cat['name'].lower(): cat['id'] for cat in categories}
-
-                for row in csv_reader:
-                    # Extract data from CSV row
-                    event_name = row.get('event_name')
-                    event_date = row.get('event_date')
-                    client_name = row.get('client_name')
-
-                    if not all([event_name, event_date, client_name]):
-                        flash(f"Skipping row due to missing required fields: {row}", 'warning')
-                        continue
-
-                    # Find client_id with more flexible matching
-                    client_id = None
-                    csv_client_name_lower = client_name.lower()
-
-                    for client in clients:
-                        db_client_name_lower = client['name'].lower()
-                        
-                        # 1. Check for direct substring match (e.g., "Horizon" in "Horizon Blue Cross")
-                        if csv_client_name_lower in db_client_name_lower:
-                            client_id = client['id']
-                            break
-
-                        # 2. Check for acronym match (e.g., "RWJ" for "Robert Wood Johnson")
-                        name_parts = db_client_name_lower.split()
-                        if len(name_parts) > 1:
-                            acronym = "".join(part[0] for part in name_parts)
-                            if csv_client_name_lower == acronym:
-                                client_id = client['id']
-                                break
-                    
-                    if not client_id:
-                        flash(f"Client '{client_name}' not found. Skipping event '{event_name}'.", 'warning')
-                        continue
-
-                    # --- DUPLICATE CHECK ---
-                    existing_event = db.execute(
-                        'SELECT event_id FROM events WHERE event_name = ? AND client_id = ? AND event_date = ?',
-                        (event_name, client_id, event_date)
-                    ).fetchone()
-
-                    if existing_event:
-                        flash(f"Skipped duplicate event: '{event_name}' on {event_date}", 'info')
-                        continue
-                    
-                    # Find category_id if provided
-                    category_name = row.get('category_name')
-                    category_id = category_map.get(category_name.lower()) if category_name else None
-
-                    # Insert into database
-                    cursor = db.execute(
-                        '''INSERT INTO events 
-                           (event_name, client_id, category_id, event_date, drop_off_time, 
-                            pickup_time, event_location, onsite_contact, manager, items_needed, 
-                            boxes_from_pi, notes, status, ics_uid) 
-                           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                        (
-                            event_name,
-                            client_id,
-                            category_id,
-                            event_date,
-                            row.get('start_time'),
-                            row.get('pickup_time'),
-                            row.get('location_address'),
-                            row.get('onsite_contact'),
-                            row.get('manager'),
-                            row.get('items_needed'),
-                            row.get('boxes_from_pi'),
-                            row.get('notes'),
-                            'booked',
-                            str(uuid.uuid4())
-                        )
-                    )
-                    event_id = cursor.lastrowid
-                    imported_count += 1
-
-                    # --- EQUIPMENT ASSIGNMENT ---
-                    items_needed_str = row.get('items_needed', '')
-                    if items_needed_str:
-                        # Get all available equipment from DB
-                        all_equipment = db.execute('SELECT id, name FROM equipment').fetchall()
-                        
-                        # Split items from CSV, handling different separators
-                        items_to_assign = [item.strip() for item in items_needed_str.replace(';',',').split(',') if item.strip()]
-
-                        for item_string in items_to_assign:
-                            # --- Enhanced Equipment Matching & Creation ---
-                            matched_equipment = None
-                            # First, try to find an exact match
-                            for equipment in all_equipment:
-                                if equipment['name'].lower() == item_string.lower():
-                                    matched_equipment = equipment
-                                    break
-                            
-                            # If no exact match, try partial match
-                            if not matched_equipment:
-                                for equipment in all_equipment:
-                                    if equipment['name'].lower() in item_string.lower():
-                                        matched_equipment = equipment
-                                        break
-
-                            # If still no match, create the equipment
-                            if not matched_equipment:
-                                # Create a new record only in the 'equipment' table
-                                cursor = db.execute(
-                                    "INSERT INTO equipment (name, description, quantity, status) VALUES (?, ?, ?, ?)",
-                                    (item_string, 'Auto-created during CSV import', 1, 'available')
-                                )
-                                new_equipment_id = cursor.lastrowid
-                                matched_equipment = {'id': new_equipment_id, 'name': item_string}
-                                
-                                # Add to our local list of all_equipment to avoid re-creating it in the same import session
-                                all_equipment.append(matched_equipment)
-                                flash(f"Created new equipment item: '{item_string}'", "info")
-
-                            # Assign the matched or newly created equipment
-                            if matched_equipment:
-                                quantity = 1  # Assuming quantity of 1 for now
-                                
-                                # Check if this equipment is already assigned to this event to avoid duplicates
-                                already_assigned = db.execute(
-                                    'SELECT 1 FROM equipment_assignments WHERE event_id = ? AND equipment_id = ?',
-                                    (event_id, matched_equipment['id'])
-                                ).fetchone()
-
-                                if not already_assigned:
-                                    db.execute(
-                                        '''INSERT INTO equipment_assignments (event_id, equipment_id, quantity, assigned_by)
-                                           VALUES (?, ?, ?, ?)''',
-                                        (event_id, matched_equipment['id'], quantity, session.get('user_id'))
-                                    )
-                
-                db.commit()
-                flash(f'Successfully imported {imported_count} events from CSV', 'success')
-                return redirect(url_for('calendar.calendar'))
-
-            except Exception as e:
-                flash(f'Error processing CSV file: {str(e)}', 'danger')
-                return redirect(url_for('calendar.calendar'))
-            
+            if import_type == 'ics_file' and not background:
+                # Read the upload line by line instead of decoding it whole
+                source = file.stream
+            else:
+                payload['content'] = file.read().decode('utf-8')
+        
         elif import_type == 'ics_url':
             # Import from URL
-            ics_url = request.form.get('ics_url')
-            if not ics_url:
+            payload['url'] = request.form.get('ics_url')
+            payload['auto_sync'] = bool(request.form.get('auto_sync'))
+            if not payload['url']:
                 flash('URL is required', 'danger')
-                return redirect(url_for('calendar_bp.calendar'))
-            
-            # Fetch ICS content from URL
-            response = requests.get(ics_url)
-            if response.status_code != 200:
-                flash(f'Failed to fetch ICS: {response.status_code}', 'danger')
-                return redirect(url_for('calendar_bp.calendar'))
-            
-            # Parse ICS content
-            calendar = ics.Calendar(response.text)
-            
-            # If auto-sync is enabled, save the URL for later sync
-            if request.form.get('auto_sync'):
-                db = get_db()
-                db.execute(
-                    'INSERT INTO calendar_feeds (url, category_id, created_by) VALUES (?, ?, ?)',
-                    (ics_url, category_id, session.get('user_id', None))
-                )
-                db.commit()
+                return redirect(url_for('calendar.calendar'))
         
-        if not calendar:
+        else:
             flash('Invalid calendar data', 'danger')
-            return redirect(url_for('calendar_bp.calendar'))
+            return redirect(url_for('calendar.calendar'))
         
-        # Get default client for imported events
-        db = get_db()
-        default_client = db.execute('SELECT id FROM clients LIMIT 1').fetchone()
-        if not default_client:
-            flash('No clients available to assign events to', 'danger')
-            return redirect(url_for('calendar_bp.calendar'))
+        if background:
+            job_id = enqueue(get_db(), 'import_calendar', payload, session.get('user_id'))
+            return job_accepted(job_id, 'Import queued', url_for('calendar.calendar'))
         
-        # Process the calendar events
-        imported_count = 0
-        for event in calendar.events:
-            # Extract event details
-            event_name = event.name
-            
-            # Extract dates
-            start_date = event.begin.date().strftime('%Y-%m-%d')
-            start_time = event.begin.time().strftime('%H:%M:%S')
-            
-            if hasattr(event, 'end') and event.end:
-                end_date = event.end.date().strftime('%Y-%m-%d')
-                end_time = event.end.time().strftime('%H:%M:%S')
-                
-                # Check if this is a multi-day event
-                if end_date != start_date:
-                    is_multi_day = True
-                else:
-                    is_multi_day = False
-                    end_date = None
-            else:
-                end_date = None
-                end_time = None
-                is_multi_day = False
-            
-            # Check if an event with this UID already exists
-            event_uid = getattr(event, 'uid', None) or str(uuid.uuid4())
-            existing_event = db.execute(
-                'SELECT event_id FROM events WHERE ics_uid = ?', 
-                (event_uid,)
-            ).fetchone()
-            
-            if existing_event:
-                # Update the existing event
-                db.execute(
-                    '''UPDATE events SET 
-                       event_name = ?, client_id = ?, category_id = ?, 
-                       event_date = ?, end_date = ?, drop_off_time = ?, 
-                       pickup_time = ?, event_location = ?, status = ?, 
-                       notes = ?, is_all_day = ?
-                       WHERE ics_uid = ?''',
-                    (
-                        event_name,
-                        default_client['id'], 
-                        category_id,
-                        start_date,
-                        end_date,
-                        start_time,
-                        end_time,
-                        getattr(event, 'location', '') or '',
-                        'booked',  # Default status
-                        getattr(event, 'description', '') or '',
-                        0 if start_time and end_time else 1,  # All-day if no times
-                        event_uid
-                    )
-                )
-            else:
-                # Create a new event
-                db.execute(
-                    '''INSERT INTO events 
-                       (event_name, client_id, category_id, event_date, end_date,
-                        drop_off_time, pickup_time, event_location, status, notes, is_all_day, ics_uid) 
-                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                    (
-                        event_name,
-                        default_client['id'], 
-                        category_id,
-                        start_date,
-                        end_date,
-                        start_time,
-                        end_time,
-                        getattr(event, 'location', '') or '',
-                        'booked',  # Default status
-                        getattr(event, 'description', '') or '',
-                        0 if start_time and end_time else 1,  # All-day if no times
-                        event_uid
-                    )
-                )
-            imported_count += 1
-        
-        db.commit()
-        flash(f'Successfully imported {imported_count} events', 'success')
-        return redirect(url_for('calendar_bp.calendar'))
+        result = _run_calendar_import(payload, session.get('user_id'), source=source)
+        for message in result['messages']:
+            flash(*message)
+        flash(f"Successfully imported {result['imported']} events"
+              f"{' from CSV' if import_type == 'csv_file' else ''}", 'success')
+        return redirect(url_for('calendar.calendar'))
         
     except Exception as e:
         flash(f'Error importing calendar: {str(e)}', 'danger')
-        return redirect(url_for('calendar_bp.calendar'))
+        return redirect(url_for('calendar.calendar'))
+
+@job_handler('import_calendar')
+def run_import_job(job):
+    """Background version of import_calendar"""
+    result = _run_calendar_import(job.payload, job.user_id, job.progress)
+    result['messages'] = [message for message, _ in result['messages']]
+    return result
+
+def _run_calendar_import(payload, user_id, progress=None, source=None):
+    """Import the calendar described by an import_calendar payload.
+
+    source, when given, is an open ICS upload to read instead of
+    payload['content'].  Returns {'imported': n, 'event_ids': [...],
+    'messages': [(message, category), ...]}.  Raises JobError for input that
+    cannot be imported.
+    """
+    progress = progress or (lambda percent, message=None: None)
+    import_type = payload['import_type']
+    
+    if import_type == 'csv_file':
+        # Parse and validate every row before touching the database
+        rows, messages = parse_csv_rows(payload['content'])
+        progress(20, f'Parsed {len(rows)} rows')
+        db = get_db(write=True)
+        result = import_csv_events(db, rows, user_id)
+        imported_ids = result['imported_ids']
+        messages += result['messages']
+    else:
+        messages = []
+        timezone = current_app.config.get('EVENTS_TIMEZONE')
+        fetches = {}
+        try:
+            if import_type == 'ics_url':
+                # Several URLs (one per line) are fetched concurrently
+                urls = list(dict.fromkeys(payload['url'].split()))
+                fetches = fetch_feeds([{'id': url, 'url': url, 'etag': None, 'last_modified': None}
+                                       for url in urls], tz=timezone)
+                for fetch in fetches.values():
+                    if isinstance(fetch, FeedHTTPError):
+                        # Server errors may be temporary and are retried; client errors are not
+                        raise Exception(str(fetch)) if fetch.temporary else JobError(str(fetch))
+                    if isinstance(fetch, Exception):
+                        raise fetch
+                events = [event for fetch in fetches.values() for event in fetch.events]
+            else:
+                events = list(read_vevents(payload['content'] if source is None else source, timezone))
+        except IcsError as e:
+            raise JobError(f'Invalid calendar data: {e}')
+        progress(30, f'Parsed {len(events)} events')
+        
+        # Everything is parsed before the writer is taken
+        db = get_db(write=True)
+        if import_type == 'ics_url' and payload.get('auto_sync'):
+            # Save the URLs for the feed scheduler (see feed_sync.py) and import
+            # what diff_feed returns, so events without a UID are stored under
+            # the synthetic UID later syncs update and cancel them by
+            imported_ids = []
+            for url, fetch in fetches.items():
+                feed_id = db.execute(
+                    '''INSERT INTO calendar_feeds (url, category_id, auto_sync, etag, last_modified, created_by)
+                       VALUES (?, ?, 1, ?, ?, ?)''',
+                    (url, payload.get('category_id'), fetch.etag, fetch.last_modified, user_id)
+                ).lastrowid
+                changed, hashes, _ = diff_feed(db, feed_id, fetch.events)
+                imported_ids += _import_ics_events(db, changed, payload.get('category_id'))
+                record_feed_events(db, feed_id, hashes)
+        else:
+            imported_ids = _import_ics_events(db, events, payload.get('category_id'))
+    
+    progress(80, f'Imported {len(imported_ids)} events')
+    conflicts = refresh_event_conflicts(db, imported_ids)
+    db.commit()
+    publish_event_changes(db, 'updated', imported_ids, conflicts)
+    return {'imported': len(imported_ids), 'event_ids': imported_ids, 'messages': messages}
+
+def _import_ics_events(db, events, category_id):
+    """Insert or update (by UID) the IcsEvents read from a calendar; returns their ids.
+
+    Events without a UID get a random one, so feeds pass them through diff_feed first.
+    """
+    # Get default client for imported events
+    default_client = db.execute('SELECT id FROM clients LIMIT 1').fetchone()
+    if not default_client:
+        raise JobError('No clients available to assign events to')
+    
+    # Process the calendar events
+    imported_ids = []
+    for event in events:
+        # Multi-day events keep their end date; same-day events store only the day
+        end_date = event.end_date if event.end_date != event.start_date else None
+        values = (
+            event.summary,
+            default_client['id'],
+            category_id,
+            event.start_date,
+            end_date,
+            event.start_time,
+            event.end_time,
+            event.location or '',
+            ICS_STATUSES.get(event.status, 'booked'),
+            event.description or '',
+            1 if event.all_day else 0,
+        )
+        
+        # Check if an event with this UID already exists
+        event_uid = event.uid or str(uuid.uuid4())
+        existing_event = db.execute(
+            'SELECT event_id FROM events WHERE ics_uid = ?', 
+            (event_uid,)
+        ).fetchone()
+        
+        if existing_event:
+            # Update the existing event
+            db.execute(
+                '''UPDATE events SET 
+                   event_name = ?, client_id = ?, category_id = ?, 
+                   event_date = ?, end_date = ?, drop_off_time = ?, 
+                   pickup_time = ?, event_location = ?, status = ?, 
+                   notes = ?, is_all_day = ?
+                   WHERE ics_uid = ?''',
+                values + (event_uid,)
+            )
+            imported_ids.append(existing_event['event_id'])
+        else:
+            # Create a new event
+            cursor = db.execute(
+                '''INSERT INTO events 
+                   (event_name, client_id, category_id, event_date, end_date,
+                    drop_off_time, pickup_time, event_location, status, notes, is_all_day, ics_uid) 
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                values + (event_uid,)
+            )
+            imported_ids.append(cursor.lastrowid)
+    
+    return imported_ids
+
+@job_handler('sync_feed')
+def run_feed_sync_job(job):
+    """Re-fetch one auto-sync calendar feed and apply what changed"""
+    return sync_calendar_feed(job.payload['feed_id'])
+
+@job_handler('sync_feeds')
+def run_feeds_sync_job(job):
+    """Re-fetch a batch of due feeds concurrently; failures are recorded per feed"""
+    results = sync_calendar_feeds(job.payload['feed_ids'], job.progress)
+    return {str(feed_id): {'error': str(result)} if isinstance(result, Exception) else result
+            for feed_id, result in results.items()}
+
+def sync_calendar_feed(feed_id):
+    """Sync one calendar feed (see sync_calendar_feeds) and return its result.
+
+    Fetch failures that retrying cannot fix raise JobError, others are re-raised.
+    """
+    results = sync_calendar_feeds([feed_id])
+    if feed_id not in results:
+        raise JobError(f'Calendar feed {feed_id} not found')
+    result = results[feed_id]
+    if isinstance(result, Exception):
+        if isinstance(result, IcsError) or (isinstance(result, FeedHTTPError) and not result.temporary):
+            raise JobError(str(result))
+        raise result
+    return result
+
+def sync_calendar_feeds(feed_ids, progress=None):
+    """Conditionally fetch calendar feeds and apply their new, changed and removed events.
+
+    Feeds are fetched concurrently without holding the writer, then applied
+    in one transaction.  Returns {feed id: result or exception}; a result is
+    {'status': 'not_modified' or 'updated', 'changed': n, 'removed': n,
+    'fetch_ms': ..., 'apply_ms': ...}.  Fetch failures are also recorded on
+    the feed row.
+    """
+    progress = progress or (lambda percent, message=None: None)
+    feed_ids = [int(feed_id) for feed_id in feed_ids]
+    if not feed_ids:
+        return {}
+    feeds = get_db().execute(
+        f'SELECT * FROM calendar_feeds WHERE id IN ({",".join("?" * len(feed_ids))})', feed_ids
+    ).fetchall()
+    fetched = fetch_feeds(feeds, tz=current_app.config.get('EVENTS_TIMEZONE'))
+    progress(50, f'Fetched {len(feeds)} feeds')
+    
+    db = get_db(write=True)
+    results = {}
+    event_ids = []
+    for feed in feeds:
+        fetch = fetched[feed['id']]
+        if isinstance(fetch, Exception):
+            record_feed_status(db, feed['id'], 'error', error=str(fetch))
+            results[feed['id']] = fetch
+            continue
+        result = {'status': fetch.status, 'changed': 0, 'removed': 0, 'fetch_ms': fetch.fetch_ms, 'apply_ms': 0}
+        results[feed['id']] = result
+        if fetch.status == 'not_modified':
+            record_feed_status(db, feed['id'], 'not_modified', fetch)
+            continue
+        
+        started = time.monotonic()
+        changed, hashes, removed = diff_feed(db, feed['id'], fetch.events)
+        event_ids += _import_ics_events(db, changed, feed['category_id'])
+        if removed:
+            # Events that left the feed are cancelled rather than deleted
+            db.execute(
+                f"""UPDATE events SET status = 'cancelled'
+                    WHERE status != 'cancelled' AND event_id IN ({','.join('?' * len(removed))})""",
+                removed
+            )
+            event_ids += removed
+        record_feed_events(db, feed['id'], hashes)
+        result.update(status='updated', changed=len(changed), removed=len(removed),
+                      apply_ms=int((time.monotonic() - started) * 1000))
+        record_feed_status(db, feed['id'], 'updated', fetch, result['apply_ms'], len(changed) + len(removed))
+    
+    conflicts = refresh_event_conflicts(db, event_ids)
+    db.commit()
+    publish_event_changes(db, 'updated', event_ids, conflicts)
+    return results
+
+# Auto-sync feeds with their schedule and last sync outcome
+@calendar_bp.route('/api/calendar-feeds')
+@login_required
+@role_required('admin', 'staff')
+def api_calendar_feeds():
+    """List calendar feeds with their sync status and timing"""
+    feeds = get_db().execute(f'SELECT {FEED_STATUS_COLUMNS} FROM calendar_feeds ORDER BY id').fetchall()
+    return jsonify([dict(feed) for feed in feeds])
+
+@calendar_bp.route('/calendar-feeds/<int:feed_id>/sync', methods=['POST'])
+@login_required
+@role_required('admin', 'staff')
+def sync_feed_now(feed_id):
+    """Queue an immediate sync of a calendar feed"""
+    db = get_db()
+    if db.execute('SELECT 1 FROM calendar_feeds WHERE id = ?', (feed_id,)).fetchone() is None:
+        abort(404)
+    job_id = enqueue(db, 'sync_feed', {'feed_id': feed_id}, session.get('user_id'))
+    return job_accepted(job_id, 'Feed sync queued', url_for('calendar.calendar'))
+
+def _feed_headers(response, revision, etag=None):
+    """Attach the feed revision (and validator) to a calendar feed response"""
+    if etag:
+        response.set_etag(etag)
+    response.headers['X-Events-Revision'] = str(revision)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 # API endpoint to get all events for the calendar
 @calendar_bp.route('/api/events')
@@ -597,141 +662,140 @@ def api_events():
     """API endpoint to get all events for the calendar, with filtering."""
     db = get_db()
 
-    # Base query
-    query = '''
-        SELECT e.*, 
-               c.name as client_name, 
-               c.color as client_color,
-               ec.name as category_name,
-               ec.color as category_color,
-               l.name as location_name
-        FROM events e 
-        LEFT JOIN clients c ON e.client_id = c.id
-        LEFT JOIN event_categories ec ON e.category_id = ec.id
-        LEFT JOIN locations l ON e.location_id = l.id
-    '''
-    
-    # --- Dynamic WHERE clause construction ---
-    conditions = []
-    params = []
-
-    # 1. Date Range Filtering (Required for calendar view)
-    start = request.args.get('start')
-    end = request.args.get('end')
-    if start and end:
-        # Improved logic: Include events that overlap with the requested date range
-        # An event is visible if its start date is before the view's end date,
-        # AND its end date (or event_date if no end_date) is after the view's start date
-        conditions.append('''
-            (e.event_date <= ? AND 
-             COALESCE(e.end_date, e.event_date) >= ?)
-        ''')
-        params.extend([end, start])
-
-    # 2. Category Filtering
-    categories = request.args.get('categories')
-    if categories:
-        category_ids = [cat.strip() for cat in categories.split(',') if cat.strip()]
-        if category_ids:
-            placeholders = ','.join(['?'] * len(category_ids))
-            # Include events with NULL category_id OR matching category_id
-            conditions.append(f"(e.category_id IS NULL OR e.category_id IN ({placeholders}))")
-            params.extend(category_ids)
-
-    # 3. Status Filtering
-    statuses = request.args.get('statuses')
-    if statuses:
-        status_list = [stat.strip() for stat in statuses.split(',') if stat.strip()]
-        if status_list:
-            placeholders = ','.join(['?'] * len(status_list))
-            conditions.append(f"e.status IN ({placeholders})")
-            params.extend(status_list)
-
-    # 4. Client Filtering
-    client_id = request.args.get('client_id')
-    if client_id and client_id != 'all':
-        conditions.append("e.client_id = ?")
-        params.append(client_id)
-
-    # 5. Conflicts Only Filtering
-    conflicts_only = request.args.get('conflicts_only')
-    if conflicts_only and conflicts_only.lower() == 'true':
-        conditions.append("e.has_conflicts = 1")
-
-    # --- Assemble the final query ---
-    if conditions:
-        query += " WHERE " + " AND ".join(conditions)
-    
-    query += ' ORDER BY e.event_date'
-    
-    events = db.execute(query, params).fetchall()
-    
-    # Convert to list of dicts for JSON serialization
+    # Conditional GET: nothing changed since the client's copy, skip the events query
+    revision = current_revision(db)
+    etag = events_etag(revision, request.args)
+    if request.if_none_match.contains(etag):
+        return _feed_headers(Response(status=304), revision, etag)
+
+    try:
+        conditions, params = event_feed_filters(db, request.args)
+        # Recurring series are expanded for the requested window only
+        occurrences = fetch_series_feed(db, request.args)
+    except ValueError:
+        return jsonify({'error': 'Invalid date range'}), 400
+
+    # Large ranges are streamed in batches instead of being built in memory;
+    # ?stream=1 / ?stream=0 overrides the row-count threshold
+    stream = request.args.get('stream', '').lower()
+    if stream in ('1', 'true'):
+        streaming = True
+    elif stream in ('0', 'false'):
+        streaming = False
+    else:
+        threshold = current_app.config.get('EVENTS_STREAM_THRESHOLD', 2000)
+        streaming = count_event_feed(db, conditions, params) + len(occurrences) > threshold
+    
+    if streaming:
+        chunks = stream_event_feed(db, conditions, params,
+                                   current_app.config.get('EVENTS_STREAM_BATCH_SIZE', 500), occurrences)
+        # Keep the request context (and its database connection) until the last chunk
+        response = Response(stream_with_context(chunks), mimetype='application/json')
+        return _feed_headers(response, revision, etag)
+    
+    events_list = serialize_event_feed(fetch_event_feed(db, conditions, params)) + occurrences
+    
+    return _feed_headers(json_response(events_list), revision, etag)
+
+# API endpoint returning only what changed since a feed revision
+@calendar_bp.route('/api/events/changes')
+@login_required
+def api_event_changes():
+    """API endpoint to get events created, updated or deleted since a revision"""
+    db = get_db()
+    
+    try:
+        since = int(request.args.get('since', ''))
+    except ValueError:
+        return jsonify({'error': 'since must be a revision number'}), 400
+    
+    # Read the token first: anything written afterwards is picked up by the next sync
+    revision = current_revision(db)
+    if since < 0 or since > revision:
+        # Unknown token (e.g. the database was restored), the client must reload
+        return _feed_headers(jsonify({'revision': revision, 'reset': True, 'events': [], 'deleted': []}), revision)
+    
+    try:
+        conditions, params = event_feed_filters(db, request.args)
+    except ValueError:
+        return jsonify({'error': 'Invalid date range'}), 400
+    
+    changed_ids = {row[0] for row in db.execute('SELECT event_id FROM events WHERE revision > ?', (since,))}
+    
     events_list = []
-    for event in events:
-        # Basic event details
-        # Handle time formatting - add seconds if missing
-        start_time = event['drop_off_time'] or '00:00:00'
-        if start_time and len(start_time) == 5:  # Format is HH:MM
-            start_time += ':00'
-        
-        event_dict = {
-            'id': event['event_id'],
-            'title': event['event_name'],
-            'start': f"{event['event_date']}T{start_time}",
-            'color': event['category_color'] or event['client_color'] or '#3788d8',
-            'textColor': '#ffffff',
-            'borderColor': event['client_color'] or '#3788d8',
-            'url': url_for('calendar.view_event', event_id=event['event_id']),
-            'allDay': bool(event['is_all_day'])
-        }
-        
-        # Add end date if it exists
-        if event['end_date']:
-            # For all-day events, FullCalendar needs exclusive end date
-            if event['is_all_day']:
-                # Parse end_date and add 1 day
-                end_date = datetime.strptime(event['end_date'], '%Y-%m-%d')
-                end_date = end_date + timedelta(days=1)
-                event_dict['end'] = end_date.strftime('%Y-%m-%d')
-            else:
-                event_dict['end'] = f"{event['end_date']}T{event['pickup_time'] or '23:59:59'}"
-        elif event['pickup_time']:
-            # Single-day event with end time
-            end_time = event['pickup_time']
-            if end_time and len(end_time) == 5:  # Format is HH:MM
-                end_time += ':00'
-            event_dict['end'] = f"{event['event_date']}T{end_time}"
-        
-        # Add classes for styling
-        classNames = []
-        if event['status']:
-            classNames.append(f"event-{event['status']}")
-        if event['has_conflicts']:
-            classNames.append('event-conflict')
-        if event['is_recurring']:
-            classNames.append('event-recurring')
-        
-        if classNames:
-            event_dict['classNames'] = classNames
-        
-        # Add extended properties
-        event_dict['extendedProps'] = {
-            'client_id': event['client_id'],
-            'client_name': event['client_name'],
-            'category_id': event['category_id'],
-            'category_name': event['category_name'],
-            'location': event['event_location'] or event['location_name'],
-            'location_id': event['location_id'],
-            'status': event['status'],
-            'is_recurring': bool(event['is_recurring']),
-            'has_conflicts': bool(event['has_conflicts']),
-            'parent_event_id': event['parent_event_id']
-        }
-        
-        events_list.append(event_dict)
+    if changed_ids:
+        events_list = serialize_event_feed(
+            fetch_event_feed(db, ['e.revision > ?'] + conditions, [since] + params))
+        # A changed series is sent whole: the client replaces every occurrence of it
+        events_list += fetch_series_feed(db, request.args, ['e.revision > ?'], [since])
+    
+    # Deleted events, plus changed events that no longer match the client's filters.
+    # Clients drop the occurrences of a deleted series id as well.
+    deleted = {row[0] for row in db.execute(
+        'SELECT event_id FROM event_tombstones WHERE revision > ?', (since,))}
+    deleted |= changed_ids - {event['extendedProps'].get('series_id', event['id']) for event in events_list}
+    
+    return _feed_headers(json_response({
+        'revision': revision,
+        'reset': False,
+        'events': events_list,
+        'deleted': sorted(deleted)
+    }), revision)
+
+def publish_event_changes(db, kind, event_ids, conflicts=None):
+    """Notify live calendars about committed changes to event_ids.
+
+    conflicts is the result of refresh_event_conflicts; events that now have
+    conflicts and their counterparts get a separate 'conflicts' notification.
+    """
+    event_ids = {int(event_id) for event_id in event_ids if event_id is not None}
+    if not event_ids:
+        return
+    revision = current_revision(db)
+    event_bus.publish(kind, event_ids, revision)
     
-    return jsonify(events_list)
+    conflicted = set()
+    for event_id, event_conflicts in (conflicts or {}).items():
+        if event_conflicts:
+            conflicted.add(event_id)
+            conflicted.update(conflict['conflict_event_id'] for conflict in event_conflicts)
+    if conflicted:
+        event_bus.publish('conflicts', conflicted, revision)
+
+def _sse_message(message):
+    """Format a bus notification as a server-sent event"""
+    return f"id: {message['revision']}\nevent: {message['type']}\ndata: {json.dumps(message)}\n\n"
+
+# Server-sent events stream of calendar changes
+@calendar_bp.route('/api/events/stream')
+@login_required
+def api_event_stream():
+    """Push change notifications to an open calendar (text/event-stream)"""
+    # Everything the stream needs is read here: the generator runs after the
+    # request context (and its database connection) has been released
+    revision = current_revision(get_db())
+    heartbeat = current_app.config.get('SSE_HEARTBEAT_SECONDS', 15)
+    
+    def stream():
+        subscriber = event_bus.subscribe()
+        try:
+            # Tell the client where the stream starts so it can sync anything it missed
+            yield 'retry: 5000\n' + _sse_message({'type': 'ready', 'event_ids': [], 'revision': revision})
+            while True:
+                try:
+                    message = subscriber.get(timeout=heartbeat)
+                except queue.Empty:
+                    # Comment line keeps proxies from closing an idle connection
+                    yield ': keep-alive\n\n'
+                    continue
+                yield _sse_message(message)
+        finally:
+            event_bus.unsubscribe(subscriber)
+    
+    response = Response(stream(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Disable nginx response buffering
+    return response
 
 # API endpoint to quickly add an event from the calendar
 @calendar_bp.route('/api/events/quick_add', methods=['POST'])
@@ -763,9 +827,11 @@ def api_quick_add_event():
                VALUES (?, ?, ?, ?, ?, ?, ?)''',
             (event_name, client_id, category_id, event_date, location_id, 'booked', str(uuid.uuid4()))
         )
-        db.commit()
-        
         event_id = cursor.lastrowid
+        refreshed = refresh_event_conflicts(db, [event_id])
+        db.commit()
+        publish_event_changes(db, 'created', [event_id], refreshed)
+        conflicts = refreshed[event_id]
         
         # Get the newly created event
         event = db.execute(
@@ -791,14 +857,16 @@ def api_quick_add_event():
             'extendedProps': {
                 'client_id': event['client_id'],
                 'client_name': event['client_name'],
-                'status': event['status']
+                'status': event['status'],
+                'has_conflicts': bool(conflicts)
             }
         }
         
         return jsonify({
             'success': True, 
             'message': 'Event created successfully',
-            'event': event_data
+            'event': event_data,
+            'conflicts': conflicts
         })
         
     except sqlite3.Error as db_err:
@@ -814,12 +882,16 @@ def api_quick_add_event():
 def api_update_event_dates():
     """API endpoint to update event dates/times when moved on calendar"""
     try:
-        event_id = request.form['event_id']
         start_date = request.form['start_date']
         end_date = request.form.get('end_date')
         start_time = request.form.get('start_time')
         end_time = request.form.get('end_time')
         recurrence_edit = request.form.get('recurrence_edit', 'single')
+        try:
+            # Occurrences of a recurring series arrive as '<series id>_<date>'
+            event_id, occurrence = parse_event_id(request.form['event_id'])
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Invalid event id'}), 400
         
         db = get_db()
         
@@ -830,40 +902,18 @@ def api_update_event_dates():
             return jsonify({'success': False, 'message': 'Event not found'}), 404
         
         # Update logic depends on whether this is a recurring event
-        if event['is_recurring'] and recurrence_edit != 'single':
-            if recurrence_edit == 'all':
-                # Update all instances
-                events_to_update = db.execute(
-                    'SELECT event_id FROM events WHERE event_id = ? OR parent_event_id = ?',
-                    (event_id, event_id)
-                ).fetchall()
-                
-                for e in events_to_update:
-                    db.execute(
-                        '''UPDATE events SET 
-                           event_date = ?, end_date = ?, drop_off_time = ?, pickup_time = ?
-                           WHERE event_id = ?''',
-                        (start_date, end_date, start_time, end_time, e['event_id'])
-                    )
-            elif recurrence_edit == 'future':
-                # Get the original date of the current event
-                original_date = event['event_date']
-                
-                # Update this event and all future events in the series
-                events_to_update = db.execute(
-                    '''SELECT event_id FROM events 
-                       WHERE (event_id = ? OR parent_event_id = ?) 
-                       AND event_date >= ?''',
-                    (event_id, event_id, original_date)
-                ).fetchall()
-                
-                for e in events_to_update:
-                    db.execute(
-                        '''UPDATE events SET 
-                           event_date = ?, end_date = ?, drop_off_time = ?, pickup_time = ?
-                           WHERE event_id = ?''',
-                        (start_date, end_date, start_time, end_time, e['event_id'])
-                    )
+        updated_ids = [event['event_id']]
+        moved_id = event['event_id']
+        if occurrence and recurrence_edit == 'single':
+            # Detach the occurrence from its series as an exception row
+            moved_id = _create_series_exception(db, event_id, occurrence, start_date, end_date,
+                                                start_time, end_time)
+            updated_ids = [event_id, moved_id]
+        elif recurrence_edit in ('all', 'future') and (event['is_recurring'] or event['parent_event_id']):
+            series_id, updated_ids = _move_series(db, event, occurrence, recurrence_edit, start_date,
+                                                  end_date, start_time, end_time)
+            if event['is_recurring']:
+                moved_id = series_id
         else:
             # Just update this single event
             db.execute(
@@ -873,26 +923,16 @@ def api_update_event_dates():
                 (start_date, end_date, start_time, end_time, event_id)
             )
         
-        # Now check for conflicts
-        conflicts = check_event_conflicts(db, event_id, start_date, end_date)
-        if conflicts:
-            # Mark event as having conflicts
-            db.execute('UPDATE events SET has_conflicts = 1 WHERE event_id = ?', (event_id,))
-            
-            # Record the specific conflicts
-            for conflict in conflicts:
-                db.execute(
-                    '''INSERT INTO event_conflicts 
-                       (event_id, conflicting_event_id, conflict_type)
-                       VALUES (?, ?, ?)''',
-                    (event_id, conflict['conflict_event_id'], conflict['conflict_type'])
-                )
-        
+        # Now bring the stored conflicts of the moved events and their neighbours up to date
+        refreshed = refresh_event_conflicts(db, updated_ids)
         db.commit()
+        publish_event_changes(db, 'updated', updated_ids, refreshed)
+        conflicts = refreshed[moved_id]
         
         return jsonify({
             'success': True, 
             'message': 'Event dates updated successfully',
+            'event_id': moved_id,
             'has_conflicts': bool(conflicts),
             'conflicts': conflicts
         })
@@ -900,13 +940,75 @@ def api_update_event_dates():
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+def _move_series(db, event, occurrence, recurrence_edit, start_date, end_date, start_time, end_time):
+    """Shift all or the future occurrences of event's series like the dragged one.
+
+    event is the series master (when an occurrence was dragged) or one of
+    its exception rows.  Every row moves by the same relative delta, so the
+    series keeps its rhythm; 'future' first splits the series at the
+    dragged occurrence.  Returns (id of the moved series, ids of every row
+    written).
+    """
+    if event['is_recurring']:
+        series_id = event['event_id']
+        old_date = occurrence or event['event_date']
+        old_end_date = (datetime.fromisoformat(old_date) + timedelta(days=event['span_days'] or 0)).date().isoformat()
+        pivot = old_date
+    else:
+        series_id = event['parent_event_id']
+        old_date = event['event_date']
+        old_end_date = event['end_date'] or old_date
+        pivot = event['original_start_date'] or old_date
+
+    start_shift = time_shift(old_date, event['drop_off_time'], start_date, start_time)
+    end_shift = start_shift
+    if end_date or end_time:
+        end_shift = time_shift(old_end_date, event['pickup_time'], end_date or old_end_date, end_time)
+
+    moved_ids = []
+    series = db.execute('SELECT event_date FROM events WHERE event_id = ?', (series_id,)).fetchone()
+    if recurrence_edit == 'future' and series and pivot > series['event_date']:
+        # The occurrences before the pivot stay where they are
+        moved_ids.append(series_id)
+        series_id = split_series(db, series_id, pivot, str(uuid.uuid4()), session.get('user_id'))
+    return series_id, moved_ids + shift_series(db, series_id, start_shift, end_shift, session.get('user_id'))
+
+def _create_series_exception(db, series_id, occurrence, start_date, end_date, start_time, end_time):
+    """Store one occurrence of a series as its own event with new dates; returns its id.
+
+    The exception copies the series details and equipment, and its
+    original_start_date stops the series from expanding that occurrence.
+    """
+    cursor = db.execute(
+        '''INSERT INTO events
+           (event_name, client_id, category_id, template_id, ics_uid, event_date, end_date,
+            drop_off_time, pickup_time, is_all_day, parent_event_id, original_start_date,
+            manager, onsite_contact, onsite_contact_phone, event_location, location_id,
+            items_needed, boxes_from_pi, notes, status, created_by)
+           SELECT event_name, client_id, category_id, template_id, ?, ?, ?,
+                  ?, ?, is_all_day, event_id, ?,
+                  manager, onsite_contact, onsite_contact_phone, event_location, location_id,
+                  items_needed, boxes_from_pi, notes, status, ?
+           FROM events WHERE event_id = ?''',
+        (str(uuid.uuid4()), start_date, end_date, start_time, end_time, occurrence,
+         session.get('user_id'), series_id)
+    )
+    exception_id = cursor.lastrowid
+    db.execute(
+        '''INSERT INTO equipment_assignments (event_id, equipment_id, quantity, assigned_by)
+           SELECT ?, equipment_id, quantity, ? FROM equipment_assignments WHERE event_id = ?''',
+        (exception_id, session.get('user_id'), series_id)
+    )
+    return exception_id
+
 # API endpoint to check for equipment/location conflicts
 @calendar_bp.route('/api/events/check_conflicts', methods=['POST'])
 @login_required
 def api_check_event_conflicts():
     """API endpoint to check for equipment/location conflicts"""
     try:
-        event_id = request.form['event_id']
+        # An occurrence of a series is checked with its series' resources
+        event_id, _ = parse_event_id(request.form['event_id'])
         start_date = request.form['start_date']
         end_date = request.form.get('end_date')
         
@@ -921,76 +1023,43 @@ def api_check_event_conflicts():
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
-# Helper function to check for event conflicts
-def check_event_conflicts(db, event_id, start_date, end_date=None):
-    """Check for equipment/location conflicts for an event"""
-    if not end_date:
-        end_date = start_date
+# API endpoint to rebuild conflict state for a date range
+@calendar_bp.route('/api/admin/conflicts/recompute', methods=['POST'])
+@login_required
+@role_required('admin')
+def api_recompute_conflicts():
+    """API endpoint to recompute event_conflicts and has_conflicts in bulk"""
+    try:
+        start_date = request.form.get('start_date') or None
+        end_date = request.form.get('end_date') or None
         
-    # Find events that overlap with the given date range
-    overlapping_events = db.execute(
-        '''SELECT event_id FROM events 
-           WHERE event_id != ? AND 
-                 (
-                     (event_date BETWEEN ? AND ?) OR
-                     (end_date BETWEEN ? AND ?) OR
-                     (event_date <= ? AND (end_date IS NULL OR end_date >= ?))
-                 ) AND
-                 status != 'cancelled' ''',
-        (event_id, start_date, end_date, start_date, end_date, start_date, start_date)
-    ).fetchall()
-    
-    conflicts = []
-    
-    # Check for equipment conflicts
-    # Get equipment assigned to this event
-    event_equipment = db.execute(
-        'SELECT equipment_id FROM equipment_assignments WHERE event_id = ?',
-        (event_id,)
-    ).fetchall()
-    
-    for equipment in event_equipment:
-        equipment_id = equipment['equipment_id']
+        db = get_db()
+        summary = recompute_conflicts(db, start_date, end_date)
         
-        # Check if any overlapping events use this equipment
-        for other_event in overlapping_events:
-            other_id = other_event['event_id']
-            
-            conflict = db.execute(
-                'SELECT 1 FROM equipment_assignments WHERE event_id = ? AND equipment_id = ?',
-                (other_id, equipment_id)
-            ).fetchone()
-            
-            if conflict:
-                conflicts.append({
-                    'conflict_event_id': other_id,
-                    'conflict_type': 'equipment',
-                    'equipment_id': equipment_id
-                })
-    
-    # Check for location conflicts
-    event = db.execute('SELECT location_id FROM events WHERE event_id = ?', (event_id,)).fetchone()
-    
-    if event and event['location_id']:
-        location_id = event['location_id']
+        # Conflict flags may have changed anywhere in the range
+        flagged = [row[0] for row in db.execute('SELECT event_id FROM events WHERE has_conflicts = 1')]
+        if flagged:
+            event_bus.publish('conflicts', flagged, current_revision(db))
         
-        # Check if any overlapping events use this location
-        for other_event in overlapping_events:
-            other_id = other_event['event_id']
-            
-            conflict = db.execute(
-                'SELECT 1 FROM events WHERE event_id = ? AND location_id = ?',
-                (other_id, location_id)
-            ).fetchone()
-            
-            if conflict:
-                conflicts.append({
-                    'conflict_event_id': other_id,
-                    'conflict_type': 'location',
-                    'location_id': location_id
-                })
-    
-    return conflicts
+        return jsonify({'success': True, **summary})
+        
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+def _recurrence_from_form(form, event_date):
+    """Read (is_recurring, recurrence_pattern, recurrence_end_date) from an event form.
+
+    Returns an error message instead when the recurrence settings are invalid.
+    """
+    if not form.get('is_recurring'):
+        return (0, None, None), None
+    pattern = form.get('recurrence_pattern')
+    if pattern not in RECURRENCE_PATTERNS:
+        return None, 'Choose how often the event repeats'
+    end_date = form.get('recurrence_end_date') or None
+    if end_date and end_date < event_date:
+        return None, 'End recurrence must be on or after the event date'
+    return (1, pattern, end_date), None
 
 # Event routes
 @calendar_bp.route('/events/new', methods=['GET', 'POST'])
@@ -1058,32 +1127,31 @@ def new_event():
             error = 'Client is required'
         elif not event_date:
             error = 'Event date is required'
+        else:
+            recurrence, error = _recurrence_from_form(request.form, event_date)
         
         if error is not None:
             flash(error, 'danger')
         else:
-            # Create the event with template reference if used
+            # Create the event with template reference if used; a recurring
+            # event is a single series row expanded when the calendar is shown
             cursor = db.execute(
                 '''INSERT INTO events 
                    (event_name, client_id, category_id, event_date, drop_off_time, 
-                    pickup_time, event_location, status, notes, template_id) 
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                    pickup_time, event_location, status, notes, template_id,
+                    is_recurring, recurrence_pattern, recurrence_end_date) 
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
                 (title, client_id, category_id, event_date, drop_off_time, 
-                 pick_up_time, location, status, notes, template_id)
+                 pick_up_time, location, status, notes, template_id, *recurrence)
             )
             event_id = cursor.lastrowid
             
             # Add equipment assignments
+            windows = occurrence_windows(event_date, None, *recurrence[1:])
+            availability = AvailabilityIndex.load_windows(db, windows, exclude_event_id=event_id)
             for eq_id, qty in equipment_qtys.items():
-                # Verify there's enough available equipment
-                available = db.execute(
-                    '''SELECT (e.quantity - COALESCE(
-                           (SELECT SUM(ea.quantity) FROM equipment_assignments ea 
-                            WHERE ea.equipment_id = e.id), 0)
-                       ) as available
-                       FROM equipment e WHERE e.id = ?''',
-                    (eq_id,)
-                ).fetchone()['available']
+                # Verify there's enough equipment free on the event date (every date of a series)
+                available = availability.free_during(eq_id, windows)
                 
                 if available >= qty:
                     db.execute(
@@ -1102,7 +1170,11 @@ def new_event():
                             (event_id, eq_id, available)
                         )
             
+            refreshed = refresh_event_conflicts(db, [event_id])
             db.commit()
+            publish_event_changes(db, 'created', [event_id], refreshed)
+            if refreshed[event_id]:
+                flash('Warning: this event conflicts with other bookings', 'warning')
             flash('Event created successfully', 'success')
             return redirect(url_for('calendar.calendar'))
     
@@ -1115,15 +1187,15 @@ def new_event():
            LEFT JOIN event_categories c ON t.category_id = c.id
            ORDER BY t.name'''
     ).fetchall()
-    equipment_list = db.execute(
-        '''SELECT e.*, 
-           (e.quantity - COALESCE(
-               (SELECT SUM(ea.quantity) FROM equipment_assignments ea 
-                WHERE ea.equipment_id = e.id), 0)
-           ) as assigned
-           FROM equipment e 
-           ORDER BY e.name'''
-    ).fetchall()
+    # Equipment with units free on the requested date (defaults to today)
+    availability_date = request.args.get('event_date') or datetime.now().strftime('%Y-%m-%d')
+    availability = AvailabilityIndex.load(db, availability_date, availability_date)
+    free_units = availability.free_all(availability_date)
+    equipment_list = []
+    for item in db.execute('SELECT * FROM equipment ORDER BY name').fetchall():
+        equipment_item = dict(item)
+        equipment_item['available'] = free_units.get(item['id'], 0)
+        equipment_list.append(equipment_item)
     
     # Pre-select client if passed in query param
     selected_client = request.args.get('client_id')
@@ -1206,14 +1278,18 @@ def edit_event(event_id):
             error = 'Client is required'
         elif not event_date:
             error = 'Event date is required'
+        else:
+            recurrence, error = _recurrence_from_form(request.form, event_date)
         
         if error is not None:
             flash(error, 'danger')
         else:
             db.execute(
                 'UPDATE events SET event_name = ?, client_id = ?, event_date = ?, drop_off_time = ?, '
-                'pickup_time = ?, event_location = ?, status = ? WHERE event_id = ?',
-                (event_name, client_id, event_date, drop_off_time, pickup_time, event_location, status, event_id)
+                'pickup_time = ?, event_location = ?, status = ?, '
+                'is_recurring = ?, recurrence_pattern = ?, recurrence_end_date = ? WHERE event_id = ?',
+                (event_name, client_id, event_date, drop_off_time, pickup_time, event_location, status,
+                 *recurrence, event_id)
             )
             
             # Update equipment assignments
@@ -1221,16 +1297,12 @@ def edit_event(event_id):
             db.execute('DELETE FROM equipment_assignments WHERE event_id = ?', (event_id,))
             
             # Add new equipment assignments
+            window_end = event['end_date'] if event['end_date'] and event['end_date'] > event_date else event_date
+            windows = occurrence_windows(event_date, window_end, *recurrence[1:])
+            availability = AvailabilityIndex.load_windows(db, windows, exclude_event_id=event_id)
             for eq_id, qty in equipment_qtys.items():
-                # Verify there's enough available equipment
-                available = db.execute(
-                    '''SELECT (e.quantity - COALESCE(
-                           (SELECT SUM(ea.quantity) FROM equipment_assignments ea 
-                            WHERE ea.equipment_id = e.id AND ea.event_id != ?), 0)
-                       ) as available
-                       FROM equipment e WHERE e.id = ?''',
-                    (event_id, eq_id)
-                ).fetchone()['available']
+                # Verify there's enough equipment free for the event's dates (every occurrence of a series)
+                available = availability.free_during(eq_id, windows)
                 
                 if available >= qty:
                     db.execute(
@@ -1249,7 +1321,11 @@ def edit_event(event_id):
                             (event_id, eq_id, available)
                         )
             
+            refreshed = refresh_event_conflicts(db, [event_id])
             db.commit()
+            publish_event_changes(db, 'updated', [event_id], refreshed)
+            if refreshed[event_id]:
+                flash('Warning: this event conflicts with other bookings', 'warning')
             
             # If status is changed to completed, generate an invoice
             if status == 'completed' and event['status'] != 'completed':
@@ -1271,17 +1347,12 @@ def edit_event(event_id):
     # Get clients for the dropdown
     clients = db.execute('SELECT * FROM clients').fetchall()
     
-    # Get equipment with availability info
-    equipment = db.execute(
-        '''SELECT e.*,
-           (e.quantity - COALESCE(
-               (SELECT SUM(ea.quantity) FROM equipment_assignments ea 
-                WHERE ea.equipment_id = e.id AND ea.event_id != ?), 0)
-           ) as available_qty
-           FROM equipment e 
-           ORDER BY e.name''',
-        (event_id,)
-    ).fetchall()
+    # Get equipment with units free for the event's dates (excluding this event's own assignments)
+    window_start = event['event_date'] or datetime.now().strftime('%Y-%m-%d')
+    window_end = event['end_date'] or window_start
+    availability = AvailabilityIndex.load(db, window_start, window_end, exclude_event_id=event_id)
+    free_units = availability.free_all(window_start, window_end)
+    equipment = db.execute('SELECT * FROM equipment ORDER BY name').fetchall()
     
     # Get current equipment assignments for this event
     current_assignments = db.execute(
@@ -1293,6 +1364,7 @@ def edit_event(event_id):
     equipment_list = []
     for item in equipment:
         equipment_item = dict(item)
+        equipment_item['available_qty'] = free_units.get(item['id'], 0)
         equipment_item['assigned_to_event'] = False
         equipment_item['assigned_qty'] = 0
         
@@ -1313,7 +1385,9 @@ def delete_event(event_id):
     """Delete an event"""
     db = get_db()
     db.execute('DELETE FROM events WHERE event_id = ?', (event_id,))
+    refresh_event_conflicts(db, [event_id])
     db.commit()
+    publish_event_changes(db, 'deleted', [event_id])
     flash('Event deleted successfully', 'success')
     return redirect(url_for('calendar.calendar'))
 
@@ -1453,89 +1527,44 @@ def import_sample_events():
     """Import sample events from the ICS_EVENTS data"""
     print("Starting sample ICS event import...")
     
-    # Get database connection
-    db = get_db()
+    # Get database connection (this also runs from a GET route, so ask for the writer)
+    db = get_db(write=True)
     
-    # Query clients table to create a mapping of names to IDs
+    # Client names in the descriptions are resolved by name, initials or alias
     clients = db.execute("SELECT id, name FROM clients").fetchall()
+    clients_by_name = client_index(db)
     
-    # Create client name to ID mapping
-    client_map = {}
-    for client in clients:
-        # Store both exact match and lowercase version for case-insensitive lookup
-        client_map[client['name']] = client['id']
-        client_map[client['name'].lower()] = client['id']
-        
-        # Also add common abbreviations/aliases
-        if 'robert wood johnson' in client['name'].lower() or 'rwj' in client['name'].lower():
-            client_map['RWJ'] = client['id']
-            client_map['rwj'] = client['id']
-            client_map['Robert Wood Johnson'] = client['id']
-        
-        if 'horizon' in client['name'].lower():
-            client_map['Horizon'] = client['id']
-            client_map['horizon'] = client['id']
-            
     print(f"Found {len(clients)} clients in the database")
     
-    # Map ICS status to database status
-    status_map = {
-        'CONFIRMED': 'confirmed',
-        'TENTATIVE': 'booked',
-        'CANCELLED': 'cancelled'
-    }
-    
-    # Parse the ICS string using ics library
-    calendar = ics.Calendar(ICS_EVENTS)
-    events = list(calendar.events)
+    # Parse the ICS string
+    events = list(read_vevents(ICS_EVENTS, current_app.config.get('EVENTS_TIMEZONE')))
     
     print(f"Found {len(events)} events in the ICS data")
     
     # Initialize counters
     inserted_count = 0
     updated_count = 0
+    imported_ids = []
     
     # Insert or update events in the database
     for ics_event in events:
         # Extract event details
-        summary = ics_event.name
+        summary = ics_event.summary
         uid = ics_event.uid
         
         print(f"Processing event: {summary} (UID: {uid})")
         
-        # Extract dates and times
-        start_date = ics_event.begin.date().strftime('%Y-%m-%d')
-        start_time = ics_event.begin.time().strftime('%H:%M:%S')
+        # Dates and times (all-day events have no times and an inclusive end date)
+        start_date = ics_event.start_date
+        start_time = ics_event.start_time
+        is_all_day = ics_event.all_day
+        end_time = ics_event.end_time
         
-        # Determine if all day event (no time component or duration is 24 hours)
-        is_all_day = False
-        if ics_event.all_day:
-            is_all_day = True
-            start_time = None
+        # Same day event - no need for end_date
+        end_date = ics_event.end_date if ics_event.end_date != start_date else None
         
-        # Handle end date/time
-        end_date = None
-        end_time = None
-        if ics_event.end:
-            end_date = ics_event.end.date().strftime('%Y-%m-%d')
-            end_time = ics_event.end.time().strftime('%H:%M:%S')
-            
-            # Check if this is a multi-day event
-            if end_date != start_date:
-                # For multi-day events in FullCalendar:
-                # - Regular events: Use the actual end date and time
-                # - All-day events: End date is exclusive, so subtract 1 day for storage
-                if is_all_day:
-                    # Convert to datetime, subtract a day, convert back to string
-                    end_date_obj = datetime.strptime(end_date, '%Y-%m-%d')
-                    end_date_obj = end_date_obj - timedelta(days=1)
-                    end_date = end_date_obj.strftime('%Y-%m-%d')
-            else:
-                # Same day event - no need for end_date
-                end_date = None
-        
-        location = str(ics_event.location) if ics_event.location else ''
-        description = str(ics_event.description) if ics_event.description else ''
+        location = ics_event.location or ''
+        description = ics_event.description or ''
         
         # Extract client information from description
         client_id = None  # Default to None
@@ -1544,8 +1573,8 @@ def import_sample_events():
             client_part = description.split('Client:')[1].strip()
             client_name = client_part.split(';')[0].strip() if ';' in client_part else client_part
             
-            # Look up client ID by name (case-insensitive)
-            client_id = client_map.get(client_name) or client_map.get(client_name.lower())
+            # Look up client ID by name, initials or alias (case-insensitive)
+            client_id = clients_by_name.resolve(client_name)
             
             if not client_id:
                 print(f"Client not found for name: {client_name}")
@@ -1555,8 +1584,7 @@ def import_sample_events():
                     print(f"Using first client (ID: {client_id}) as fallback")
         
         # Determine status from ICS event status
-        ics_status = getattr(ics_event, 'status', None)
-        status = status_map.get(str(ics_status), 'booked') if ics_status else 'booked'
+        status = ICS_STATUSES.get(ics_event.status, 'booked')
         
         # Check if event with this UID already exists using the ics_uid field
         existing_event = db.execute("SELECT event_id FROM events WHERE ics_uid = ?", (uid,)).fetchone()
@@ -1591,13 +1619,14 @@ def import_sample_events():
                     1 if is_all_day else 0,
                     uid
                 ))
+                imported_ids.append(existing_event['event_id'])
                 updated_count += 1
                 print(f"Updated existing event: {summary}")
             except Exception as e:
                 print(f"Error updating event: {e}")
         else:
             # Insert new event
-            db.execute("""
+            cursor = db.execute("""
                 INSERT INTO events (
                   event_name, 
                   event_date, 
@@ -1624,11 +1653,16 @@ def import_sample_events():
                 1 if is_all_day else 0,
                 uid
             ))
+            imported_ids.append(cursor.lastrowid)
             inserted_count += 1
             print(f"Inserted new event: {summary}")
     
+    # Bring stored conflicts up to date for everything that was touched
+    conflicts = refresh_event_conflicts(db, imported_ids)
+    
     # Commit changes
     db.commit()
+    publish_event_changes(db, 'updated', imported_ids, conflicts)
     
     print(f"Import complete: {inserted_count} events inserted, {updated_count} events updated.")
     return inserted_count + updated_count
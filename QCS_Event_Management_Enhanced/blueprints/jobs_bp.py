@@ -0,0 +1,44 @@
+# Background Job Status Routes Blueprint
+from flask import Blueprint, jsonify, session, url_for, Response
+
+# Create the blueprint
+jobs_bp = Blueprint('jobs', __name__, url_prefix='')
+
+# Import helpers from the helpers module
+from helpers import get_db, login_required, get_current_user
+from jobs import job_status
+
+def _visible_job(job_id):
+    """Status of job_id if the current user queued it (admins see every job), else None"""
+    job = job_status(get_db(), job_id)
+    if job is None or job['created_by'] == session.get('user_id'):
+        return job
+    user = get_current_user()
+    return job if user and user['role'] == 'admin' else None
+
+@jobs_bp.route('/jobs/<int:job_id>')
+@login_required
+def job_status_api(job_id):
+    """Status, progress and result of a background job"""
+    job = _visible_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    
+    if job['has_output'] and job['status'] == 'succeeded':
+        job['output_url'] = url_for('jobs.job_output', job_id=job_id)
+    return jsonify({'success': True, **job})
+
+@jobs_bp.route('/jobs/<int:job_id>/output')
+@login_required
+def job_output(job_id):
+    """Download the file a finished job produced"""
+    job = _visible_job(job_id)
+    if job is None or job['status'] != 'succeeded' or not job['has_output']:
+        return jsonify({'success': False, 'message': 'Job output not available'}), 404
+    
+    output = get_db().execute(
+        'SELECT output, output_mimetype, output_filename FROM jobs WHERE id = ?', (job_id,)
+    ).fetchone()
+    return Response(output['output'], mimetype=output['output_mimetype'], headers={
+        'Content-Disposition': f"inline; filename={output['output_filename']}"
+    })
@@ -0,0 +1,124 @@
+# Client Name Index
+#
+# Resolves the client names found in imported data (CSV rows, ICS
+# descriptions) with a dict lookup.  Every client is reachable by its name
+# (case and spacing ignored), by its initials ("rwj" for "Robert Wood
+# Johnson") and by the aliases kept in client_aliases, which are edited on
+# the client form.  Names win over aliases, aliases over initials, and the
+# lowest client id wins a tie.
+#
+# The index is cached per process and rebuilt only when the 'clients'
+# revision in sync_state moves; triggers bump it on every client or alias
+# change (migration 7), so checking freshness is one primary-key lookup.
+import threading
+
+from revisions import current_revision
+
+
+def normalize_name(name):
+    """Lookup key for a client name or alias"""
+    return ' '.join((name or '').lower().split())
+
+
+def initials(name):
+    """'robert wood johnson' -> 'rwj'; None for single-word names"""
+    parts = normalize_name(name).split()
+    return ''.join(part[0] for part in parts) if len(parts) > 1 else None
+
+
+def parse_aliases(value):
+    """Aliases entered on the client form (comma or newline separated), without duplicates"""
+    aliases = []
+    seen = set()
+    for alias in (value or '').replace('\n', ',').split(','):
+        alias = ' '.join(alias.split())
+        if alias and normalize_name(alias) not in seen:
+            seen.add(normalize_name(alias))
+            aliases.append(alias)
+    return aliases
+
+
+class ClientIndex:
+    """Client name, initials and alias lookup table"""
+
+    def __init__(self, clients, aliases=()):
+        self._keys = {}
+        self._names = []
+        clients = sorted(tuple(client) for client in clients)
+        for client_id, name in clients:
+            self._keys.setdefault(normalize_name(name), client_id)
+            self._names.append((client_id, normalize_name(name)))
+        for client_id, alias in sorted(tuple(alias) for alias in aliases):
+            self._keys.setdefault(normalize_name(alias), client_id)
+        for client_id, name in clients:
+            acronym = initials(name)
+            if acronym:
+                self._keys.setdefault(acronym, client_id)
+
+    @classmethod
+    def from_db(cls, db):
+        return cls(db.execute('SELECT id, name FROM clients').fetchall(),
+                   db.execute('SELECT client_id, alias FROM client_aliases').fetchall())
+
+    def resolve(self, name):
+        """Client id for an imported client name, or None.
+
+        A name that is not in the index falls back to the first client whose
+        name contains it ("Horizon" for "Horizon Blue Cross"); the answer is
+        remembered, so each distinct name is looked up the slow way once.
+        """
+        key = normalize_name(name)
+        if not key:
+            return None
+        if key not in self._keys:
+            self._keys[key] = next((client_id for client_id, client_name in self._names
+                                    if key in client_name), None)
+        return self._keys[key]
+
+
+_cache = {}  # database file -> (revision, index)
+_cache_lock = threading.Lock()
+
+
+def client_index(db):
+    """The shared ClientIndex of db, rebuilt when clients or aliases changed.
+
+    Indexes built inside an open transaction (which may still roll back) and
+    those of in-memory databases are not shared.
+    """
+    path = db.execute('PRAGMA database_list').fetchone()[2]
+    revision = current_revision(db, 'clients')
+    if not path or db.in_transaction:
+        return ClientIndex.from_db(db)
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached is None or cached[0] != revision:
+            cached = _cache[path] = (revision, ClientIndex.from_db(db))
+        return cached[1]
+
+
+def set_client_aliases(db, client_id, aliases):
+    """Replace the aliases of a client; returns an error message or None.
+
+    Runs inside the caller's transaction; the caller commits.
+    """
+    taken = {}
+    if aliases:
+        placeholders = ','.join('?' * len(aliases))
+        taken = dict(db.execute(
+            f'''SELECT alias, client_id FROM client_aliases
+                WHERE client_id != ? AND alias COLLATE NOCASE IN ({placeholders})''',
+            [client_id] + aliases
+        ).fetchall())
+    if taken:
+        return f"Alias '{next(iter(taken))}' already belongs to another client"
+    db.execute('DELETE FROM client_aliases WHERE client_id = ?', (client_id,))
+    db.executemany('INSERT INTO client_aliases (client_id, alias) VALUES (?, ?)',
+                   [(client_id, alias) for alias in aliases])
+    return None
+
+
+def client_aliases(db, client_id):
+    """Aliases of a client, in the order they were entered"""
+    return [row[0] for row in db.execute(
+        'SELECT alias FROM client_aliases WHERE client_id = ? ORDER BY id', (client_id,))]
@@ -9,6 +9,56 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'you-need-to-change-this-in-production'
     DATABASE = os.environ.get('DATABASE_PATH') or 'database.db'
     
+    # SQLite connection pool and tuning (the pool size applies to read-only connections;
+    # writes always go through a single serialized connection per worker)
+    SQLITE_POOL_SIZE = int(os.environ.get('SQLITE_POOL_SIZE', 8))
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 16384))
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 64 * 1024 * 1024))
+    
+    # Live calendar updates: keep-alive interval of the server-sent events stream
+    SSE_HEARTBEAT_SECONDS = int(os.environ.get('SSE_HEARTBEAT_SECONDS', 15))
+    
+    # /api/events streams its JSON above this many events (or with ?stream=1),
+    # reading the cursor EVENTS_STREAM_BATCH_SIZE rows at a time
+    EVENTS_STREAM_THRESHOLD = int(os.environ.get('EVENTS_STREAM_THRESHOLD', 2000))
+    EVENTS_STREAM_BATCH_SIZE = int(os.environ.get('EVENTS_STREAM_BATCH_SIZE', 500))
+    
+    # Serialized VEVENTs kept in memory for re-exporting the ICS calendar (see ics_writer.py)
+    EVENTS_ICS_CACHE_SIZE = int(os.environ.get('EVENTS_ICS_CACHE_SIZE', 50000))
+    
+    # Rendered subscription feed bodies kept in memory between polls (see subscriptions.py)
+    EVENTS_SUBSCRIPTION_CACHE_SIZE = int(os.environ.get('EVENTS_SUBSCRIPTION_CACHE_SIZE', 256))
+    
+    # Zone (e.g. America/New_York) imported ICS times are converted to; unset keeps
+    # the wall-clock time each event was written in
+    EVENTS_TIMEZONE = os.environ.get('EVENTS_TIMEZONE') or None
+    
+    # Background jobs (see jobs.py): worker threads in the web process (0 leaves the
+    # queue to `flask run-jobs`; forced to 0 when run.py serves with gevent), idle poll
+    # interval, retries with exponential backoff from JOBS_RETRY_SECONDS, and how long
+    # finished jobs are kept
+    JOBS_WORKERS = int(os.environ.get('JOBS_WORKERS', 2))
+    JOBS_POLL_SECONDS = int(os.environ.get('JOBS_POLL_SECONDS', 5))
+    JOBS_MAX_ATTEMPTS = int(os.environ.get('JOBS_MAX_ATTEMPTS', 3))
+    JOBS_RETRY_SECONDS = int(os.environ.get('JOBS_RETRY_SECONDS', 30))
+    JOBS_STALE_SECONDS = int(os.environ.get('JOBS_STALE_SECONDS', 3600))
+    JOBS_RETENTION_DAYS = int(os.environ.get('JOBS_RETENTION_DAYS', 7))
+    
+    # Calendar feed sync (see feed_sync.py): default re-fetch interval of auto-sync
+    # feeds, how often the scheduler looks for due feeds, and the fetch timeout
+    FEEDS_SYNC_MINUTES = int(os.environ.get('FEEDS_SYNC_MINUTES', 60))
+    FEEDS_POLL_SECONDS = int(os.environ.get('FEEDS_POLL_SECONDS', 60))
+    FEEDS_FETCH_TIMEOUT = int(os.environ.get('FEEDS_FETCH_TIMEOUT', 30))
+    # Concurrent fetching: fetches in flight overall and per host, attempts per
+    # feed, and the first retry delay (doubled on each further attempt)
+    FEEDS_CONCURRENCY = int(os.environ.get('FEEDS_CONCURRENCY', 8))
+    FEEDS_PER_HOST = int(os.environ.get('FEEDS_PER_HOST', 2))
+    FEEDS_FETCH_ATTEMPTS = int(os.environ.get('FEEDS_FETCH_ATTEMPTS', 3))
+    FEEDS_BACKOFF_SECONDS = float(os.environ.get('FEEDS_BACKOFF_SECONDS', 1))
+    
     # Security settings
     WTF_CSRF_ENABLED = True
     WTF_CSRF_TIME_LIMIT = 3600
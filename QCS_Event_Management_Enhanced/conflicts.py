@@ -0,0 +1,347 @@
+# Event Conflict Detection Engine
+#
+# Conflicts are found in-process: the candidate window is loaded with a single
+# query, the event intervals are sorted by start date and a sweep-line pass
+# reports every pair of overlapping events that share equipment or a location.
+# Occurrences of recurring series take part as intervals carrying the series
+# id, so a conflict of any occurrence is stored against the series master.
+import heapq
+from collections import defaultdict
+
+from helpers import epoch_day, overlap_condition
+from recurrence import (single_condition, window_condition, series_condition, series_columns,
+                        default_window, horizon_day, expand_series)
+
+# Order in which conflict types are reported (matches the historic API output)
+CONFLICT_TYPE_ORDER = {'equipment': 0, 'location': 1}
+
+
+def sweep_conflicts(intervals):
+    """Find resource collisions between overlapping intervals.
+
+    ``intervals`` is an iterable of ``(start, end, event_id, location_id,
+    equipment_ids)`` tuples where ``start``/``end`` are inclusive and
+    comparable (ISO date strings or day numbers).  Yields
+    ``(event_id, other_event_id, conflict_type, resource_id)`` once per
+    colliding pair and shared resource.
+    """
+    ordered = sorted(intervals, key=lambda interval: (interval[0], interval[1]))
+
+    active = []  # min-heap of (end, slot) for intervals still open
+    resources = {}  # slot -> (event_id, location_id, equipment_ids)
+    by_location = defaultdict(dict)  # location_id -> {slot: event_id}
+    by_equipment = defaultdict(dict)  # equipment_id -> {slot: event_id}
+
+    for slot, (start, end, event_id, location_id, equipment_ids) in enumerate(ordered):
+        # Retire every interval that finished before this one starts
+        while active and active[0][0] < start:
+            _, expired = heapq.heappop(active)
+            _, expired_location, expired_equipment = resources.pop(expired)
+            if expired_location:
+                by_location[expired_location].pop(expired, None)
+            for equipment_id in expired_equipment:
+                by_equipment[equipment_id].pop(expired, None)
+
+        for equipment_id in equipment_ids:
+            holders = by_equipment[equipment_id]
+            for other_id in holders.values():
+                if other_id != event_id:
+                    yield event_id, other_id, 'equipment', equipment_id
+            holders[slot] = event_id
+
+        if location_id:
+            holders = by_location[location_id]
+            for other_id in holders.values():
+                if other_id != event_id:
+                    yield event_id, other_id, 'location', location_id
+            holders[slot] = event_id
+
+        resources[slot] = (event_id, location_id, equipment_ids)
+        heapq.heappush(active, (end, slot))
+
+
+def conflict_dict(other_id, conflict_type, resource_id):
+    """Build the conflict dict returned by the calendar API"""
+    resource_key = 'equipment_id' if conflict_type == 'equipment' else 'location_id'
+    return {
+        'conflict_event_id': other_id,
+        'conflict_type': conflict_type,
+        resource_key: resource_id
+    }
+
+
+def load_intervals(db, start_day=None, end_day=None, exclude_event_id=None):
+    """Load every non-cancelled event and series occurrence overlapping [start_day, end_day] as sweep intervals"""
+    query = f'''
+        SELECT e.event_id, e.start_day, e.end_day, e.location_id, ea.equipment_id
+        FROM events e
+        LEFT JOIN equipment_assignments ea ON ea.event_id = e.event_id
+        WHERE e.status != 'cancelled' AND e.start_day IS NOT NULL AND {single_condition()}
+    '''
+    params = []
+    if start_day is not None and end_day is not None:
+        condition, condition_params = overlap_condition(db, start_day, end_day)
+        query += ' AND ' + condition
+        params.extend(condition_params)
+    if exclude_event_id is not None:
+        query += ' AND e.event_id != ?'
+        params.append(exclude_event_id)
+
+    cursor = db.cursor()
+    cursor.row_factory = None
+    rows = cursor.execute(query, params).fetchall()
+
+    events = {}
+    for event_id, event_start, event_end, location_id, equipment_id in rows:
+        event = events.get(event_id)
+        if event is None:
+            event = events[event_id] = [event_start, event_end, event_id, location_id, set()]
+        if equipment_id is not None:
+            event[4].add(equipment_id)
+
+    intervals = [(start, end, event_id, location_id, frozenset(equipment))
+                 for start, end, event_id, location_id, equipment in events.values()]
+    intervals.extend(_series_intervals(db, start_day, end_day, exclude_event_id))
+    return intervals
+
+
+def _series_intervals(db, start_day=None, end_day=None, exclude_event_id=None):
+    """Sweep intervals for the occurrences of non-cancelled series in [start_day, end_day]"""
+    if start_day is None or end_day is None:
+        start_day, end_day = default_window()
+    condition, params = window_condition(start_day, end_day)
+    query = f'''
+        SELECT {series_columns()}, e.location_id, ea.equipment_id
+        FROM events e
+        LEFT JOIN equipment_assignments ea ON ea.event_id = e.event_id
+        WHERE e.status != 'cancelled' AND {condition}
+    '''
+    if exclude_event_id is not None:
+        query += ' AND e.event_id != ?'
+        params.append(exclude_event_id)
+
+    cursor = db.cursor()
+    cursor.row_factory = None
+    masters = {}
+    equipment = defaultdict(set)
+    for row in cursor.execute(query, params):
+        masters.setdefault(row[0], row)
+        if row[7] is not None:
+            equipment[row[0]].add(row[7])
+
+    return [(day, day + (master[3] or 0), master[0], master[6], frozenset(equipment[master[0]]))
+            for master, day in expand_series(db, list(masters.values()), start_day, end_day)]
+
+
+def check_event_conflicts(db, event_id, start_date, end_date=None):
+    """Check for equipment/location conflicts for an event"""
+    start_day = epoch_day(start_date)
+    end_day = epoch_day(end_date) if end_date else start_day
+    event_id = int(event_id)
+
+    # Resources held by the event being checked
+    cursor = db.cursor()
+    cursor.row_factory = None
+    rows = cursor.execute(
+        '''SELECT e.location_id, ea.equipment_id
+           FROM events e
+           LEFT JOIN equipment_assignments ea ON ea.event_id = e.event_id
+           WHERE e.event_id = ?''',
+        (event_id,)
+    ).fetchall()
+    location_id = rows[0][0] if rows else None
+    equipment_ids = frozenset(row[1] for row in rows if row[1] is not None)
+
+    if not location_id and not equipment_ids:
+        return []
+
+    intervals = load_intervals(db, start_day, end_day, exclude_event_id=event_id)
+    intervals.append((start_day, end_day, event_id, location_id, equipment_ids))
+
+    found = set()
+    for first, second, conflict_type, resource_id in sweep_conflicts(intervals):
+        if first == event_id:
+            found.add((conflict_type, resource_id, second))
+        elif second == event_id:
+            found.add((conflict_type, resource_id, first))
+
+    return _format_conflicts(found)
+
+
+def _format_conflicts(found):
+    """Sort (conflict_type, resource_id, other_id) triples into API conflict dicts"""
+    ordered = sorted(found, key=lambda item: (CONFLICT_TYPE_ORDER[item[0]], item[1], item[2]))
+    return [conflict_dict(other_id, conflict_type, resource_id)
+            for conflict_type, resource_id, other_id in ordered]
+
+
+def _conflict_rows(pairs, scope_ids=None):
+    """Turn sweep pairs into (event_id, conflicting_event_id, conflict_type) rows for both events"""
+    rows = set()
+    for first, second, conflict_type, _ in pairs:
+        if scope_ids is not None and first not in scope_ids and second not in scope_ids:
+            continue
+        rows.add((first, second, conflict_type))
+        rows.add((second, first, conflict_type))
+    return rows
+
+
+def _apply_conflict_rows(db, scope_ids, desired_rows):
+    """Make event_conflicts match desired_rows for every row touching scope_ids.
+
+    Rows that are still valid are kept (preserving their resolved flag),
+    duplicates and obsolete rows are removed, new rows are inserted and
+    has_conflicts is recalculated for every event whose rows changed.
+    Runs inside the caller's transaction.
+    """
+    db.execute('CREATE TEMP TABLE IF NOT EXISTS conflict_scope (event_id INTEGER PRIMARY KEY)')
+    db.execute('CREATE TEMP TABLE IF NOT EXISTS conflict_touched (event_id INTEGER PRIMARY KEY)')
+    db.execute('''CREATE TEMP TABLE IF NOT EXISTS conflict_desired (
+                      event_id INTEGER NOT NULL,
+                      conflicting_event_id INTEGER NOT NULL,
+                      conflict_type TEXT NOT NULL,
+                      PRIMARY KEY (event_id, conflicting_event_id, conflict_type)
+                  )''')
+    db.execute('DELETE FROM temp.conflict_scope')
+    db.execute('DELETE FROM temp.conflict_touched')
+    db.execute('DELETE FROM temp.conflict_desired')
+
+    db.executemany('INSERT INTO temp.conflict_scope (event_id) VALUES (?)',
+                   ((event_id,) for event_id in scope_ids))
+    db.executemany('INSERT INTO temp.conflict_desired VALUES (?, ?, ?)', desired_rows)
+
+    # Every event whose flag may change: the scope, its old partners and its new partners
+    db.execute('INSERT OR IGNORE INTO temp.conflict_touched SELECT event_id FROM temp.conflict_scope')
+    db.execute('INSERT OR IGNORE INTO temp.conflict_touched SELECT event_id FROM temp.conflict_desired')
+    db.execute('''INSERT OR IGNORE INTO temp.conflict_touched
+                  SELECT c.event_id FROM event_conflicts c
+                  WHERE c.conflicting_event_id IN (SELECT event_id FROM temp.conflict_scope)''')
+
+    # Collapse duplicate rows left behind by older versions
+    db.execute('''DELETE FROM event_conflicts
+                  WHERE event_id IN (SELECT event_id FROM temp.conflict_touched)
+                    AND id NOT IN (SELECT MIN(id) FROM event_conflicts
+                                   GROUP BY event_id, conflicting_event_id, conflict_type)''')
+
+    removed = db.execute(
+        '''DELETE FROM event_conflicts
+           WHERE (event_id IN (SELECT event_id FROM temp.conflict_scope)
+                  OR conflicting_event_id IN (SELECT event_id FROM temp.conflict_scope))
+             AND NOT EXISTS (SELECT 1 FROM temp.conflict_desired d
+                             WHERE d.event_id = event_conflicts.event_id
+                               AND d.conflicting_event_id = event_conflicts.conflicting_event_id
+                               AND d.conflict_type = event_conflicts.conflict_type)'''
+    ).rowcount
+
+    added = db.execute(
+        '''INSERT INTO event_conflicts (event_id, conflicting_event_id, conflict_type)
+           SELECT d.event_id, d.conflicting_event_id, d.conflict_type
+           FROM temp.conflict_desired d
+           WHERE NOT EXISTS (SELECT 1 FROM event_conflicts c
+                             WHERE c.event_id = d.event_id
+                               AND c.conflicting_event_id = d.conflicting_event_id
+                               AND c.conflict_type = d.conflict_type)'''
+    ).rowcount
+
+    db.execute(
+        '''UPDATE events SET has_conflicts = EXISTS (
+               SELECT 1 FROM event_conflicts c
+               WHERE c.event_id = events.event_id AND c.resolved = 0)
+           WHERE event_id IN (SELECT event_id FROM temp.conflict_touched)
+             AND IFNULL(has_conflicts, 0) != EXISTS (
+               SELECT 1 FROM event_conflicts c
+               WHERE c.event_id = events.event_id AND c.resolved = 0)'''
+    )
+
+    return added, removed
+
+
+def recompute_conflicts(db, start_date=None, end_date=None):
+    """Rebuild event_conflicts and events.has_conflicts for a date range in one pass.
+
+    Without a range the whole calendar is recomputed.  Everything happens in
+    a single transaction which is committed on success.
+    """
+    if start_date or end_date:
+        start_day = epoch_day(start_date) if start_date else epoch_day('0001-01-01')
+        end_day = epoch_day(end_date) if end_date else epoch_day('9999-12-31')
+
+        # Every event in the range (cancelled ones included, so their stale rows are cleared)
+        condition, params = overlap_condition(db, start_day, end_day, alias='events')
+        scope_ids = {row[0] for row in db.execute(
+            f'SELECT event_id FROM events WHERE {condition}', params)}
+        series, series_params = window_condition(start_day, end_day, alias='events')
+        scope_ids.update(row[0] for row in db.execute(
+            f'SELECT event_id FROM events WHERE {series}', series_params))
+
+        intervals = load_intervals(db, start_day, end_day)
+        if intervals:
+            # Events spanning the range edges can collide with events outside it
+            span_start = min(start_day, min(interval[0] for interval in intervals))
+            span_end = max(end_day, max(interval[1] for interval in intervals))
+            if (span_start, span_end) != (start_day, end_day):
+                intervals = load_intervals(db, span_start, span_end)
+    else:
+        scope_ids = {row[0] for row in db.execute('SELECT event_id FROM events')}
+        intervals = load_intervals(db)
+
+    desired_rows = _conflict_rows(sweep_conflicts(intervals), scope_ids)
+
+    try:
+        added, removed = _apply_conflict_rows(db, scope_ids, desired_rows)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    return {
+        'events': len(scope_ids),
+        'conflicts': len(desired_rows),
+        'added': added,
+        'removed': removed,
+        'conflicted_events': len({row[0] for row in desired_rows if row[0] in scope_ids})
+    }
+
+
+def refresh_event_conflicts(db, event_ids):
+    """Re-evaluate stored conflicts for events that were just written.
+
+    Only the window covered by the given events is loaded, so the cost is
+    bounded by their neighbours rather than the whole calendar.  Rows for
+    pairs that no longer collide are removed from both sides (this also
+    covers deleted and cancelled events), new pairs are inserted once and
+    has_conflicts is updated for every event whose rows changed.  Runs
+    inside the caller's transaction; returns ``{event_id: [conflict dicts]}``
+    for the given events.
+    """
+    scope_ids = {int(event_id) for event_id in event_ids if event_id is not None}
+    if not scope_ids:
+        return {}
+
+    placeholders = ','.join('?' * len(scope_ids))
+    # A series covers every occurrence up to its end (or the expansion horizon)
+    window = db.execute(
+        f'''SELECT MIN(start_day),
+                   MAX(CASE WHEN {series_condition('events')}
+                            THEN IFNULL(recurrence_end_day, ?) + span_days ELSE end_day END)
+            FROM events
+            WHERE status != 'cancelled' AND start_day IS NOT NULL AND event_id IN ({placeholders})''',
+        [horizon_day()] + list(scope_ids)
+    ).fetchone()
+
+    found = {event_id: set() for event_id in scope_ids}
+    pairs = []
+    if window[0] is not None:
+        # Anything colliding with a written event overlaps this window
+        intervals = load_intervals(db, window[0], window[1])
+        for pair in sweep_conflicts(intervals):
+            first, second, conflict_type, resource_id = pair
+            if first in found:
+                found[first].add((conflict_type, resource_id, second))
+            if second in found:
+                found[second].add((conflict_type, resource_id, first))
+            pairs.append(pair)
+
+    _apply_conflict_rows(db, scope_ids, _conflict_rows(pairs, scope_ids))
+
+    return {event_id: _format_conflicts(conflicts) for event_id, conflicts in found.items()}
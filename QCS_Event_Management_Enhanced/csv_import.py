@@ -0,0 +1,194 @@
+# Bulk CSV Import
+#
+# The calendar's CSV import runs in stages so a large spreadsheet costs a
+# handful of set-based statements instead of several queries per row:
+#
+#   1. every row is parsed and validated before the database is touched,
+#   2. clients, categories and equipment are resolved against in-memory
+#      indexes (client_index.py for clients and their aliases,
+#      equipment_matcher.py for items),
+#   3. the staged rows are loaded into a temp table and rows duplicating an
+#      existing event (or an earlier row of the same file) are found with a
+#      single query,
+#   4. new equipment, events and equipment assignments are written with
+#      executemany in batches of at most IMPORT_BATCH_SIZE rows.
+#
+# Everything runs inside the caller's transaction; the caller commits.
+import csv
+import uuid
+from io import StringIO
+
+from client_index import client_index
+from equipment_matcher import EquipmentMatcher
+
+IMPORT_BATCH_SIZE = 500
+
+REQUIRED_COLUMNS = ('event_name', 'event_date', 'client_name')
+
+# Every column the importer reads; the CSV export writes these by default (see exporters.py)
+CSV_COLUMNS = ('event_name', 'event_date', 'client_name', 'category_name', 'start_time', 'pickup_time',
+               'location_address', 'onsite_contact', 'manager', 'items_needed', 'boxes_from_pi', 'notes')
+
+# Staged row layout, shared by the temp table and the events INSERT
+_STAGED_COLUMNS = ('row_no', 'event_name', 'client_id', 'category_id', 'event_date', 'drop_off_time',
+                   'pickup_time', 'event_location', 'onsite_contact', 'manager', 'items_needed',
+                   'boxes_from_pi', 'notes', 'ics_uid')
+
+
+def parse_csv_rows(text):
+    """Parse CSV text into (rows, messages).
+
+    rows holds the (row number, row dict) of every row with the required
+    fields; messages holds (message, category) pairs for the skipped rows.
+    """
+    rows = []
+    messages = []
+    for row_no, row in enumerate(csv.DictReader(StringIO(text, newline=None)), start=1):
+        if not all(row.get(column) for column in REQUIRED_COLUMNS):
+            messages.append((f"Skipping row due to missing required fields: {row}", 'warning'))
+            continue
+        rows.append((row_no, row))
+    return rows, messages
+
+
+def split_items(value):
+    """Equipment names listed in an items_needed cell (comma or semicolon separated)"""
+    return [item.strip() for item in (value or '').replace(';', ',').split(',') if item.strip()]
+
+
+def _batches(rows, size):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+class EquipmentIndex:
+    """Resolves items_needed entries to equipment, queueing unknown items for creation.
+
+    Matching is done by an EquipmentMatcher built once per import.  Unknown
+    items become new equipment, which later items can match too.
+    References are equipment ids, or ('new', n) for the n-th entry of
+    self.created.
+    """
+
+    def __init__(self, matcher):
+        self.matcher = matcher
+        self.created = []
+        self._resolved = {}
+
+    def resolve(self, item):
+        key = item.lower()
+        reference = self._resolved.get(key)
+        if reference is None:
+            reference = self.matcher.find(item)
+            if reference is None:
+                reference = ('new', len(self.created))
+                self.created.append(item)
+                self.matcher.add(item, reference)
+            self._resolved[key] = reference
+        return reference
+
+
+def _stage_rows(rows, clients, categories):
+    """Resolve the client and category of each parsed row; returns (staged tuples, messages)"""
+    staged = []
+    messages = []
+    for row_no, row in rows:
+        client_id = clients.resolve(row['client_name'])
+        if not client_id:
+            messages.append((f"Client '{row['client_name']}' not found. Skipping event '{row['event_name']}'.",
+                             'warning'))
+            continue
+        category_name = row.get('category_name')
+        staged.append((
+            row_no, row['event_name'], client_id,
+            categories.get(category_name.lower()) if category_name else None,
+            row['event_date'], row.get('start_time'), row.get('pickup_time'), row.get('location_address'),
+            row.get('onsite_contact'), row.get('manager'), row.get('items_needed'), row.get('boxes_from_pi'),
+            row.get('notes'), str(uuid.uuid4())
+        ))
+    return staged, messages
+
+
+def _duplicate_rows(db, staged, batch_size):
+    """Row numbers of staged rows that repeat an existing event or an earlier row"""
+    db.execute('DROP TABLE IF EXISTS temp.import_events')
+    db.execute(f'CREATE TEMP TABLE import_events ({", ".join(_STAGED_COLUMNS)})')
+    db.execute('CREATE INDEX temp.idx_import_events_key ON import_events(event_name, client_id, event_date)')
+    placeholders = ', '.join('?' * len(_STAGED_COLUMNS))
+    for batch in _batches(staged, batch_size):
+        db.executemany(f'INSERT INTO temp.import_events VALUES ({placeholders})', batch)
+
+    duplicates = {row[0] for row in db.execute(
+        '''SELECT t.row_no FROM temp.import_events t
+           WHERE EXISTS (SELECT 1 FROM events e
+                         WHERE e.event_name = t.event_name AND e.client_id = t.client_id
+                           AND e.event_date = t.event_date)
+              OR EXISTS (SELECT 1 FROM temp.import_events p
+                         WHERE p.event_name = t.event_name AND p.client_id = t.client_id
+                           AND p.event_date = t.event_date AND p.row_no < t.row_no)''')}
+    db.execute('DROP TABLE temp.import_events')
+    return duplicates
+
+
+def _insert_equipment(db, names, batch_size):
+    """Create equipment for names and return their ids in the same order"""
+    if not names:
+        return []
+    last_id = db.execute('SELECT IFNULL(MAX(id), 0) FROM equipment').fetchone()[0]
+    for batch in _batches([(name, 'Auto-created during CSV import', 1, 'available') for name in names],
+                          batch_size):
+        db.executemany('INSERT INTO equipment (name, description, quantity, status) VALUES (?, ?, ?, ?)', batch)
+    return [row[0] for row in db.execute('SELECT id FROM equipment WHERE id > ? ORDER BY id', (last_id,))]
+
+
+def import_csv_events(db, rows, user_id=None, batch_size=IMPORT_BATCH_SIZE):
+    """Import parsed CSV rows as booked events with their equipment.
+
+    Returns {'imported_ids': [...], 'messages': [(message, category), ...]}.
+    """
+    clients = client_index(db)
+    categories = {name.lower(): category_id
+                  for category_id, name in db.execute('SELECT id, name FROM event_categories')}
+    staged, messages = _stage_rows(rows, clients, categories)
+    if not staged:
+        return {'imported_ids': [], 'messages': messages}
+
+    duplicates = _duplicate_rows(db, staged, batch_size)
+    new_rows = []
+    for row in staged:
+        if row[0] in duplicates:
+            messages.append((f"Skipped duplicate event: '{row[1]}' on {row[4]}", 'info'))
+        else:
+            new_rows.append(row)
+
+    # Resolve every item before writing so new equipment is created in one go
+    equipment = EquipmentIndex(EquipmentMatcher.from_db(db))
+    row_items = [[equipment.resolve(item) for item in split_items(row[10])] for row in new_rows]
+    created_ids = _insert_equipment(db, equipment.created, batch_size)
+    messages.extend((f"Created new equipment item: '{name}'", 'info') for name in equipment.created)
+
+    for batch in _batches(new_rows, batch_size):
+        db.executemany(
+            f'''INSERT INTO events ({", ".join(_STAGED_COLUMNS[1:])}, status)
+                VALUES ({", ".join('?' * (len(_STAGED_COLUMNS) - 1))}, 'booked')''',
+            [row[1:] for row in batch])
+
+    event_ids = {}
+    for batch in _batches([row[-1] for row in new_rows], batch_size):
+        event_ids.update(db.execute(
+            f'SELECT ics_uid, event_id FROM events WHERE ics_uid IN ({",".join("?" * len(batch))})', batch))
+    imported_ids = [event_ids[row[-1]] for row in new_rows]
+
+    assignments = []
+    for event_id, references in zip(imported_ids, row_items):
+        assigned = set()
+        for reference in references:
+            equipment_id = created_ids[reference[1]] if isinstance(reference, tuple) else reference
+            if equipment_id not in assigned:
+                assigned.add(equipment_id)
+                assignments.append((event_id, equipment_id, 1, user_id))
+    for batch in _batches(assignments, batch_size):
+        db.executemany('''INSERT INTO equipment_assignments (event_id, equipment_id, quantity, assigned_by)
+                          VALUES (?, ?, ?, ?)''', batch)
+
+    return {'imported_ids': imported_ids, 'messages': messages}
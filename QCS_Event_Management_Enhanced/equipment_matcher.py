@@ -0,0 +1,141 @@
+# Equipment Name Matching
+#
+# Maps free text such as an items_needed entry ("Popup tent #A (blue)") to
+# equipment in the catalogue.  A text matches the equipment with the same
+# name, ignoring case, otherwise the first equipment (in catalogue order)
+# whose name occurs in it.
+#
+# Exact names are a dict lookup; substring matches come from an
+# Aho-Corasick automaton over every name, so one pass over the text finds
+# all the names it contains whatever the catalogue size.  Names added later
+# (equipment auto-created during an import) go to a short pending list that
+# is scanned directly and folded into the automaton once it grows past
+# REBUILD_THRESHOLD, so adding an item never rebuilds the automaton per call.
+from collections import deque
+
+REBUILD_THRESHOLD = 32
+
+
+class EquipmentMatcher:
+    """Exact-name map plus Aho-Corasick automaton over equipment names.
+
+    Values are whatever the caller registers with each name (equipment ids,
+    or placeholders for equipment that is not stored yet).
+    """
+
+    def __init__(self, equipment=()):
+        self._exact = {}
+        self._patterns = []  # (lowercase name, value) in catalogue order
+        for value, name in equipment:
+            self._register(name, value)
+        self._build()
+
+    @classmethod
+    def from_db(cls, db):
+        """Matcher over the equipment table, valued by equipment id"""
+        return cls(db.execute('SELECT id, name FROM equipment ORDER BY id').fetchall())
+
+    def _register(self, name, value):
+        """Add name to the exact map and the pattern list; returns False for blank names"""
+        key = (name or '').strip().lower()
+        if not key:
+            return False
+        self._exact.setdefault(key, value)
+        self._patterns.append((key, value))
+        return True
+
+    def add(self, name, value):
+        """Register another equipment name; earlier names keep precedence"""
+        if self._register(name, value):
+            self._pending.append(len(self._patterns) - 1)
+            if len(self._pending) > REBUILD_THRESHOLD:
+                self._build()
+
+    def _build(self):
+        """Build the automaton (goto, fail and best-match tables) over every pattern"""
+        goto = [{}]
+        best = [None]  # Smallest pattern index ending at each state
+        for index, (name, _) in enumerate(self._patterns):
+            state = 0
+            for char in name:
+                next_state = goto[state].get(char)
+                if next_state is None:
+                    next_state = goto[state][char] = len(goto)
+                    goto.append({})
+                    best.append(None)
+                state = next_state
+            if best[state] is None or index < best[state]:
+                best[state] = index
+
+        # Breadth-first failure links; each state inherits the best match of its fallback
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in goto[state].items():
+                fallback = fail[state]
+                while fallback and char not in goto[fallback]:
+                    fallback = fail[fallback]
+                if state:
+                    fail[next_state] = goto[fallback].get(char, 0)
+                inherited = best[fail[next_state]]
+                if inherited is not None and (best[next_state] is None or inherited < best[next_state]):
+                    best[next_state] = inherited
+                queue.append(next_state)
+
+        self._goto, self._fail, self._best = goto, fail, best
+        self._pending = []
+
+    def _scan(self, text):
+        """Yield (end offset, pattern index) for every automaton state with a match"""
+        goto, fail, best = self._goto, self._fail, self._best
+        state = 0
+        for offset, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if best[state] is not None:
+                yield offset, best[state]
+
+    def exact(self, text):
+        """Value of the equipment named text (ignoring case), or None"""
+        return self._exact.get((text or '').strip().lower())
+
+    def find(self, text):
+        """Value of the equipment text refers to, or None.
+
+        An exact name wins; otherwise the first catalogue name that occurs
+        in text.
+        """
+        key = (text or '').strip().lower()
+        value = self._exact.get(key)
+        if value is not None:
+            return value
+        index = min((index for _, index in self._scan(key)), default=None)
+        if index is None:
+            # Pending names were added after every name in the automaton
+            index = next((index for index in self._pending if self._patterns[index][0] in key), None)
+        return None if index is None else self._patterns[index][1]
+
+    def find_all(self, text):
+        """Values of every catalogue name occurring in free text, in order of appearance.
+
+        Overlapping names report the earliest registered one ending at each
+        position; each value is listed once.
+        """
+        key = (text or '').lower()
+        hits = [(offset - len(self._patterns[index][0]) + 1, index) for offset, index in self._scan(key)]
+        for index in self._pending:
+            name = self._patterns[index][0]
+            start = key.find(name)
+            if start >= 0:
+                hits.append((start, index))
+
+        values = []
+        seen = set()
+        for _, index in sorted(hits):
+            value = self._patterns[index][1]
+            if value not in seen:
+                seen.add(value)
+                values.append(value)
+        return values
@@ -0,0 +1,62 @@
+# Live Update Bus
+#
+# In-process publish/subscribe channel behind the calendar's server-sent
+# events stream.  Write routes publish a small notification after they commit
+# ({'type': 'created' | 'updated' | 'deleted' | 'conflicts', 'event_ids': [...],
+# 'revision': n}); every open stream has its own bounded queue.
+#
+# Notifications only say *that* something changed: clients fetch the actual
+# rows from /api/events/changes, so a dropped or missed message merely delays
+# a sync instead of losing data.  The bus is per process; with several
+# workers a client still catches up on its next sync.
+#
+# Subscribers block on queue.Queue.get, which gevent's monkey patching turns
+# into a cooperative wait, so idle streams cost a greenlet rather than a
+# worker thread when the app is served by gevent (see run.py).
+import queue
+import threading
+
+
+class EventBus:
+    """Fan-out of change notifications to the subscribed SSE streams"""
+
+    def __init__(self, queue_size=64):
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        """Register a new subscriber and return its message queue"""
+        subscriber = queue.Queue(self.queue_size)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def publish(self, kind, event_ids, revision=None):
+        """Queue a notification for every subscriber; returns how many received it"""
+        message = {'type': kind, 'event_ids': sorted(event_ids), 'revision': revision}
+        with self._lock:
+            subscribers = list(self._subscribers)
+
+        delivered = 0
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+                delivered += 1
+            except queue.Full:
+                # A full queue already holds notifications that will trigger a
+                # sync covering this change, so the slow client can skip it
+                pass
+        return delivered
+
+
+# Shared by every request handled in this process
+bus = EventBus()
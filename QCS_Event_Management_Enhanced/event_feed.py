@@ -0,0 +1,319 @@
+# Calendar Feed Serialization
+#
+# Builds the FullCalendar payload for /api/events and /api/events/changes.
+# Rows are fetched as plain tuples in the fixed column order of
+# EVENTS_FEED_QUERY and serialized column-wise: the event URL is formatted
+# from a template computed once, time padding, class lists and all-day end
+# dates (integer day math on the end_day column) are memoized per distinct
+# value, and the result is encoded with orjson when it is installed.
+# Large ranges are streamed: the cursor is read with fetchmany and each
+# batch is written out as a chunk of the JSON array, so memory stays flat.
+# Recurring series are expanded for the requested window (see recurrence.py)
+# and their occurrences follow the stored events.
+import json
+
+from flask import Response, url_for
+
+from helpers import epoch_day, overlap_condition, day_to_iso
+from recurrence import (single_condition, window_condition, series_columns, default_window,
+                        expand_series, virtual_id)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Feed columns shared by the full and delta endpoints; the serializer
+# below unpacks them in this order
+_FEED_COLUMNS = '''
+           e.event_id, e.event_name, e.event_date, e.end_date, e.end_day,
+           e.drop_off_time, e.pickup_time, e.is_all_day, e.status,
+           e.has_conflicts, e.is_recurring, e.client_id, e.category_id,
+           e.location_id, e.parent_event_id, e.event_location,
+           c.name as client_name,
+           c.color as client_color,
+           ec.name as category_name,
+           ec.color as category_color,
+           l.name as location_name
+'''
+_FEED_JOINS = '''
+    FROM events e
+    LEFT JOIN clients c ON e.client_id = c.id
+    LEFT JOIN event_categories ec ON e.category_id = ec.id
+    LEFT JOIN locations l ON e.location_id = l.id
+'''
+EVENTS_FEED_QUERY = 'SELECT' + _FEED_COLUMNS + _FEED_JOINS
+
+# Series masters: the expansion columns followed by the feed columns
+SERIES_FEED_QUERY = f'SELECT {series_columns()},' + _FEED_COLUMNS + _FEED_JOINS
+_SERIES_WIDTH = 6
+
+DEFAULT_COLOR = '#3788d8'
+
+# Placeholder id used to derive the event URL template from url_for
+_URL_ID_PLACEHOLDER = 987654321
+
+
+def feed_window(args):
+    """(start_day, end_day) requested by args, or None for the whole calendar.
+
+    Raises ValueError when the start/end range cannot be parsed.
+    """
+    start = args.get('start')
+    end = args.get('end')
+    if start and end:
+        return epoch_day(start), epoch_day(end)
+    return None
+
+
+def event_feed_filters(db, args):
+    """Build the WHERE conditions and params for the calendar feed filters in args.
+
+    They match stored events only; series masters are expanded separately by
+    fetch_series_feed.  Raises ValueError when the start/end range cannot be parsed.
+    """
+    # --- Dynamic WHERE clause construction ---
+    conditions = [single_condition()]
+    params = []
+
+    # 1. Date Range Filtering (Required for calendar view)
+    window = feed_window(args)
+    if window:
+        # Include events that overlap with the requested date range, compared on
+        # the integer day columns so the month view is an index range scan
+        range_condition, range_params = overlap_condition(db, *window)
+        conditions.append(f'({range_condition})')
+        params.extend(range_params)
+
+    attribute_conditions, attribute_params = _attribute_filters(args)
+    return conditions + attribute_conditions, params + attribute_params
+
+
+def _attribute_filters(args):
+    """Category, status, client and conflict filters of args as (conditions, params)"""
+    conditions = []
+    params = []
+
+    # 2. Category Filtering
+    categories = args.get('categories')
+    if categories:
+        category_ids = [cat.strip() for cat in categories.split(',') if cat.strip()]
+        if category_ids:
+            placeholders = ','.join(['?'] * len(category_ids))
+            # Include events with NULL category_id OR matching category_id
+            conditions.append(f"(e.category_id IS NULL OR e.category_id IN ({placeholders}))")
+            params.extend(category_ids)
+
+    # 3. Status Filtering
+    statuses = args.get('statuses')
+    if statuses:
+        status_list = [stat.strip() for stat in statuses.split(',') if stat.strip()]
+        if status_list:
+            placeholders = ','.join(['?'] * len(status_list))
+            conditions.append(f"e.status IN ({placeholders})")
+            params.extend(status_list)
+
+    # 4. Client Filtering
+    client_id = args.get('client_id')
+    if client_id and client_id != 'all':
+        conditions.append("e.client_id = ?")
+        params.append(client_id)
+
+    # 5. Conflicts Only Filtering
+    conflicts_only = args.get('conflicts_only')
+    if conflicts_only and conflicts_only.lower() == 'true':
+        conditions.append("e.has_conflicts = 1")
+
+    return conditions, params
+
+
+def _feed_cursor(db, conditions, params):
+    """Execute the feed query with the given conditions on a tuple cursor"""
+    query = EVENTS_FEED_QUERY
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += ' ORDER BY e.event_date'
+
+    cursor = db.cursor()
+    cursor.row_factory = None  # Tuples are much cheaper to build than sqlite3.Row
+    return cursor.execute(query, list(params))
+
+
+def fetch_event_feed(db, conditions=(), params=()):
+    """Run the feed query with the given conditions and return plain tuples"""
+    return _feed_cursor(db, conditions, params).fetchall()
+
+
+def count_event_feed(db, conditions=(), params=()):
+    """Number of events the feed query would return (the filters only use events columns)"""
+    query = 'SELECT COUNT(*) FROM events e'
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    return db.execute(query, list(params)).fetchone()[0]
+
+
+def stream_event_feed(db, conditions=(), params=(), batch_size=500, tail=()):
+    """Return a generator yielding the feed as JSON array chunks.
+
+    The query runs (and the URL template is resolved) before the first
+    chunk, so errors surface while a normal error response is still
+    possible; the rows are then read batch_size at a time.  tail holds
+    already serialized events (series occurrences) written after the rows.
+    """
+    url_template = event_url_template()
+    cursor = _feed_cursor(db, conditions, params)
+
+    def generate():
+        yield b'['
+        separator = b''
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            # Strip the brackets so the batches join into one array
+            yield separator + dump_json(serialize_event_feed(rows, url_template))[1:-1]
+            separator = b','
+        for start in range(0, len(tail), batch_size):
+            yield separator + dump_json(tail[start:start + batch_size])[1:-1]
+            separator = b','
+        yield b']'
+
+    return generate()
+
+
+def fetch_series_feed(db, args, conditions=(), params=()):
+    """Serialized occurrences of the recurring series matching the feed filters in args.
+
+    Occurrences get a virtual id ('<series id>_<date>') and carry series_id
+    and occurrence_date in extendedProps.  Raises ValueError when the
+    start/end range cannot be parsed.
+    """
+    window = feed_window(args) or default_window()
+    series_condition, series_params = window_condition(*window)
+    attribute_conditions, attribute_params = _attribute_filters(args)
+
+    query = SERIES_FEED_QUERY + ' WHERE ' + ' AND '.join(
+        [series_condition] + attribute_conditions + list(conditions))
+    cursor = db.cursor()
+    cursor.row_factory = None
+    masters = cursor.execute(query, series_params + attribute_params + list(params)).fetchall()
+    if not masters:
+        return []
+
+    rows = []
+    occurrences = []
+    for master, day in expand_series(db, masters, *window):
+        row = master[_SERIES_WIDTH:]
+        span = master[3] or 0
+        # Same feed tuple as the master, moved to the occurrence's dates
+        rows.append(row[:2] + (day_to_iso(day), day_to_iso(day + span) if row[3] else None, day + span) + row[5:])
+        occurrences.append((master[0], day))
+
+    events = serialize_event_feed(rows)
+    for event, row, (series_id, day) in zip(events, rows, occurrences):
+        event['id'] = virtual_id(series_id, day)
+        event['extendedProps']['series_id'] = series_id
+        event['extendedProps']['occurrence_date'] = row[2]
+    return events
+
+
+def event_url_template(external=False):
+    """Return the event page URL (absolute when external) with a '{}' slot for the event id"""
+    url = url_for('calendar.view_event', event_id=_URL_ID_PLACEHOLDER, _external=external)
+    return url.replace(str(_URL_ID_PLACEHOLDER), '{}')
+
+
+def serialize_event_feed(rows, url_template=None):
+    """Convert feed query tuples to FullCalendar event dicts"""
+    if not rows:
+        return []
+    url_template = url_template or event_url_template()
+
+    # Memo tables: the feed has few distinct times, days and class combinations
+    padded_times = {}
+    next_days = {}
+    class_names = {}
+
+    def pad(value):
+        """'HH:MM' -> 'HH:MM:00'"""
+        padded = padded_times.get(value)
+        if padded is None:
+            padded = padded_times[value] = value + ':00' if len(value) == 5 else value
+        return padded
+
+    events = []
+    append = events.append
+    for (event_id, name, event_date, end_date, end_day, drop_off, pickup, all_day, status,
+         has_conflicts, is_recurring, client_id, category_id, location_id, parent_id,
+         event_location, client_name, client_color, category_name, category_color,
+         location_name) in rows:
+        all_day = bool(all_day)
+        has_conflicts = bool(has_conflicts)
+        is_recurring = bool(is_recurring)
+
+        event = {
+            'id': event_id,
+            'title': name,
+            'start': f"{event_date}T{pad(drop_off) if drop_off else '00:00:00'}",
+            'color': category_color or client_color or DEFAULT_COLOR,
+            'textColor': '#ffffff',
+            'borderColor': client_color or DEFAULT_COLOR,
+            'url': url_template.format(event_id),
+            'allDay': all_day,
+        }
+
+        if end_date:
+            if all_day:
+                # FullCalendar needs an exclusive end date for all-day events
+                if end_day is not None:
+                    end = next_days.get(end_day)
+                    if end is None:
+                        end = next_days[end_day] = day_to_iso(end_day + 1)
+                    event['end'] = end
+            else:
+                event['end'] = f"{end_date}T{pickup or '23:59:59'}"
+        elif pickup:
+            # Single-day event with end time
+            event['end'] = f"{event_date}T{pad(pickup)}"
+
+        class_key = (status, has_conflicts, is_recurring)
+        classes = class_names.get(class_key)
+        if classes is None:
+            classes = []
+            if status:
+                classes.append(f'event-{status}')
+            if has_conflicts:
+                classes.append('event-conflict')
+            if is_recurring:
+                classes.append('event-recurring')
+            classes = class_names[class_key] = tuple(classes)
+        if classes:
+            event['classNames'] = list(classes)
+
+        event['extendedProps'] = {
+            'client_id': client_id,
+            'client_name': client_name,
+            'category_id': category_id,
+            'category_name': category_name,
+            'location': event_location or location_name,
+            'location_id': location_id,
+            'status': status,
+            'is_recurring': is_recurring,
+            'has_conflicts': has_conflicts,
+            'parent_event_id': parent_id,
+        }
+        append(event)
+
+    return events
+
+
+def dump_json(payload):
+    """Encode payload as compact JSON bytes, with orjson when available"""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+
+def json_response(payload, status=200):
+    """Response carrying payload encoded by dump_json"""
+    return Response(dump_json(payload), status=status, mimetype='application/json')
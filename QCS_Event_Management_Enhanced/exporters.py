@@ -0,0 +1,260 @@
+# Event Exporters
+#
+# /export-calendar/<format> looks the format up in a registry of streaming
+# writers; a new format is one function decorated with @exporter.  Every
+# writer is fed by the same query (export_batches): the selected columns of
+# the non-cancelled events, read from the cursor EVENTS_STREAM_BATCH_SIZE
+# rows at a time, so memory stays flat however many events are exported.
+#
+# Columns are chosen with ?columns=a,b,c from EXPORT_FIELDS.  The default
+# is the CSV importer's column set, so an exported CSV can be imported again.
+# (ICS is exported by ics_writer.py, which has its own query and cache.)
+import csv
+import re
+import zipfile
+from collections import namedtuple
+from io import StringIO
+
+from csv_import import CSV_COLUMNS
+from event_feed import dump_json
+
+# Export column -> SQL expression over the joins of export_batches
+EXPORT_FIELDS = {
+    'event_id': 'e.event_id',
+    'event_name': 'e.event_name',
+    'event_date': 'e.event_date',
+    'end_date': 'e.end_date',
+    'client_name': 'c.name',
+    'category_name': 'ec.name',
+    'start_time': 'e.drop_off_time',
+    'pickup_time': 'e.pickup_time',
+    'location_name': 'l.name',
+    'location_address': 'COALESCE(e.event_location, l.address)',
+    'onsite_contact': 'e.onsite_contact',
+    'onsite_contact_phone': 'e.onsite_contact_phone',
+    'manager': 'e.manager',
+    'items_needed': 'e.items_needed',
+    'boxes_from_pi': 'e.boxes_from_pi',
+    'notes': 'e.notes',
+    'status': 'e.status',
+    'is_all_day': 'e.is_all_day',
+    'recurrence_pattern': 'e.recurrence_pattern',
+    'recurrence_end_date': 'e.recurrence_end_date',
+    'ics_uid': 'e.ics_uid',
+}
+
+DEFAULT_COLUMNS = CSV_COLUMNS
+
+Exporter = namedtuple('Exporter', ('format', 'mimetype', 'extension', 'render'))
+
+_exporters = {}
+
+
+def exporter(format, mimetype, extension=None):
+    """Register render(batches, columns) as the writer of format.
+
+    render receives an iterator of row batches (lists of tuples in column
+    order) and yields the file as str or bytes chunks.
+    """
+    def register(render):
+        _exporters[format] = Exporter(format, mimetype, extension or format, render)
+        return render
+    return register
+
+
+def get_exporter(format):
+    """The Exporter registered for format, or None"""
+    return _exporters.get(format)
+
+
+def export_formats():
+    return sorted(_exporters)
+
+
+def export_columns(value):
+    """Columns requested as 'a,b,c' (default: the importer's); raises ValueError for unknown ones"""
+    columns = [column.strip() for column in (value or '').split(',') if column.strip()]
+    if not columns:
+        return list(DEFAULT_COLUMNS)
+    unknown = [column for column in columns if column not in EXPORT_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown export columns: {', '.join(unknown)}")
+    return list(dict.fromkeys(columns))
+
+
+def export_batches(db, columns, batch_size=500):
+    """Return a generator of row batches for columns.
+
+    The query runs before the generator is returned, so errors surface
+    while a normal error response is still possible.
+    """
+    cursor = db.execute(
+        f'''SELECT {', '.join(EXPORT_FIELDS[column] for column in columns)}
+            FROM events e
+            LEFT JOIN clients c ON e.client_id = c.id
+            LEFT JOIN event_categories ec ON e.category_id = ec.id
+            LEFT JOIN locations l ON e.location_id = l.id
+            WHERE e.status != 'cancelled'
+            ORDER BY e.event_date, e.event_id'''
+    )
+
+    def generate():
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+
+    return generate()
+
+
+@exporter('csv', 'text/csv')
+def write_csv(batches, columns):
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+@exporter('jsonl', 'application/x-ndjson')
+def write_jsonl(batches, columns):
+    for rows in batches:
+        yield b''.join(dump_json(dict(zip(columns, row))) + b'\n' for row in rows)
+
+
+# --- XLSX ---
+# A minimal workbook written with zipfile: the sheet is compressed as rows
+# arrive and strings are stored inline, so no shared-strings table has to
+# be held in memory (and no spreadsheet library is needed).
+
+_XLSX_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+_XLSX_PARTS = (
+    ('[Content_Types].xml',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+     '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+     '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+     '<Default Extension="xml" ContentType="application/xml"/>'
+     '<Override PartName="/xl/workbook.xml" '
+     'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+     '<Override PartName="/xl/worksheets/sheet1.xml" '
+     'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+     '<Override PartName="/xl/styles.xml" '
+     'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+     '</Types>'),
+    ('_rels/.rels',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+     '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+     '<Relationship Id="rId1" '
+     'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+     'Target="xl/workbook.xml"/>'
+     '</Relationships>'),
+    ('xl/workbook.xml',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+     f'<workbook xmlns="{_XLSX_NS}" '
+     'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+     '<sheets><sheet name="Events" sheetId="1" r:id="rId1"/></sheets>'
+     '</workbook>'),
+    ('xl/_rels/workbook.xml.rels',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+     '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+     '<Relationship Id="rId1" '
+     'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+     'Target="worksheets/sheet1.xml"/>'
+     '<Relationship Id="rId2" '
+     'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+     'Target="styles.xml"/>'
+     '</Relationships>'),
+    ('xl/styles.xml',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+     f'<styleSheet xmlns="{_XLSX_NS}">'
+     '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+     '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+     '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+     '<fill><patternFill patternType="gray125"/></fill></fills>'
+     '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+     '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+     '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+     '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/></cellXfs>'
+     '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+     '</styleSheet>'),
+)
+
+# Characters XML 1.0 does not allow, even escaped
+_XML_ILLEGAL = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+class _ChunkBuffer:
+    """Write-only file for zipfile; what was written is collected until drained"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _column_letter(index):
+    """0 -> 'A', 26 -> 'AA'"""
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def _xlsx_row(number, values, letters, style=''):
+    cells = []
+    for letter, value in zip(letters, values):
+        if value is None or value == '':
+            continue
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            cells.append(f'<c r="{letter}{number}"{style}><v>{value}</v></c>')
+        else:
+            text = _XML_ILLEGAL.sub('', str(value)).replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+            cells.append(f'<c r="{letter}{number}" t="inlineStr"{style}><is><t xml:space="preserve">{text}</t></is></c>')
+    return f'<row r="{number}">{"".join(cells)}</row>'
+
+
+@exporter('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+def write_xlsx(batches, columns):
+    letters = [_column_letter(index) for index in range(len(columns))]
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, content in _XLSX_PARTS:
+            archive.writestr(name, content)
+        with archive.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+            # Header row in bold, frozen above the data
+            sheet.write((
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                f'<worksheet xmlns="{_XLSX_NS}"><sheetViews><sheetView workbookViewId="0">'
+                '<pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/>'
+                '</sheetView></sheetViews><sheetData>'
+                + _xlsx_row(1, columns, letters, ' s="1"')
+            ).encode('utf-8'))
+            number = 1
+            for rows in batches:
+                chunk = []
+                for row in rows:
+                    number += 1
+                    chunk.append(_xlsx_row(number, row, letters))
+                sheet.write(''.join(chunk).encode('utf-8'))
+                data = buffer.drain()
+                if data:
+                    yield data
+            sheet.write(b'</sheetData></worksheet>')
+    yield buffer.drain()
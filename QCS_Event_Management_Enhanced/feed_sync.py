@@ -0,0 +1,283 @@
+# Calendar Feed Sync
+#
+# Feeds saved with auto-sync on the ICS URL import are re-fetched every
+# sync_minutes (FEEDS_SYNC_MINUTES unless the feed sets its own).  A small
+# scheduler thread (FeedScheduler) claims due feeds with one UPDATE ...
+# RETURNING and queues one 'sync_feeds' job for the lot, so fetches run on
+# the job workers; `flask sync-feeds` does the same from cron.
+#
+# A batch of feeds is fetched concurrently (fetch_feeds): an asyncio loop
+# runs at most FEEDS_CONCURRENCY fetches at a time, each on a worker thread
+# with a keep-alive session per host, retrying network errors and
+# temporary HTTP errors with exponential backoff.  Parsed events are then
+# applied by one writer transaction, so a sync takes about as long as the
+# slowest feed rather than the sum of all of them.
+#
+# Fetches are conditional: the ETag and Last-Modified of the previous
+# response go out as If-None-Match / If-Modified-Since, so an unchanged
+# feed costs one 304.  A changed feed is diffed against feed_events, which
+# keeps a content hash per VEVENT UID, and only new or changed events are
+# written; events that left the feed are cancelled.  Each sync records its
+# status, error, fetch and apply times on the feed row.
+import asyncio
+import hashlib
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from flask import current_app
+
+from helpers import get_db
+from ics_reader import read_vevents
+from jobs import enqueue, green_threads
+
+FEED_DEFAULTS = {
+    'FEEDS_SYNC_MINUTES': 60,
+    'FEEDS_POLL_SECONDS': 60,
+    'FEEDS_FETCH_TIMEOUT': 30,
+    'FEEDS_CONCURRENCY': 8,
+    'FEEDS_PER_HOST': 2,
+    'FEEDS_FETCH_ATTEMPTS': 3,
+    'FEEDS_BACKOFF_SECONDS': 1,
+}
+
+# Columns returned by the feeds API
+FEED_STATUS_COLUMNS = ('id, url, category_id, auto_sync, sync_minutes, next_sync_at, last_synced, '
+                       'last_checked, last_status, last_error, last_fetch_ms, last_apply_ms, last_changed')
+
+
+def _setting(app, key):
+    return app.config.get(key, FEED_DEFAULTS[key])
+
+
+def event_hash(event):
+    """Content hash of an IcsEvent; equal hashes mean nothing to update"""
+    content = '\x1f'.join('' if value is None else str(value) for value in event)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+class FeedHTTPError(Exception):
+    """The feed server answered with an error status"""
+
+    def __init__(self, status_code):
+        super().__init__(f'Failed to fetch ICS: {status_code}')
+        self.status_code = status_code
+
+    @property
+    def temporary(self):
+        """Server errors and rate limiting may go away; other client errors will not"""
+        return self.status_code >= 500 or self.status_code == 429
+
+
+class FeedFetch:
+    """Outcome of one conditional fetch"""
+
+    def __init__(self, status, events=None, etag=None, last_modified=None, fetch_ms=0):
+        self.status = status  # 'not_modified' or 'fetched'
+        self.events = events
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetch_ms = fetch_ms
+
+
+def conditional_headers(feed):
+    """Request headers that let the server answer 304 for an unchanged feed"""
+    headers = {}
+    if feed['etag']:
+        headers['If-None-Match'] = feed['etag']
+    if feed['last_modified']:
+        headers['If-Modified-Since'] = feed['last_modified']
+    return headers
+
+
+def fetch_feed(feed, timeout, tz=None, session=None):
+    """Fetch and parse a feed row unless it is unchanged.
+
+    feed needs url, etag and last_modified.  Raises FeedHTTPError for error
+    responses; IcsError for a body that is not a calendar.
+    """
+    started = time.monotonic()
+    with (session or requests).get(feed['url'], headers=conditional_headers(feed), timeout=timeout,
+                                   stream=True) as response:
+        if response.status_code == 304:
+            return FeedFetch('not_modified', etag=feed['etag'], last_modified=feed['last_modified'],
+                             fetch_ms=int((time.monotonic() - started) * 1000))
+        if response.status_code != 200:
+            raise FeedHTTPError(response.status_code)
+        events = list(read_vevents(response.iter_lines(), tz))
+        return FeedFetch('fetched', events, response.headers.get('ETag'),
+                         response.headers.get('Last-Modified'),
+                         int((time.monotonic() - started) * 1000))
+
+
+def _retryable(error):
+    """Network errors and temporary HTTP errors are worth another attempt"""
+    if isinstance(error, FeedHTTPError):
+        return error.temporary
+    return isinstance(error, requests.RequestException)
+
+
+async def _fetch_concurrently(feeds, timeout, tz, concurrency, per_host, attempts, backoff):
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='feed-fetch')
+    limit = asyncio.Semaphore(concurrency)
+    hosts = {}  # host -> (session, semaphore)
+
+    def host_session(url):
+        host = urlsplit(url).netloc.lower()
+        if host not in hosts:
+            # Connections to a host are kept alive and shared by its feeds
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=per_host)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            hosts[host] = (session, asyncio.Semaphore(per_host))
+        return hosts[host]
+
+    async def fetch_one(feed):
+        session, host_limit = host_session(feed['url'])
+        for attempt in range(1, attempts + 1):
+            try:
+                async with host_limit, limit:
+                    return await loop.run_in_executor(executor, fetch_feed, feed, timeout, tz, session)
+            except Exception as error:
+                if attempt == attempts or not _retryable(error):
+                    return error
+            await asyncio.sleep(backoff * 2 ** (attempt - 1))
+
+    try:
+        return await asyncio.gather(*(fetch_one(feed) for feed in feeds))
+    finally:
+        executor.shutdown(wait=False)
+        for session, _ in hosts.values():
+            session.close()
+
+
+def fetch_feeds(feeds, app=None, tz=None):
+    """Fetch many feed rows concurrently with the app's FEEDS_* settings.
+
+    Returns {feed id: FeedFetch, or the exception its last attempt raised},
+    so one failing feed does not hold up the others.
+    """
+    app = app or current_app
+    feeds = list(feeds)
+    if not feeds:
+        return {}
+    results = asyncio.run(_fetch_concurrently(
+        feeds, _setting(app, 'FEEDS_FETCH_TIMEOUT'), tz,
+        max(1, _setting(app, 'FEEDS_CONCURRENCY')), max(1, _setting(app, 'FEEDS_PER_HOST')),
+        max(1, _setting(app, 'FEEDS_FETCH_ATTEMPTS')), _setting(app, 'FEEDS_BACKOFF_SECONDS')))
+    return {feed['id']: result for feed, result in zip(feeds, results)}
+
+
+def diff_feed(db, feed_id, events):
+    """Split fetched events against what the feed delivered last time.
+
+    Returns (changed, hashes, removed): the events that are new or differ,
+    {uid: hash} for every event in the fetch, and the ids of events whose
+    UID is no longer in the feed.  Events without a UID are given one
+    derived from their content, so an unchanged event is not imported twice.
+    """
+    known = {uid: (content_hash, event_id) for uid, content_hash, event_id in db.execute(
+        'SELECT uid, content_hash, event_id FROM feed_events WHERE feed_id = ?', (feed_id,))}
+    changed = []
+    hashes = {}
+    for event in events:
+        content_hash = event_hash(event)
+        if not event.uid:
+            event = event._replace(uid=f'feed-{feed_id}-{content_hash}')
+        if event.uid in hashes:
+            continue  # Repeated UID: the first occurrence wins
+        hashes[event.uid] = content_hash
+        if known.get(event.uid, (None,))[0] != content_hash:
+            changed.append(event)
+    removed = [event_id for uid, (_, event_id) in known.items() if uid not in hashes and event_id is not None]
+    return changed, hashes, removed
+
+
+def record_feed_events(db, feed_id, hashes):
+    """Replace the feed's UID/hash list with the one just applied"""
+    db.execute('DELETE FROM feed_events WHERE feed_id = ?', (feed_id,))
+    db.executemany(
+        '''INSERT INTO feed_events (feed_id, uid, content_hash, event_id)
+           SELECT ?, ?, ?, (SELECT event_id FROM events WHERE ics_uid = ?)''',
+        [(feed_id, uid, content_hash, uid) for uid, content_hash in hashes.items()]
+    )
+
+
+def record_feed_status(db, feed_id, status, fetch=None, apply_ms=None, changed=None, error=None):
+    """Store the outcome and timing of a sync attempt on the feed row"""
+    db.execute(
+        '''UPDATE calendar_feeds SET
+               last_checked = datetime('now'), last_status = ?, last_error = ?,
+               last_fetch_ms = ?, last_apply_ms = ?, last_changed = ?,
+               etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified),
+               last_synced = CASE WHEN ? = 'error' THEN last_synced ELSE datetime('now') END
+           WHERE id = ?''',
+        (status, error, fetch.fetch_ms if fetch else None, apply_ms, changed,
+         fetch.etag if fetch else None, fetch.last_modified if fetch else None, status, feed_id)
+    )
+
+
+def claim_due_feeds(db, default_minutes):
+    """Push the next sync of every due feed forward and return their ids.
+
+    One statement, so schedulers in several processes never claim a feed twice.
+    """
+    claimed = db.execute(
+        '''UPDATE calendar_feeds
+           SET next_sync_at = datetime('now', '+' || COALESCE(sync_minutes, ?) || ' minutes')
+           WHERE auto_sync = 1 AND (next_sync_at IS NULL OR next_sync_at <= datetime('now'))
+           RETURNING id''',
+        (int(default_minutes),)
+    ).fetchall()
+    db.commit()
+    return sorted(row[0] for row in claimed)
+
+
+def schedule_due_feeds(app):
+    """Queue one sync_feeds job for the due feeds; returns the job ids"""
+    with app.app_context():
+        db = get_db()
+        feed_ids = claim_due_feeds(db, _setting(app, 'FEEDS_SYNC_MINUTES'))
+        return [enqueue(db, 'sync_feeds', {'feed_ids': feed_ids})] if feed_ids else []
+
+
+class FeedScheduler:
+    """Daemon thread queueing due feed syncs every FEEDS_POLL_SECONDS"""
+
+    def __init__(self):
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def start(self, app):
+        # Feeds are synced by `flask run-jobs` under gevent, which starts its own scheduler
+        if green_threads():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.work, args=(app,), daemon=True, name='feed-scheduler')
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def work(self, app):
+        while not self._stop.is_set():
+            try:
+                schedule_due_feeds(app)
+            except Exception:
+                traceback.print_exc()
+            self._stop.wait(_setting(app, 'FEEDS_POLL_SECONDS'))
+
+
+# Shared by every request handled in this process
+scheduler = FeedScheduler()
+
@@ -1,24 +1,162 @@
+import os
+import queue
 import sqlite3
-from flask import g, session, flash, redirect, url_for, abort, current_app, request, jsonify
+import threading
+from contextlib import closing
+from datetime import date
+from pathlib import Path
+from flask import g, session, flash, redirect, url_for, abort, current_app, request, jsonify, has_request_context
 from functools import wraps
 
+# Connection tuning defaults (override with the SQLITE_* keys from config.py)
+SQLITE_DEFAULTS = {
+    'SQLITE_POOL_SIZE': 8,
+    'SQLITE_JOURNAL_MODE': 'WAL',
+    'SQLITE_BUSY_TIMEOUT_MS': 5000,
+    'SQLITE_SYNCHRONOUS': 'NORMAL',
+    'SQLITE_CACHE_SIZE_KB': 16384,
+    'SQLITE_MMAP_SIZE': 64 * 1024 * 1024,
+}
+
+# Requests with these methods are served from read-only connections
+READ_ONLY_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+class ConnectionPool:
+    """Per-process pool of tuned SQLite connections for one database file.
+
+    Read-only pools open the file with ``mode=ro`` and ``query_only`` so that
+    under WAL every reader works from its own snapshot and never waits on the
+    writer.  The writer pool holds a single connection that is checked out by
+    one request at a time.
+    """
+
+    def __init__(self, database, size, settings, readonly=False):
+        self.database = database
+        self.size = size
+        self.settings = settings
+        self.readonly = readonly
+        self.pid = os.getpid()
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._writer_lock = None if readonly else threading.Lock()
+
+    def _connect(self):
+        """Open a connection and apply the configured pragmas"""
+        settings = self.settings
+        if self.readonly:
+            target, uri = Path(self.database).resolve().as_uri() + '?mode=ro', True
+        else:
+            target, uri = self.database, False
+        conn = sqlite3.connect(
+            target,
+            uri=uri,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            timeout=settings['SQLITE_BUSY_TIMEOUT_MS'] / 1000,
+            # Readers never open transactions; the writer takes the write lock up front
+            isolation_level=None if self.readonly else 'IMMEDIATE',
+            check_same_thread=False  # Connections move between request threads
+        )
+        conn.row_factory = sqlite3.Row
+        if self.readonly:
+            conn.execute('PRAGMA query_only = 1')
+        else:
+            conn.execute(f"PRAGMA journal_mode = {settings['SQLITE_JOURNAL_MODE']}")
+            conn.execute(f"PRAGMA synchronous = {settings['SQLITE_SYNCHRONOUS']}")
+        conn.execute(f"PRAGMA busy_timeout = {int(settings['SQLITE_BUSY_TIMEOUT_MS'])}")
+        conn.execute(f"PRAGMA cache_size = -{int(settings['SQLITE_CACHE_SIZE_KB'])}")
+        conn.execute(f"PRAGMA mmap_size = {int(settings['SQLITE_MMAP_SIZE'])}")
+        conn.execute('PRAGMA temp_store = MEMORY')
+        return conn
+
+    def acquire(self):
+        """Hand out an idle connection, opening a new one if none is free"""
+        if self._writer_lock is not None:
+            timeout = self.settings['SQLITE_BUSY_TIMEOUT_MS'] / 1000
+            if not self._writer_lock.acquire(timeout=timeout):
+                raise sqlite3.OperationalError('database is locked')
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            try:
+                return self._connect()
+            except Exception:
+                if self._writer_lock is not None:
+                    self._writer_lock.release()
+                raise
+
+    def release(self, conn):
+        """Return a connection to the pool, discarding any unfinished transaction"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = sqlite3.Row
+            self._idle.put_nowait(conn)
+        except (queue.Full, sqlite3.Error):
+            conn.close()
+        finally:
+            if self._writer_lock is not None:
+                self._writer_lock.release()
+
+    def close(self):
+        """Close every idle connection"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(readonly=False):
+    """Return the reader or writer pool for the configured database in this worker process"""
+    database = current_app.config['DATABASE']
+    key = (database, readonly)
+    pool = _pools.get(key)
+    if pool is None or pool.pid != os.getpid():
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None or pool.pid != os.getpid():
+                # Connections must never be shared with a forked parent
+                settings = {key: current_app.config.get(key, default)
+                            for key, default in SQLITE_DEFAULTS.items()}
+                if readonly:
+                    # Readers cannot switch the journal mode, so set it once up front
+                    with closing(sqlite3.connect(database)) as conn:
+                        conn.execute(f"PRAGMA journal_mode = {settings['SQLITE_JOURNAL_MODE']}")
+                    size = settings['SQLITE_POOL_SIZE']
+                else:
+                    size = 1
+                pool = _pools[key] = ConnectionPool(database, size, settings, readonly=readonly)
+    return pool
+
 # Database helper functions
-def get_db():
-    """Connect to the database if there's no connection yet"""
+def get_db(write=False):
+    """Return this request's database connection.
+
+    GET/HEAD requests read through a read-only snapshot connection; other
+    requests, code outside a request and callers passing ``write=True`` get
+    the serialized writer, which is kept for the rest of the request.
+    """
     if 'db' not in g:
-        # Use current_app to access app configuration
-        g.db = sqlite3.connect(
-            current_app.config['DATABASE'],
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+        readonly = (not write and has_request_context()
+                    and request.method in READ_ONLY_METHODS
+                    and current_app.config['DATABASE'] != ':memory:')
+        if readonly:
+            if 'read_db' not in g:
+                g.read_db_pool = get_pool(readonly=True)
+                g.read_db = g.read_db_pool.acquire()
+            return g.read_db
+        g.db_pool = get_pool()
+        g.db = g.db_pool.acquire()
     return g.db
 
 def close_db(e=None):
-    """Close the database connection"""
-    db = g.pop('db', None)
-    if db is not None:
-        db.close()
+    """Return the request's database connections to their pools"""
+    for name in ('db', 'read_db'):
+        db = g.pop(name, None)
+        pool = g.pop(f'{name}_pool', None)
+        if db is not None:
+            pool.release(db)
 
 # Authentication helpers
 def login_required(f):
@@ -74,3 +212,27 @@ def get_current_user():
         return db.execute('SELECT * FROM users WHERE id = ?',
                          (session['user_id'],)).fetchone()
     return None
+
+# Date helpers
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+def epoch_day(value):
+    """Convert a 'YYYY-MM-DD' (or ISO datetime) string or date to days since 1970-01-01"""
+    if isinstance(value, date):
+        return value.toordinal() - EPOCH_ORDINAL
+    return date.fromisoformat(str(value)[:10]).toordinal() - EPOCH_ORDINAL
+
+def day_to_iso(day):
+    """Convert a day number produced by epoch_day back to 'YYYY-MM-DD'"""
+    return date.fromordinal(day + EPOCH_ORDINAL).isoformat()
+
+def overlap_condition(db, start_day, end_day, alias='e'):
+    """SQL predicate and params matching events that overlap [start_day, end_day].
+
+    Works on the integer start_day/end_day columns.  Bounding start_day by
+    the longest stored span keeps the test sargable, so it is answered with
+    a range scan of idx_events_day_range.
+    """
+    max_span = db.execute('SELECT MAX(span_days) FROM events').fetchone()[0] or 0
+    return (f'{alias}.start_day BETWEEN ? AND ? AND {alias}.end_day >= ?',
+            [start_day - max(max_span, 0), end_day, start_day])
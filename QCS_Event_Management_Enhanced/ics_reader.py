@@ -0,0 +1,197 @@
+# Streaming ICS Reader
+#
+# Calendar imports read VEVENTs straight from the source (an uploaded file
+# stream, the lines of a fetched response or a string) one at a time,
+# instead of building the whole calendar as an object graph.
+# Folded lines are joined on the fly and every VEVENT becomes a small
+# IcsEvent record holding the fields the importers store; components nested
+# in an event (VALARM) and other properties are skipped.
+#
+# Times are kept as written, i.e. the wall-clock time of their TZID, or UTC
+# for values ending in Z, as the ics library did.  Given a target zone,
+# zoned and UTC values are converted to it instead; floating times and
+# TZIDs zoneinfo does not know are left alone.  All-day events (VALUE=DATE)
+# have no times and an inclusive end date.
+import re
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+IcsEvent = namedtuple('IcsEvent', (
+    'uid', 'summary', 'description', 'location', 'status',
+    'start_date', 'start_time', 'end_date', 'end_time', 'all_day', 'tzid',
+))
+
+# Properties copied into IcsEvent; everything else is skipped unparsed
+_WANTED = frozenset(('UID', 'SUMMARY', 'DESCRIPTION', 'LOCATION', 'STATUS', 'DTSTART', 'DTEND', 'DURATION'))
+
+_PARAM = re.compile(r';([^=;:]+)=("[^"]*"|[^;:]*)')
+_DURATION = re.compile(r'([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$')
+_TEXT_ESCAPES = re.compile(r'\\([\\;,nN])')
+
+
+class IcsError(ValueError):
+    """The input is not an iCalendar file, or an event in it is malformed"""
+
+
+@lru_cache(maxsize=64)
+def _zone(name):
+    """ZoneInfo for a TZID, or None when it is unknown"""
+    try:
+        return ZoneInfo(name.strip('"').lstrip('/'))
+    except (KeyError, ValueError):
+        return None
+
+
+def _decode(line):
+    return line.decode('utf-8', 'replace') if isinstance(line, bytes) else line
+
+
+def unfold(lines):
+    """Join folded content lines (continuations start with a space or tab).
+
+    Byte lines are joined before they are decoded, as a fold may split a
+    multi-byte UTF-8 character.
+    """
+    current = None
+    for line in lines:
+        line = line.rstrip(b'\r\n' if isinstance(line, bytes) else '\r\n')
+        if not line:
+            continue
+        if line[:1] in (' ', '\t', b' ', b'\t') and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield _decode(current)
+        current = line
+    if current is not None:
+        yield _decode(current)
+
+
+def parse_content_line(line):
+    """'DTSTART;TZID=Europe/Paris:20250101T090000' -> ('DTSTART', {'TZID': 'Europe/Paris'}, '20250101T090000')"""
+    head, separator, value = line.partition(':')
+    if '"' in head:
+        # A quoted parameter value may contain the separator
+        quoted = False
+        for index, char in enumerate(line):
+            if char == '"':
+                quoted = not quoted
+            elif char == ':' and not quoted:
+                head, separator, value = line[:index], ':', line[index + 1:]
+                break
+        else:
+            separator = ''
+    if not separator:
+        return None
+    name = head.split(';', 1)[0].upper()
+    params = {key.upper(): param.strip('"') for key, param in _PARAM.findall(head)} if ';' in head else {}
+    return name, params, value
+
+
+def _unescape(value):
+    return _TEXT_ESCAPES.sub(lambda match: '\n' if match.group(1) in 'nN' else match.group(1), value)
+
+
+def _parse_moment(params, value, target):
+    """(date, time or None) of a DATE or DATE-TIME value"""
+    value = value.strip()
+    if params.get('VALUE', '').upper() == 'DATE' or len(value) == 8:
+        return datetime.strptime(value[:8], '%Y%m%d').date(), None
+    moment = datetime.strptime(value[:15], '%Y%m%dT%H%M%S')
+    if target is not None:
+        source = timezone.utc if value.endswith('Z') else _zone(params['TZID']) if 'TZID' in params else None
+        if source is not None:
+            moment = moment.replace(tzinfo=source).astimezone(target).replace(tzinfo=None)
+    return moment.date(), moment.time()
+
+
+def _parse_duration(value):
+    match = _DURATION.match(value.strip())
+    if not match:
+        raise ValueError(f'bad duration {value!r}')
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    duration = timedelta(weeks=int(weeks or 0), days=int(days or 0), hours=int(hours or 0),
+                         minutes=int(minutes or 0), seconds=int(seconds or 0))
+    return -duration if sign == '-' else duration
+
+
+def _build_event(properties, target):
+    """IcsEvent for the collected properties of one VEVENT, or None without DTSTART"""
+    if 'DTSTART' not in properties:
+        return None
+    text = {name: _unescape(properties[name][1]) if name in properties else None
+            for name in ('UID', 'SUMMARY', 'DESCRIPTION', 'LOCATION')}
+    start_params, start_value = properties['DTSTART']
+    try:
+        start_date, start_time = _parse_moment(start_params, start_value, target)
+        if 'DTEND' in properties:
+            end_date, end_time = _parse_moment(*properties['DTEND'], target)
+        elif 'DURATION' in properties:
+            end = datetime.combine(start_date, start_time or datetime.min.time()) \
+                + _parse_duration(properties['DURATION'][1])
+            end_date, end_time = end.date(), end.time() if start_time is not None else None
+        else:
+            # A bare DATE start lasts that day; a bare DATE-TIME start has no duration
+            end_date, end_time = (start_date + timedelta(days=1) if start_time is None else start_date), start_time
+    except ValueError as error:
+        raise IcsError(f"Invalid date in event {text['UID'] or text['SUMMARY']!r}: {error}")
+
+    all_day = start_time is None
+    if all_day:
+        # DTEND of an all-day event is the day after it ends
+        end_date, end_time = max(start_date, end_date - timedelta(days=1)), None
+    return IcsEvent(
+        uid=text['UID'], summary=text['SUMMARY'], description=text['DESCRIPTION'], location=text['LOCATION'],
+        status=properties['STATUS'][1].strip().upper() if 'STATUS' in properties else None,
+        start_date=start_date.isoformat(),
+        start_time=start_time.strftime('%H:%M:%S') if start_time is not None else None,
+        end_date=end_date.isoformat(),
+        end_time=end_time.strftime('%H:%M:%S') if end_time is not None else None,
+        all_day=all_day, tzid=start_params.get('TZID'),
+    )
+
+
+def read_vevents(source, tz=None):
+    """Yield an IcsEvent for every VEVENT in source.
+
+    source is ICS text or any iterable of lines (str or bytes), such as a
+    file object or a response's iter_lines(); it is read incrementally.
+    tz is a zone name or tzinfo to convert times to (see above).  Raises
+    IcsError when the input is not a calendar or an event has a bad date.
+    """
+    if isinstance(source, (str, bytes)):
+        source = source.splitlines()
+    target = _zone(tz) if isinstance(tz, str) else tz
+    started = False
+    properties = None
+    nested = 0
+    for line in unfold(source):
+        if not started:
+            if line.lstrip('\ufeff').upper() != 'BEGIN:VCALENDAR':
+                raise IcsError('Input is not an iCalendar file (missing BEGIN:VCALENDAR)')
+            started = True
+            continue
+        parsed = parse_content_line(line)
+        if parsed is None:
+            continue
+        name, params, value = parsed
+        if properties is None:
+            if name == 'BEGIN' and value.strip().upper() == 'VEVENT':
+                properties = {}
+                nested = 0
+        elif name == 'BEGIN':
+            nested += 1
+        elif name == 'END':
+            if nested:
+                nested -= 1
+            elif value.strip().upper() == 'VEVENT':
+                event = _build_event(properties, target)
+                properties = None
+                if event is not None:
+                    yield event
+        elif not nested and name in _WANTED:
+            properties.setdefault(name, (params, value))
+    if not started:
+        raise IcsError('Input is not an iCalendar file (missing BEGIN:VCALENDAR)')
@@ -0,0 +1,197 @@
+# Streaming ICS Writer
+#
+# The calendar export is written as it is read: stream_calendar runs one
+# query and yields the VCALENDAR a batch of VEVENTs at a time, so even a
+# large calendar starts downloading at once and never sits in memory as a
+# whole.  Exceptions of a recurring series (its EXDATEs) come from a
+# correlated subquery on the same row.
+#
+# Serialized VEVENTs are cached per process, keyed by database and event
+# id and tagged with the event's revision (stamped by triggers on every
+# change to the event, its client, location or exceptions; see migrations
+# 4 and 5) and the URL template.  A re-export only renders the events that
+# changed since the last one; the rest are copied from the cache.
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from recurrence import RECURRENCE_PATTERNS
+
+# Columns unpacked by render_vevent, in this order
+EXPORT_COLUMNS = '''
+           e.event_id, e.revision, e.ics_uid, e.event_name, e.event_date, e.end_date,
+           e.drop_off_time, e.pickup_time, e.is_recurring, e.recurrence_pattern,
+           e.recurrence_end_date, e.notes, e.event_location, e.status,
+           COALESCE(e.last_updated, e.created_at),
+           c.name, l.name, l.address,
+           CASE WHEN e.is_recurring THEN
+               (SELECT group_concat(x.original_start_date) FROM events x
+                WHERE x.parent_event_id = e.event_id AND x.original_start_date IS NOT NULL)
+           END
+'''
+EXPORT_QUERY = f'''SELECT {EXPORT_COLUMNS}
+    FROM events e
+    LEFT JOIN clients c ON e.client_id = c.id
+    LEFT JOIN locations l ON e.location_id = l.id
+'''
+
+CALENDAR_HEADER = ('BEGIN:VCALENDAR\r\n'
+                   'VERSION:2.0\r\n'
+                   'PRODID:-//QCS Event Management//ICS Export//EN\r\n'
+                   'CALSCALE:GREGORIAN\r\n'
+                   'METHOD:PUBLISH\r\n')
+CALENDAR_FOOTER = 'END:VCALENDAR\r\n'
+
+_STATUSES = {'booked': 'CONFIRMED', 'cancelled': 'CANCELLED'}
+
+
+def escape_text(value):
+    """Escape a TEXT property value (RFC 5545 3.3.11)"""
+    return (value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def fold_line(line):
+    """Fold a content line into CRLF-terminated lines of at most 75 octets"""
+    if len(line) <= 75 and line.isascii():
+        return line + '\r\n'
+    parts = []
+    current = ''
+    size = 0
+    limit = 75
+    for char in line:
+        width = len(char.encode('utf-8'))
+        if size + width > limit:
+            parts.append(current)
+            # Continuation lines start with a space, which counts towards the limit
+            current, size, limit = '', 0, 74
+        current += char
+        size += width
+    parts.append(current)
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def _moment(date, time, default):
+    """'2025-07-14', '07:00' -> '20250714T070000Z' (stored times are written as UTC, as before)"""
+    return datetime.fromisoformat(f"{date}T{time or default}").strftime('%Y%m%dT%H%M%SZ')
+
+
+def _stamp(value):
+    """DTSTAMP from a stored 'YYYY-MM-DD HH:MM:SS' timestamp, or None"""
+    digits = ''.join(char for char in value or '' if char.isdigit())
+    return f'{digits[:8]}T{digits[8:14]}Z' if len(digits) >= 14 else None
+
+
+def render_vevent(row, url_template):
+    """Serialize one EXPORT_QUERY row as a folded VEVENT block"""
+    (event_id, _, uid, name, event_date, end_date, drop_off, pickup, is_recurring, pattern,
+     recurrence_end, notes, event_location, status, modified, client_name, location_name,
+     location_address, exdates) = row
+
+    begin = _moment(event_date, drop_off, '09:00:00')
+    lines = [
+        'BEGIN:VEVENT',
+        f'UID:{escape_text(uid or f"event-{event_id}@qcs-event-management")}',
+    ]
+    stamp = _stamp(modified)
+    if stamp:
+        lines.append(f'DTSTAMP:{stamp}')
+    lines.append(f'DTSTART:{begin}')
+    lines.append(f"DTEND:{_moment(end_date or event_date, pickup, '17:00:00')}")
+
+    # A recurring series is exported once, with its rule and the occurrences it skips
+    if is_recurring and pattern in RECURRENCE_PATTERNS:
+        rule = f'RRULE:FREQ={pattern.upper()}'
+        if recurrence_end:
+            rule += f";UNTIL={recurrence_end.replace('-', '')}T235959Z"
+        lines.append(rule)
+        for original in sorted((exdates or '').split(',')):
+            if original:
+                lines.append(f"EXDATE:{original.replace('-', '')}{begin[8:]}")
+
+    lines.append(f'SUMMARY:{escape_text(name or "")}')
+    description = '\n'.join(part for part in (f'Client: {client_name}' if client_name else None, notes) if part)
+    if description:
+        lines.append(f'DESCRIPTION:{escape_text(description)}')
+    if event_location:
+        location = event_location
+    else:
+        location = ', '.join(part for part in (location_name, location_address if location_name else None) if part)
+    if location:
+        lines.append(f'LOCATION:{escape_text(location)}')
+    lines.append(f"STATUS:{_STATUSES.get(status, 'TENTATIVE')}")
+    lines.append(f'URL:{url_template.format(event_id)}')
+    lines.append('END:VEVENT')
+    return ''.join(fold_line(line) for line in lines)
+
+
+class VeventCache:
+    """LRU of serialized VEVENTs: (database, event id) -> (revision, url template, text)"""
+
+    def __init__(self, size=50000):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def render(self, path, rows, url_template):
+        """VEVENT texts for a batch of EXPORT_QUERY rows, rendering only the misses"""
+        texts = [None] * len(rows)
+        with self._lock:
+            for index, row in enumerate(rows):
+                entry = self._entries.get((path, row[0]))
+                if entry is not None and entry[0] == row[1] and entry[1] == url_template:
+                    self._entries.move_to_end((path, row[0]))
+                    texts[index] = entry[2]
+        misses = [index for index, text in enumerate(texts) if text is None]
+        for index in misses:
+            texts[index] = render_vevent(rows[index], url_template)
+        if misses and self.size > 0:
+            with self._lock:
+                for index in misses:
+                    self._entries[(path, rows[index][0])] = (rows[index][1], url_template, texts[index])
+                    self._entries.move_to_end((path, rows[index][0]))
+                while len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+        return texts
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Shared by every export in this process
+vevent_cache = VeventCache()
+
+
+def calendar_cursor(db, conditions=(), params=()):
+    """Run the export query for the non-cancelled events matching conditions"""
+    where = ' AND '.join(("e.status != 'cancelled'",) + tuple(conditions))
+    return db.execute(f'{EXPORT_QUERY} WHERE {where} ORDER BY e.event_id', list(params))
+
+
+def stream_calendar(db, url_template, conditions=(), params=(), batch_size=500, cache=None, name=None):
+    """Return a generator yielding the VCALENDAR text in chunks.
+
+    The query runs before the first chunk, so errors surface while a normal
+    error response is still possible.  Cached VEVENTs are reused unless the
+    database is in memory or db has uncommitted changes.  name is shown by
+    calendar apps as the calendar's title.
+    """
+    cache = vevent_cache if cache is None else cache
+    path = db.execute('PRAGMA database_list').fetchone()[2]
+    cursor = calendar_cursor(db, conditions, params)
+    cached = bool(path) and not db.in_transaction
+
+    def generate():
+        yield CALENDAR_HEADER + (fold_line(f'X-WR-CALNAME:{escape_text(name)}') if name else '')
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            if cached:
+                yield ''.join(cache.render(path, rows, url_template))
+            else:
+                yield ''.join(render_vevent(row, url_template) for row in rows)
+        yield CALENDAR_FOOTER
+
+    return generate()
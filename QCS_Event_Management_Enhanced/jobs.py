@@ -0,0 +1,293 @@
+# Background Jobs
+#
+# Slow work (calendar imports, feed fetches, invoice PDFs) is queued in the
+# jobs table and run outside the request, either by a small pool of worker
+# threads in the web process (JOBS_WORKERS) or by a separate
+# `flask run-jobs` process.  Routes enqueue a job and answer 202 with its
+# /jobs/<id> status URL straight away.
+#
+# Workers claim the oldest due job with one UPDATE ... RETURNING, so threads
+# and processes can share the table.  A handler gets a JobContext, reports
+# progress through it and returns a JSON-serializable result; any other
+# exception than JobError is retried with exponential backoff until the
+# job's max_attempts is reached.  Jobs left 'running' by a worker that died
+# are requeued once they are older than JOBS_STALE_SECONDS.
+#
+# Under gevent (run.py in production) threading is monkey-patched and a
+# worker "thread" would be a greenlet sharing the OS thread that serves
+# every request, so a PDF render or a long import would stall the site.
+# The in-process pool is therefore never started there; run
+# `flask run-jobs` as a separate process instead.
+import json
+import threading
+import traceback
+
+from flask import current_app, g, request, jsonify, flash, redirect, url_for
+
+from helpers import get_db
+
+JOB_STATUSES = ('queued', 'running', 'succeeded', 'failed')
+
+JOB_DEFAULTS = {
+    'JOBS_WORKERS': 2,
+    'JOBS_POLL_SECONDS': 5,
+    'JOBS_MAX_ATTEMPTS': 3,
+    'JOBS_RETRY_SECONDS': 30,
+    'JOBS_STALE_SECONDS': 3600,
+    'JOBS_RETENTION_DAYS': 7,
+}
+
+# Columns returned by the status API
+_STATUS_COLUMNS = ('id, kind, status, progress, message, result, error, attempts, max_attempts, '
+                   'run_after, created_by, created_at, started_at, finished_at, output_filename')
+
+_handlers = {}
+
+
+class JobError(Exception):
+    """A job failure that retrying cannot fix (bad input, missing data)"""
+
+
+def job_handler(kind):
+    """Register the decorated function as the handler for jobs of the given kind"""
+    def register(func):
+        _handlers[kind] = func
+        return func
+    return register
+
+
+def _setting(app, key):
+    return app.config.get(key, JOB_DEFAULTS[key])
+
+
+class JobContext:
+    """What a handler sees of the job it runs"""
+
+    def __init__(self, job_id, kind, payload, attempt, user_id):
+        self.id = job_id
+        self.kind = kind
+        self.payload = payload
+        self.attempt = attempt
+        self.user_id = user_id
+        self.output = None
+        self._pending = None
+
+    def progress(self, percent, message=None):
+        """Record progress (0-100) for the status API.
+
+        The handler's own transaction is never committed for it: while the
+        handler holds uncommitted writes, the latest progress waits for the
+        next call made outside a transaction (success sets 100 anyway).
+        """
+        self._pending = (max(0, min(100, int(percent))), message)
+        if 'db' in g:
+            if g.db.in_transaction:
+                return
+            self._write_progress(g.db)
+            return
+        with current_app.app_context():
+            self._write_progress(get_db(write=True))
+
+    def _write_progress(self, db):
+        percent, message = self._pending
+        self._pending = None
+        db.execute('UPDATE jobs SET progress = ?, message = ? WHERE id = ?', (percent, message, self.id))
+        db.commit()
+
+    def set_output(self, data, mimetype, filename):
+        """Attach a file (e.g. a rendered PDF) that /jobs/<id>/output will serve"""
+        self.output = (data, mimetype, filename)
+
+
+def enqueue(db, kind, payload=None, user_id=None, max_attempts=None):
+    """Queue a job and return its id.  Commits, then wakes the worker threads."""
+    if kind not in _handlers:
+        raise ValueError(f'Unknown job kind: {kind}')
+    app = current_app._get_current_object()
+    cursor = db.execute(
+        'INSERT INTO jobs (kind, payload, max_attempts, created_by) VALUES (?, ?, ?, ?)',
+        (kind, json.dumps(payload or {}), max_attempts or _setting(app, 'JOBS_MAX_ATTEMPTS'), user_id)
+    )
+    db.commit()
+    runner.wake(app)
+    return cursor.lastrowid
+
+
+def job_accepted(job_id, message, redirect_to):
+    """Response for a route that queued job_id.
+
+    API clients get 202 with the status URL; browsers are sent on to
+    redirect_to with a flash message.
+    """
+    status_url = url_for('jobs.job_status_api', job_id=job_id)
+    if (request.is_json or request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+            or request.accept_mimetypes.best == 'application/json'):
+        response = jsonify({'success': True, 'job_id': job_id, 'status_url': status_url})
+        response.status_code = 202
+        response.headers['Location'] = status_url
+        return response
+    flash(f'{message}; follow its progress at {status_url}', 'info')
+    return redirect(redirect_to)
+
+
+def job_status(db, job_id):
+    """Status dict of a job for the /jobs API, or None when it does not exist"""
+    row = db.execute(f'SELECT {_STATUS_COLUMNS} FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    if row is None:
+        return None
+    job = dict(row)
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    job['has_output'] = job.pop('output_filename') is not None
+    return job
+
+
+def _claim(db, stale_seconds):
+    """Mark the next due job as running and return it, or None"""
+    db.execute(
+        """UPDATE jobs SET status = 'queued'
+           WHERE status = 'running' AND started_at < datetime('now', ?)""",
+        (f'-{int(stale_seconds)} seconds',)
+    )
+    claimed = db.execute(
+        """UPDATE jobs SET status = 'running', attempts = attempts + 1, progress = 0,
+                          message = NULL, started_at = datetime('now')
+           WHERE id = (SELECT id FROM jobs
+                       WHERE status = 'queued' AND run_after <= datetime('now')
+                       ORDER BY run_after, id LIMIT 1)
+           RETURNING id, kind, payload, attempts, max_attempts, created_by"""
+    ).fetchall()
+    db.commit()
+    return claimed[0] if claimed else None
+
+
+def _finish(db, job, context, result):
+    output = context.output or (None, None, None)
+    db.execute(
+        """UPDATE jobs SET status = 'succeeded', progress = 100, result = ?, error = NULL,
+                          output = ?, output_mimetype = ?, output_filename = ?,
+                          finished_at = datetime('now')
+           WHERE id = ?""",
+        (json.dumps(result), *output, job['id'])
+    )
+
+
+def _fail(db, job, error, retry_seconds):
+    """Requeue the job with backoff, or mark it failed when it is out of attempts"""
+    error_type, message = error
+    if error_type is not JobError and job['attempts'] < job['max_attempts']:
+        delay = retry_seconds * 2 ** (job['attempts'] - 1)
+        db.execute(
+            """UPDATE jobs SET status = 'queued', error = ?, run_after = datetime('now', ?)
+               WHERE id = ?""",
+            (message, f'+{int(delay)} seconds', job['id'])
+        )
+    else:
+        db.execute(
+            """UPDATE jobs SET status = 'failed', error = ?, finished_at = datetime('now')
+               WHERE id = ?""",
+            (message, job['id'])
+        )
+
+
+def run_next(app):
+    """Claim and run the next due job in this thread.
+
+    Returns the job id, or None when nothing is due.  The handler runs in a
+    request context of its own, so url_for/render_template work as in a
+    route; get_db() gives it a read-only connection and get_db(write=True)
+    the writer, which is only taken once the handler asks for it so slow
+    fetches or rendering do not block other writes.
+    """
+    with app.app_context():
+        job = _claim(get_db(), _setting(app, 'JOBS_STALE_SECONDS'))
+    if job is None:
+        return None
+
+    context = JobContext(job['id'], job['kind'], json.loads(job['payload']), job['attempts'],
+                         job['created_by'])
+    result = error = None
+    with app.test_request_context():
+        try:
+            handler = _handlers.get(job['kind'])
+            if handler is None:
+                raise JobError(f"No handler for job kind '{job['kind']}'")
+            result = handler(context)
+            if 'db' in g:
+                g.db.commit()
+        except JobError as failure:
+            error = (JobError, str(failure))
+        except Exception:
+            # Unfinished work is rolled back when the connection goes back to the pool
+            error = (Exception, traceback.format_exc(limit=5))
+
+    with app.app_context():
+        db = get_db()
+        if error:
+            _fail(db, job, error, _setting(app, 'JOBS_RETRY_SECONDS'))
+        else:
+            _finish(db, job, context, result)
+        # Finished jobs (and their output) are kept for a while for the status API
+        db.execute(
+            """DELETE FROM jobs WHERE finished_at < datetime('now', ?)""",
+            (f"-{int(_setting(app, 'JOBS_RETENTION_DAYS'))} days",)
+        )
+        db.commit()
+    return job['id']
+
+
+def green_threads():
+    """True when gevent has monkey-patched threading, i.e. new threads would be greenlets"""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('threading')
+
+
+class JobRunner:
+    """Pool of daemon threads running due jobs"""
+
+    def __init__(self):
+        self._threads = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+
+    def start(self, app, workers):
+        """Make sure workers threads are running for app (never under gevent, see above)"""
+        if green_threads():
+            return
+        with self._lock:
+            self._stop.clear()
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            while len(self._threads) < workers:
+                thread = threading.Thread(target=self.work, args=(app,), daemon=True,
+                                          name=f'job-worker-{len(self._threads) + 1}')
+                thread.start()
+                self._threads.append(thread)
+
+    def wake(self, app):
+        """Signal that a job was queued; starts the threads on first use"""
+        workers = _setting(app, 'JOBS_WORKERS')
+        if workers > 0:
+            self.start(app, workers)
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def work(self, app):
+        """Run jobs until stopped, sleeping up to JOBS_POLL_SECONDS while the queue is empty"""
+        while not self._stop.is_set():
+            try:
+                if run_next(app) is not None:
+                    continue
+            except Exception:
+                traceback.print_exc()
+            self._wake.wait(_setting(app, 'JOBS_POLL_SECONDS'))
+            self._wake.clear()
+
+
+# Shared by every request handled in this process
+runner = JobRunner()
@@ -0,0 +1,375 @@
+# Schema Migrations
+#
+# schema.sql describes the baseline (version 0) database.  Every later schema
+# change is a numbered migration below; the version reached is stored in
+# PRAGMA user_version so an existing database.db can be upgraded in place.
+# A migration step is either an SQL string or a callable taking the connection.
+
+
+def _revision_triggers(table, actions):
+    """Triggers bumping the events revision in sync_state whenever table changes"""
+    return [f'''CREATE TRIGGER IF NOT EXISTS {table}_revision_{action.lower()}
+                AFTER {action} ON {table}
+                BEGIN
+                    UPDATE sync_state SET revision = revision + 1 WHERE name = 'events';
+                END'''
+            for action in actions]
+
+
+_BUMP_REVISION = "UPDATE sync_state SET revision = revision + 1 WHERE name = 'events';"
+_CURRENT_REVISION = "(SELECT revision FROM sync_state WHERE name = 'events')"
+
+
+def _related_revision_triggers(table, key, event_column):
+    """Triggers re-stamping the events that reference a changed or deleted row of table"""
+    return [f'''CREATE TRIGGER {table}_revision_{action.lower()}
+                AFTER {action} ON {table}
+                BEGIN
+                    {_BUMP_REVISION}
+                    UPDATE events SET revision = {_CURRENT_REVISION}
+                    WHERE {event_column} = OLD.{key};
+                END'''
+            for action in ('UPDATE', 'DELETE')]
+
+
+# Columns of events a subscription feed renders or filters on (see ics_writer.py)
+_SUBSCRIPTION_COLUMNS = ('event_name, event_date, end_date, drop_off_time, pickup_time, is_recurring, '
+                         'recurrence_pattern, recurrence_end_date, notes, event_location, status, ics_uid, '
+                         'last_updated, client_id, category_id, location_id, manager, '
+                         'parent_event_id, original_start_date')
+
+# Today as an epoch day, in the server's local time like date.today()
+_TODAY = "CAST(julianday('now', 'localtime') - 2440587.5 AS INTEGER)"
+
+_BUMP_SUBSCRIPTIONS = "UPDATE calendar_subscriptions SET revision = revision + 1, changed_at = datetime('now')"
+
+
+def _subscription_match(row):
+    """Predicate on calendar_subscriptions matching the filters and horizon an events row passes.
+
+    row is NEW, OLD or a table alias; subscription columns are qualified
+    so the predicate also works inside a subquery on events.
+    """
+    s = 'calendar_subscriptions'
+    return (f"(({s}.client_id IS NULL OR {s}.client_id = {row}.client_id) "
+            f"AND ({s}.category_id IS NULL OR {s}.category_id = {row}.category_id) "
+            f"AND ({s}.location_id IS NULL OR {s}.location_id = {row}.location_id) "
+            f"AND ({s}.manager IS NULL OR {s}.manager = {row}.manager COLLATE NOCASE) "
+            # The same day ranges as subscriptions.subscription_conditions; a NULL bound is open
+            f"AND ({s}.days_ahead IS NULL OR {row}.start_day <= {_TODAY} + {s}.days_ahead) "
+            f"AND ({s}.days_back IS NULL OR {row}.end_day >= {_TODAY} - {s}.days_back "
+            f"OR (IFNULL({row}.is_recurring, 0) = 1 AND ({row}.recurrence_end_day IS NULL "
+            f"OR {row}.recurrence_end_day + {row}.span_days >= {_TODAY} - {s}.days_back))))")
+
+
+def _subscription_row_match(row):
+    """_subscription_match for an events row, or for the series master whose EXDATEs it changes"""
+    return (f"{_subscription_match(row)} OR EXISTS (SELECT 1 FROM events m "
+            f"WHERE m.event_id = {row}.parent_event_id AND {row}.original_start_date IS NOT NULL "
+            f"AND {_subscription_match('m')})")
+
+
+def _subscription_triggers():
+    """Triggers invalidating the subscriptions whose filters an inserted, changed or deleted event passes.
+
+    Updates only fire for the columns a feed shows or filters on, so the
+    revision re-stamp and flags such as has_conflicts do not bump again.
+    """
+    rows = {'INSERT': ('NEW',), 'UPDATE': ('NEW', 'OLD'), 'DELETE': ('OLD',)}
+    events = {'INSERT': 'INSERT', 'UPDATE': f'UPDATE OF {_SUBSCRIPTION_COLUMNS}', 'DELETE': 'DELETE'}
+    return [f'''CREATE TRIGGER events_subscription_{action.lower()} AFTER {events[action]} ON events
+                BEGIN
+                    {_BUMP_SUBSCRIPTIONS}
+                    WHERE {' OR '.join(_subscription_row_match(row) for row in rows[action])};
+                END'''
+            for action in ('INSERT', 'UPDATE', 'DELETE')]
+
+
+def _related_subscription_triggers(table, columns, event_column):
+    """Triggers invalidating the subscriptions that show events referencing a renamed or deleted row of table"""
+    return [f'''CREATE TRIGGER {table}_subscription_{action.lower()} AFTER {event} ON {table}
+                BEGIN
+                    {_BUMP_SUBSCRIPTIONS}
+                    WHERE EXISTS (SELECT 1 FROM events e
+                                  WHERE e.{event_column} = OLD.id AND {_subscription_match('e')});
+                END'''
+            for action, event in (('UPDATE', f'UPDATE OF {columns}'), ('DELETE', 'DELETE'))]
+
+
+MIGRATIONS = [
+    (1, 'Performance index pack', [
+        # Calendar filters, client/location pages and the dashboard status counts
+        'CREATE INDEX IF NOT EXISTS idx_events_client ON events(client_id, event_date)',
+        'CREATE INDEX IF NOT EXISTS idx_events_location ON events(location_id, event_date)',
+        'CREATE INDEX IF NOT EXISTS idx_events_status ON events(status, event_date)',
+        'CREATE INDEX IF NOT EXISTS idx_events_parent ON events(parent_event_id)',
+        'CREATE INDEX IF NOT EXISTS idx_events_category ON events(category_id)',
+        'CREATE INDEX IF NOT EXISTS idx_events_template ON events(template_id)',
+        'CREATE INDEX IF NOT EXISTS idx_events_has_conflicts ON events(has_conflicts, event_date)',
+        # Conflict maintenance looks rows up from both sides
+        'CREATE INDEX IF NOT EXISTS idx_event_conflicts_event ON event_conflicts(event_id, conflicting_event_id)',
+        'CREATE INDEX IF NOT EXISTS idx_event_conflicts_conflicting ON event_conflicts(conflicting_event_id)',
+        # Covering indexes for the conflict sweep and availability timelines
+        'CREATE INDEX IF NOT EXISTS idx_equipment_assignments_event '
+        'ON equipment_assignments(event_id, equipment_id, quantity)',
+        'CREATE INDEX IF NOT EXISTS idx_equipment_assignments_equipment '
+        'ON equipment_assignments(equipment_id, event_id, quantity)',
+        'CREATE INDEX IF NOT EXISTS idx_event_tasks_event ON event_tasks(event_id, is_completed, due_date)',
+        'CREATE INDEX IF NOT EXISTS idx_invoices_client ON invoices(client_id, status)',
+        'CREATE INDEX IF NOT EXISTS idx_invoices_event ON invoices(event_id)',
+        'CREATE INDEX IF NOT EXISTS idx_client_communications_client ON client_communications(client_id, date)',
+        'CREATE INDEX IF NOT EXISTS idx_password_reset_tokens_token ON password_reset_tokens(token)',
+        'CREATE INDEX IF NOT EXISTS idx_template_equipment_template ON template_equipment(template_id)',
+        'CREATE INDEX IF NOT EXISTS idx_elements_type ON elements(type_id)',
+        'CREATE INDEX IF NOT EXISTS idx_kit_elements_element ON kit_elements(element_id)',
+        'CREATE INDEX IF NOT EXISTS idx_event_elements_element ON event_elements(element_id)',
+    ]),
+    (2, 'Integer day and minute columns for event ranges', [
+        # Days since 1970-01-01; NULL when the stored date cannot be parsed
+        'ALTER TABLE events ADD COLUMN start_day INTEGER GENERATED ALWAYS AS '
+        "(CAST(julianday(date(event_date)) - 2440587.5 AS INTEGER)) VIRTUAL",
+        'ALTER TABLE events ADD COLUMN end_day INTEGER GENERATED ALWAYS AS '
+        "(CAST(julianday(date(COALESCE(end_date, event_date))) - 2440587.5 AS INTEGER)) VIRTUAL",
+        'ALTER TABLE events ADD COLUMN span_days INTEGER GENERATED ALWAYS AS (end_day - start_day) VIRTUAL',
+        # Minutes after midnight of the drop-off and pick-up times
+        'ALTER TABLE events ADD COLUMN start_minute INTEGER GENERATED ALWAYS AS '
+        "(CAST(strftime('%H', drop_off_time) AS INTEGER) * 60 + CAST(strftime('%M', drop_off_time) AS INTEGER)) VIRTUAL",
+        'ALTER TABLE events ADD COLUMN end_minute INTEGER GENERATED ALWAYS AS '
+        "(CAST(strftime('%H', pickup_time) AS INTEGER) * 60 + CAST(strftime('%M', pickup_time) AS INTEGER)) VIRTUAL",
+        'CREATE INDEX IF NOT EXISTS idx_events_day_range '
+        'ON events(start_day, end_day, start_minute, end_minute)',
+        # MAX(span_days) bounds the overlap scan (see helpers.overlap_condition)
+        'CREATE INDEX IF NOT EXISTS idx_events_span ON events(span_days)',
+    ]),
+    (3, 'Events revision counter', [
+        '''CREATE TABLE IF NOT EXISTS sync_state (
+               name TEXT PRIMARY KEY,
+               revision INTEGER NOT NULL DEFAULT 0
+           )''',
+        "INSERT OR IGNORE INTO sync_state (name, revision) VALUES ('events', 0)",
+        # Any change that can alter the /api/events payload bumps the revision
+        *_revision_triggers('events', ('INSERT', 'UPDATE', 'DELETE')),
+        *_revision_triggers('clients', ('UPDATE', 'DELETE')),
+        *_revision_triggers('event_categories', ('UPDATE', 'DELETE')),
+        *_revision_triggers('locations', ('UPDATE', 'DELETE')),
+    ]),
+    (4, 'Per-event revisions and delete tombstones', [
+        'ALTER TABLE events ADD COLUMN revision INTEGER NOT NULL DEFAULT 0',
+        'CREATE INDEX IF NOT EXISTS idx_events_revision ON events(revision)',
+        '''CREATE TABLE IF NOT EXISTS event_tombstones (
+               event_id INTEGER PRIMARY KEY,
+               revision INTEGER NOT NULL,
+               deleted_at TEXT NOT NULL DEFAULT (datetime('now'))
+           )''',
+        'CREATE INDEX IF NOT EXISTS idx_event_tombstones_revision ON event_tombstones(revision)',
+        # Replace the plain counters with triggers that also stamp the changed rows
+        *[f'DROP TRIGGER IF EXISTS {table}_revision_{action}'
+          for table, action in (('events', 'insert'), ('events', 'update'), ('events', 'delete'),
+                                ('clients', 'update'), ('clients', 'delete'),
+                                ('event_categories', 'update'), ('event_categories', 'delete'),
+                                ('locations', 'update'), ('locations', 'delete'))],
+        f'''CREATE TRIGGER events_revision_insert AFTER INSERT ON events
+            BEGIN
+                {_BUMP_REVISION}
+                UPDATE events SET revision = {_CURRENT_REVISION} WHERE event_id = NEW.event_id;
+            END''',
+        # Stamping changes the revision column, which stops the trigger re-firing on itself
+        f'''CREATE TRIGGER events_revision_update AFTER UPDATE ON events
+            WHEN NEW.revision IS OLD.revision
+            BEGIN
+                {_BUMP_REVISION}
+                UPDATE events SET revision = {_CURRENT_REVISION} WHERE event_id = NEW.event_id;
+            END''',
+        f'''CREATE TRIGGER events_revision_delete AFTER DELETE ON events
+            BEGIN
+                {_BUMP_REVISION}
+                INSERT OR REPLACE INTO event_tombstones (event_id, revision)
+                VALUES (OLD.event_id, {_CURRENT_REVISION});
+            END''',
+        # Renaming or recolouring a client, category or location changes its events' payload
+        *_related_revision_triggers('clients', 'id', 'client_id'),
+        *_related_revision_triggers('event_categories', 'id', 'category_id'),
+        *_related_revision_triggers('locations', 'id', 'location_id'),
+    ]),
+    (5, 'Recurring series lookups', [
+        # Last day a series occurrence may start (see recurrence.py); NULL when open-ended
+        'ALTER TABLE events ADD COLUMN recurrence_end_day INTEGER GENERATED ALWAYS AS '
+        "(CAST(julianday(date(recurrence_end_date)) - 2440587.5 AS INTEGER)) VIRTUAL",
+        'CREATE INDEX IF NOT EXISTS idx_events_series ON events(start_day, recurrence_end_day) '
+        'WHERE is_recurring = 1',
+        'CREATE INDEX IF NOT EXISTS idx_events_exceptions ON events(parent_event_id, original_start_date) '
+        'WHERE original_start_date IS NOT NULL',
+        # Adding, moving or removing an exception changes which occurrences the
+        # master expands to, so the master is re-stamped for delta sync
+        *[f'''CREATE TRIGGER events_exception_{action.lower()} AFTER {action} ON events
+              WHEN {row}.parent_event_id IS NOT NULL AND {row}.original_start_date IS NOT NULL
+              BEGIN
+                  {_BUMP_REVISION}
+                  UPDATE events SET revision = {_CURRENT_REVISION} WHERE event_id = {row}.parent_event_id;
+              END'''
+          for action, row in (('INSERT', 'NEW'), ('DELETE', 'OLD'))],
+        f'''CREATE TRIGGER events_exception_update AFTER UPDATE OF parent_event_id, original_start_date ON events
+            BEGIN
+                {_BUMP_REVISION}
+                UPDATE events SET revision = {_CURRENT_REVISION}
+                WHERE event_id IN (OLD.parent_event_id, NEW.parent_event_id);
+            END''',
+    ]),
+    (6, 'Background job queue', [
+        # See jobs.py; output holds a file produced by the job (e.g. an invoice PDF)
+        '''CREATE TABLE IF NOT EXISTS jobs (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               kind TEXT NOT NULL,
+               status TEXT NOT NULL DEFAULT 'queued'
+                   CHECK(status IN ('queued', 'running', 'succeeded', 'failed')),
+               payload TEXT NOT NULL DEFAULT '{}',
+               progress INTEGER NOT NULL DEFAULT 0,
+               message TEXT,
+               result TEXT,
+               error TEXT,
+               output BLOB,
+               output_mimetype TEXT,
+               output_filename TEXT,
+               attempts INTEGER NOT NULL DEFAULT 0,
+               max_attempts INTEGER NOT NULL DEFAULT 3,
+               run_after TEXT NOT NULL DEFAULT (datetime('now')),
+               created_by INTEGER,
+               created_at TEXT NOT NULL DEFAULT (datetime('now')),
+               started_at TEXT,
+               finished_at TEXT,
+               FOREIGN KEY (created_by) REFERENCES users(id)
+           )''',
+        'CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs(status, run_after)',
+        'CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs(finished_at) WHERE finished_at IS NOT NULL',
+    ]),
+    (7, 'Client aliases for import matching', [
+        # Extra names a client is known by in imported data (see client_index.py)
+        '''CREATE TABLE IF NOT EXISTS client_aliases (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               client_id INTEGER NOT NULL,
+               alias TEXT NOT NULL,
+               created_at TEXT NOT NULL DEFAULT (datetime('now')),
+               FOREIGN KEY (client_id) REFERENCES clients(id)
+           )''',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_client_aliases_alias ON client_aliases(alias COLLATE NOCASE)',
+        'CREATE INDEX IF NOT EXISTS idx_client_aliases_client ON client_aliases(client_id)',
+        # The aliases the sample import used to hard-code
+        *[f'''INSERT OR IGNORE INTO client_aliases (client_id, alias)
+              SELECT id, '{alias}' FROM clients
+              WHERE ({match}) AND lower(name) != lower('{alias}')
+              ORDER BY id LIMIT 1'''
+          for alias, match in (
+              ('RWJ', "lower(name) LIKE '%robert wood johnson%' OR lower(name) LIKE '%rwj%'"),
+              ('Robert Wood Johnson', "lower(name) LIKE '%robert wood johnson%' OR lower(name) LIKE '%rwj%'"),
+              ('Horizon', "lower(name) LIKE '%horizon%'"))],
+        # The cached client index is rebuilt when this revision moves
+        "INSERT OR IGNORE INTO sync_state (name, revision) VALUES ('clients', 0)",
+        *[f'''CREATE TRIGGER {table}_index_{action.lower()} AFTER {action} ON {table}
+              BEGIN
+                  UPDATE sync_state SET revision = revision + 1 WHERE name = 'clients';
+              END'''
+          for table in ('clients', 'client_aliases')
+          for action in ('INSERT', 'UPDATE', 'DELETE')],
+    ]),
+    (8, 'Calendar feed sync state', [
+        # Schedule, conditional-GET validators and last outcome of each feed (see feed_sync.py)
+        *[f'ALTER TABLE calendar_feeds ADD COLUMN {column}' for column in (
+            'sync_minutes INTEGER', 'next_sync_at TEXT', 'etag TEXT', 'last_modified TEXT',
+            'last_checked TEXT', 'last_status TEXT', 'last_error TEXT',
+            'last_fetch_ms INTEGER', 'last_apply_ms INTEGER', 'last_changed INTEGER')],
+        'CREATE INDEX IF NOT EXISTS idx_calendar_feeds_due ON calendar_feeds(next_sync_at) WHERE auto_sync = 1',
+        # Feeds were only ever saved when auto-sync was asked for, but without the flag
+        'UPDATE calendar_feeds SET auto_sync = 1',
+        # Content hash of every VEVENT a feed delivered, by UID
+        '''CREATE TABLE IF NOT EXISTS feed_events (
+               feed_id INTEGER NOT NULL,
+               uid TEXT NOT NULL,
+               content_hash TEXT NOT NULL,
+               event_id INTEGER,
+               PRIMARY KEY (feed_id, uid),
+               FOREIGN KEY (feed_id) REFERENCES calendar_feeds(id),
+               FOREIGN KEY (event_id) REFERENCES events(event_id)
+           ) WITHOUT ROWID''',
+    ]),
+    (9, 'Calendar subscriptions', [
+        # Token-authenticated, filtered ICS feeds (see subscriptions.py); NULL filters match everything
+        '''CREATE TABLE IF NOT EXISTS calendar_subscriptions (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               token TEXT NOT NULL UNIQUE,
+               name TEXT NOT NULL,
+               user_id INTEGER,
+               client_id INTEGER,
+               category_id INTEGER,
+               location_id INTEGER,
+               manager TEXT,
+               days_back INTEGER,
+               days_ahead INTEGER,
+               revision INTEGER NOT NULL DEFAULT 0,
+               changed_at TEXT NOT NULL DEFAULT (datetime('now')),
+               created_at TEXT NOT NULL DEFAULT (datetime('now')),
+               FOREIGN KEY (user_id) REFERENCES users(id),
+               FOREIGN KEY (client_id) REFERENCES clients(id),
+               FOREIGN KEY (category_id) REFERENCES event_categories(id),
+               FOREIGN KEY (location_id) REFERENCES locations(id)
+           )''',
+        'CREATE INDEX IF NOT EXISTS idx_calendar_subscriptions_user ON calendar_subscriptions(user_id)',
+        *_subscription_triggers(),
+    ]),
+    (10, 'Narrower subscription invalidation', [
+        # Updates fire only for the columns a feed shows, and horizons are honoured
+        *[f'DROP TRIGGER IF EXISTS events_subscription_{action}' for action in ('insert', 'update', 'delete')],
+        *_subscription_triggers(),
+        # Events are no longer matched on their re-stamped revision, so the
+        # client and location names a feed shows invalidate it directly
+        *_related_subscription_triggers('clients', 'name', 'client_id'),
+        *_related_subscription_triggers('locations', 'name, address', 'location_id'),
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(db):
+    """Return the schema version stored in the database"""
+    return db.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(db, target=None):
+    """Apply every pending migration up to target (default: latest).
+
+    Each migration runs in its own transaction together with the
+    user_version bump, so a failure leaves the database at the last good
+    version.  Statistics are refreshed with ANALYZE once anything was
+    applied.  Returns the list of (version, description) applied.
+    """
+    target = LATEST_VERSION if target is None else target
+
+    # Nothing to upgrade until the baseline schema exists
+    if not db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'events'").fetchone():
+        return []
+
+    current = schema_version(db)
+    applied = []
+    for version, description, steps in MIGRATIONS:
+        if version <= current or version > target:
+            continue
+        try:
+            if not db.in_transaction:
+                db.execute('BEGIN IMMEDIATE')
+            for step in steps:
+                if callable(step):
+                    step(db)
+                else:
+                    db.execute(step)
+            db.execute(f'PRAGMA user_version = {int(version)}')
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        applied.append((version, description))
+
+    if applied:
+        db.execute('ANALYZE')
+        db.commit()
+
+    return applied
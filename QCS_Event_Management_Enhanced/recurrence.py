@@ -0,0 +1,312 @@
+# Recurring Event Engine
+#
+# A series is stored as one master row (is_recurring = 1 with a daily,
+# weekly, monthly or yearly recurrence_pattern) whose event_date/end_date
+# describe the first occurrence and whose recurrence_end_date, when set, is
+# the last day an occurrence may start.  An occurrence that was moved or
+# edited on its own is an exception row: a normal event with parent_event_id
+# pointing at the master and original_start_date holding the occurrence it
+# replaces.
+#
+# Occurrences are never stored.  They are expanded on the fly for the
+# window being looked at, and the expansion is cached per (series, window);
+# the master's revision is part of the key, so edits invalidate it.
+import threading
+from collections import OrderedDict
+from datetime import date
+
+from helpers import EPOCH_ORDINAL, epoch_day, day_to_iso
+
+RECURRENCE_PATTERNS = ('daily', 'weekly', 'monthly', 'yearly')
+
+# SQL predicate matching series master rows; written as the WHERE clause of
+# the partial index idx_events_series so SQLite can use it
+SERIES_CONDITION = ("{alias}.is_recurring = 1 AND "
+                    "{alias}.recurrence_pattern IN ('daily', 'weekly', 'monthly', 'yearly')")
+
+# Its negation; NULL-safe so rows with NULL recurrence columns count as single events
+SINGLE_CONDITION = ("NOT (IFNULL({alias}.is_recurring, 0) = 1 AND "
+                    "IFNULL({alias}.recurrence_pattern, '') IN ('daily', 'weekly', 'monthly', 'yearly'))")
+
+# Columns every series query selects first, in the order expand_series reads them
+SERIES_COLUMNS = ('{alias}.event_id, {alias}.revision, {alias}.start_day, {alias}.span_days, '
+                  '{alias}.recurrence_pattern, {alias}.recurrence_end_day')
+
+# Open-ended series are expanded this far past today when no window is given
+HORIZON_DAYS = 730
+
+# Lower bound of the "everything" window
+FIRST_DAY = epoch_day('0001-01-01')
+
+# Separator between the master id and the occurrence date in virtual ids
+VIRTUAL_ID_SEPARATOR = '_'
+
+_STEP_DAYS = {'daily': 1, 'weekly': 7}
+_STEP_MONTHS = {'monthly': 1, 'yearly': 12}
+
+
+def series_condition(alias='e'):
+    """SQL predicate matching series master rows of the given table alias"""
+    return SERIES_CONDITION.format(alias=alias)
+
+
+def single_condition(alias='e'):
+    """SQL predicate matching every row that is not a series master"""
+    return SINGLE_CONDITION.format(alias=alias)
+
+
+def window_condition(start_day, end_day, alias='e'):
+    """SQL predicate and params matching series that can have occurrences in the window"""
+    return (f'{series_condition(alias)} AND {alias}.start_day <= ? '
+            f'AND ({alias}.recurrence_end_day IS NULL OR {alias}.recurrence_end_day + {alias}.span_days >= ?)',
+            [end_day, start_day])
+
+
+def series_columns(alias='e'):
+    """SELECT list of the columns expand_series needs, for the given table alias"""
+    return SERIES_COLUMNS.format(alias=alias)
+
+
+def horizon_day():
+    """Last day open-ended series are expanded to when no window is given"""
+    return epoch_day(date.today()) + HORIZON_DAYS
+
+
+def default_window():
+    """Window used when a caller asks for every occurrence"""
+    return FIRST_DAY, horizon_day()
+
+
+def virtual_id(series_id, start_day):
+    """Id of the occurrence of series_id starting on start_day"""
+    return f'{series_id}{VIRTUAL_ID_SEPARATOR}{day_to_iso(start_day)}'
+
+
+def parse_event_id(value):
+    """Split an event or occurrence id into (event_id, occurrence date or None).
+
+    Raises ValueError for anything else.
+    """
+    value = str(value)
+    if VIRTUAL_ID_SEPARATOR in value:
+        series_id, occurrence = value.split(VIRTUAL_ID_SEPARATOR, 1)
+        epoch_day(occurrence)  # Validates the date
+        return int(series_id), occurrence
+    return int(value), None
+
+
+def occurrence_days(start_day, span, pattern, until_day, window_start, window_end):
+    """Start days of the occurrences of a series that overlap [window_start, window_end].
+
+    Monthly and yearly series keep the day of month of the first occurrence;
+    months without that day (e.g. the 31st, or 29 February) are skipped.
+    """
+    span = span or 0
+    first = max(start_day, window_start - span)
+    last = window_end if until_day is None else min(window_end, until_day)
+    if first > last:
+        return []
+
+    step = _STEP_DAYS.get(pattern)
+    if step:
+        skip = -(-(first - start_day) // step)  # Occurrences starting before first
+        return list(range(start_day + skip * step, last + 1, step))
+
+    step = _STEP_MONTHS[pattern]
+    origin = date.fromordinal(start_day + EPOCH_ORDINAL)
+    first_date = date.fromordinal(first + EPOCH_ORDINAL)
+    index = max(0, ((first_date.year - origin.year) * 12 + first_date.month - origin.month) // step)
+
+    days = []
+    while True:
+        month = origin.month - 1 + index * step
+        index += 1
+        try:
+            day = date(origin.year + month // 12, month % 12 + 1, origin.day).toordinal() - EPOCH_ORDINAL
+        except ValueError:
+            continue
+        if day > last:
+            return days
+        if day >= first:
+            days.append(day)
+
+
+class ExpansionCache:
+    """Bounded LRU of occurrence days keyed by (series, revision, window)"""
+
+    def __init__(self, size=1024):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            days = self._entries.get(key)
+            if days is not None:
+                self._entries.move_to_end(key)
+            return days
+
+    def put(self, key, days):
+        with self._lock:
+            self._entries[key] = days
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+cache = ExpansionCache()
+
+
+def expand(series_id, revision, start_day, span, pattern, until_day, window_start, window_end):
+    """Cached occurrence_days for one series"""
+    key = (series_id, revision, window_start, window_end)
+    days = cache.get(key)
+    if days is None:
+        days = tuple(occurrence_days(start_day, span, pattern, until_day, window_start, window_end))
+        cache.put(key, days)
+    return days
+
+
+def exception_days(db, series_ids):
+    """{series_id: set of occurrence start days replaced by exception rows}"""
+    series_ids = list(series_ids)
+    if not series_ids:
+        return {}
+    placeholders = ','.join('?' * len(series_ids))
+    replaced = {}
+    for series_id, original in db.execute(
+            f'''SELECT parent_event_id, original_start_date FROM events
+                WHERE parent_event_id IN ({placeholders}) AND original_start_date IS NOT NULL''',
+            series_ids):
+        try:
+            replaced.setdefault(series_id, set()).add(epoch_day(original))
+        except ValueError:
+            continue
+    return replaced
+
+
+def expand_series(db, masters, window_start, window_end):
+    """Yield (master, start_day) for every occurrence of masters in the window.
+
+    masters are rows starting with the series_columns(); occurrences replaced
+    by exception rows are skipped (the exception rows are events of their own).
+    """
+    replaced = exception_days(db, {master[0] for master in masters})
+    for master in masters:
+        series_id, revision, start_day, span, pattern, until_day = master[:6]
+        skip = replaced.get(series_id, ())
+        for day in expand(series_id, revision, start_day, span or 0, pattern, until_day,
+                          window_start, window_end):
+            if day not in skip:
+                yield master, day
+
+
+# --- Series edits ---
+#
+# Moving "all" or "future" occurrences shifts every row of the series by the
+# same relative delta as the occurrence that was dragged, so a weekly series
+# stays weekly.  The delta is a (days, minutes) pair applied with SQLite date
+# modifiers; rows without a time only move by days.  Each edit is a handful
+# of set-based statements no matter how many rows the series has.
+
+def _moved(date_column, time_column, shift):
+    """SQL expressions for date_column/time_column moved by the named (days, minutes) shift"""
+    moment = f"{date_column} || ' ' || {time_column}"
+    return (f'CASE WHEN {time_column} IS NULL THEN date({date_column}, :{shift}_days) '
+            f'ELSE IFNULL(date({moment}, :{shift}_days, :{shift}_minutes), {date_column}) END',
+            # Keep the stored 'HH:MM' or 'HH:MM:SS' format
+            f'IFNULL(substr(time({time_column}, :{shift}_minutes), 1, length({time_column})), {time_column})')
+
+
+_START_DATE, _START_TIME = _moved('event_date', 'drop_off_time', 'start')
+_END_DATE, _END_TIME = _moved('end_date', 'pickup_time', 'end')
+
+SHIFT_SERIES_QUERY = f'''
+    UPDATE events SET
+        event_date = {_START_DATE},
+        drop_off_time = {_START_TIME},
+        end_date = {_END_DATE},
+        pickup_time = {_END_TIME},
+        original_start_date = date(original_start_date, :start_days),
+        recurrence_end_date = date(recurrence_end_date, :start_days),
+        last_updated = datetime('now'),
+        last_updated_by = :user_id
+    WHERE event_id = :series_id OR parent_event_id = :series_id
+'''
+
+# Columns a split-off series copies from the original master
+_SERIES_COPY_COLUMNS = ('event_name, client_id, category_id, template_id, drop_off_time, pickup_time, '
+                        'is_all_day, is_recurring, recurrence_pattern, recurrence_end_date, manager, '
+                        'onsite_contact, onsite_contact_phone, event_location, location_id, '
+                        'items_needed, boxes_from_pi, notes, status')
+
+
+def _time_minutes(value):
+    """'HH:MM[:SS]' -> minutes after midnight"""
+    hours, minutes = value.split(':')[:2]
+    return int(hours) * 60 + int(minutes)
+
+
+def time_shift(old_date, old_time, new_date, new_time):
+    """(days, minutes) that move old_date/old_time to new_date/new_time.
+
+    The minutes are 0 unless both times are known.
+    """
+    minutes = 0
+    if old_time and new_time:
+        minutes = _time_minutes(new_time) - _time_minutes(old_time)
+    return epoch_day(new_date) - epoch_day(old_date), minutes
+
+
+def shift_series(db, series_id, start_shift, end_shift, user_id=None):
+    """Move a master and every row attached to it by relative (days, minutes) shifts.
+
+    Exception rows keep replacing the same occurrence because their
+    original_start_date moves with the series.  Runs inside the caller's
+    transaction; returns the ids of the rows that moved.
+    """
+    db.execute(SHIFT_SERIES_QUERY, {
+        'start_days': f'{start_shift[0]:+d} days', 'start_minutes': f'{start_shift[1]:+d} minutes',
+        'end_days': f'{end_shift[0]:+d} days', 'end_minutes': f'{end_shift[1]:+d} minutes',
+        'series_id': series_id, 'user_id': user_id,
+    })
+    return [row[0] for row in db.execute(
+        'SELECT event_id FROM events WHERE event_id = ? OR parent_event_id = ?', (series_id, series_id))]
+
+
+def split_series(db, series_id, occurrence, ics_uid, user_id=None):
+    """End a series before occurrence and continue it as a new series from there.
+
+    The new master copies the original (including its equipment) and takes
+    over the exception and instance rows from occurrence on.  Runs inside the
+    caller's transaction; returns the new master's id.
+    """
+    cursor = db.execute(
+        f'''INSERT INTO events (ics_uid, event_date, end_date, created_by, {_SERIES_COPY_COLUMNS})
+            SELECT ?, date(?), CASE WHEN end_date IS NULL THEN NULL ELSE date(?, span_days || ' days') END,
+                   ?, {_SERIES_COPY_COLUMNS}
+            FROM events WHERE event_id = ?''',
+        (ics_uid, occurrence, occurrence, user_id, series_id)
+    )
+    new_series_id = cursor.lastrowid
+    db.execute(
+        '''INSERT INTO equipment_assignments (event_id, equipment_id, quantity, assigned_by)
+           SELECT ?, equipment_id, quantity, ? FROM equipment_assignments WHERE event_id = ?''',
+        (new_series_id, user_id, series_id)
+    )
+    db.execute(
+        '''UPDATE events SET parent_event_id = ?
+           WHERE parent_event_id = ? AND IFNULL(original_start_date, event_date) >= ?''',
+        (new_series_id, series_id, occurrence)
+    )
+    db.execute(
+        '''UPDATE events SET recurrence_end_date = date(?, '-1 day'), last_updated = datetime('now'),
+                             last_updated_by = ?
+           WHERE event_id = ?''',
+        (occurrence, user_id, series_id)
+    )
+    return new_series_id
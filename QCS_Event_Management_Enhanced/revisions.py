@@ -0,0 +1,32 @@
+# Event Revisions
+#
+# sync_state.revision counts every change that can alter the calendar feed.
+# It is maintained by triggers (see migrations 3 and 4), so every write path
+# bumps it without extra code, and reading it is a single primary-key lookup.
+# Each event row carries the revision of its last change and deletes leave a
+# tombstone, which lets /api/events/changes send only what a client missed.
+import hashlib
+
+from recurrence import horizon_day
+
+# Bump when the /api/events payload format changes so cached copies are dropped
+EVENTS_FEED_FORMAT = 1
+
+
+def current_revision(db, name='events'):
+    """Return the current revision counter for a sync stream"""
+    row = db.execute('SELECT revision FROM sync_state WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else 0
+
+
+def events_etag(revision, args):
+    """Strong ETag for an /api/events response: feed revision plus the normalized query.
+
+    Without a start/end range open-ended series are expanded up to
+    horizon_day(), which moves daily, so the tag carries that day too.
+    """
+    query = '&'.join(f'{key}={value}' for key, value in sorted(args.items(multi=True)))
+    if not (args.get('start') and args.get('end')):
+        query += f'|horizon={horizon_day()}'
+    digest = hashlib.sha1(query.encode('utf-8')).hexdigest()[:16]
+    return f'events-{EVENTS_FEED_FORMAT}-{revision}-{digest}'
@@ -79,14 +79,41 @@ def main():
     print("\n🔄 Starting server...")
     print("-" * 50)
     
+    # Live calendar updates keep a server-sent events stream open per browser tab;
+    # gevent (optional) serves each idle stream from a greenlet instead of a thread
+    WSGIServer = None
+    if not debug:
+        try:
+            from gevent import monkey
+            monkey.patch_all()  # Must run before the app imports threading/queue/socket
+            from gevent.pywsgi import WSGIServer
+            print("⚡ Serving with gevent")
+        except ImportError:
+            print("⚠️  gevent not installed, live updates hold one thread per open calendar")
+    
     # Import and run the Flask app
     try:
         from app import app
-        app.run(
-            host=host,
-            port=int(port),
-            debug=debug
-        )
+        # Pick up jobs queued before a restart; JOBS_WORKERS=0 leaves them to `flask run-jobs`
+        from jobs import runner
+        from feed_sync import scheduler
+        if WSGIServer:
+            # Worker threads would be greenlets blocking the server; see jobs.py
+            app.config['JOBS_WORKERS'] = 0
+            print("📋 Background jobs need a separate worker process: flask run-jobs")
+        if app.config['JOBS_WORKERS'] > 0:
+            runner.start(app, app.config['JOBS_WORKERS'])
+            # Queues auto-sync feed refreshes for those workers
+            scheduler.start(app)
+        if WSGIServer:
+            WSGIServer((host, int(port)), app).serve_forever()
+        else:
+            app.run(
+                host=host,
+                port=int(port),
+                debug=debug,
+                threaded=True
+            )
     except ImportError as e:
         print(f"❌ Failed to import application: {e}")
         print("💡 Make sure all dependencies are installed:")
@@ -19,6 +19,12 @@ DROP TABLE IF EXISTS locations;
 DROP TABLE IF EXISTS calendar_feeds;
 DROP TABLE IF EXISTS password_reset_tokens;
 DROP TABLE IF EXISTS users;
+DROP TABLE IF EXISTS sync_state;
+DROP TABLE IF EXISTS event_tombstones;
+DROP TABLE IF EXISTS jobs;
+DROP TABLE IF EXISTS client_aliases;
+DROP TABLE IF EXISTS feed_events;
+DROP TABLE IF EXISTS calendar_subscriptions;
 
 -- User Authentication
 CREATE TABLE users (
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+QCS Event Management Application - Calendar Feed Benchmark
+Compare the columnar /api/events serializer with the previous row-at-a-time loop
+"""
+
+import os
+import sys
+import json
+import sqlite3
+import argparse
+import time
+from datetime import datetime, timedelta, date
+
+# Add the application directory to the Python path
+app_dir = os.path.join(os.path.dirname(__file__), '..')
+sys.path.insert(0, app_dir)
+
+from flask import url_for, jsonify
+from app import app
+from migrations import migrate
+from event_feed import EVENTS_FEED_QUERY, fetch_event_feed, serialize_event_feed, dump_json, orjson
+
+def build_database(event_count):
+    """Create an in-memory database holding event_count generated events"""
+    db = sqlite3.connect(':memory:')
+    db.row_factory = sqlite3.Row
+    with open(os.path.join(app_dir, 'schema.sql')) as f:
+        db.executescript(f.read())
+    migrate(db)
+
+    db.execute("INSERT INTO locations (id, name) VALUES (1, 'Main Hall')")
+    statuses = ['booked', 'confirmed', 'completed', 'cancelled']
+    first_day = date(2025, 7, 1)
+    rows = []
+    for i in range(event_count):
+        event_date = first_day + timedelta(days=i % 90)
+        all_day = i % 3 == 0
+        end_date = (event_date + timedelta(days=i % 4)).isoformat() if i % 2 else None
+        rows.append((
+            f'Event {i}', 1 + i % 2, event_date.isoformat(), end_date,
+            None if all_day else f'{8 + i % 10:02d}:{(i % 4) * 15:02d}',
+            None if all_day else f'{12 + i % 8:02d}:00',
+            statuses[i % 4], int(all_day), i % 7 == 0, i % 11 == 0,
+            1 if i % 5 == 0 else None, f'Venue {i % 20}' if i % 5 else None
+        ))
+    db.executemany(
+        '''INSERT INTO events (event_name, client_id, event_date, end_date, drop_off_time, pickup_time,
+                               status, is_all_day, has_conflicts, is_recurring, location_id, event_location)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+    db.commit()
+    return db
+
+def row_at_a_time(db):
+    """The original api_events loop: sqlite3.Row, url_for and strptime per row, jsonify"""
+    events_list = []
+    for event in db.execute(EVENTS_FEED_QUERY + ' ORDER BY e.event_date').fetchall():
+        start_time = event['drop_off_time'] or '00:00:00'
+        if start_time and len(start_time) == 5:
+            start_time += ':00'
+        event_dict = {
+            'id': event['event_id'],
+            'title': event['event_name'],
+            'start': f"{event['event_date']}T{start_time}",
+            'color': event['category_color'] or event['client_color'] or '#3788d8',
+            'textColor': '#ffffff',
+            'borderColor': event['client_color'] or '#3788d8',
+            'url': url_for('calendar.view_event', event_id=event['event_id']),
+            'allDay': bool(event['is_all_day'])
+        }
+        if event['end_date']:
+            if event['is_all_day']:
+                end_date = datetime.strptime(event['end_date'], '%Y-%m-%d') + timedelta(days=1)
+                event_dict['end'] = end_date.strftime('%Y-%m-%d')
+            else:
+                event_dict['end'] = f"{event['end_date']}T{event['pickup_time'] or '23:59:59'}"
+        elif event['pickup_time']:
+            end_time = event['pickup_time']
+            if end_time and len(end_time) == 5:
+                end_time += ':00'
+            event_dict['end'] = f"{event['event_date']}T{end_time}"
+        classNames = []
+        if event['status']:
+            classNames.append(f"event-{event['status']}")
+        if event['has_conflicts']:
+            classNames.append('event-conflict')
+        if event['is_recurring']:
+            classNames.append('event-recurring')
+        if classNames:
+            event_dict['classNames'] = classNames
+        event_dict['extendedProps'] = {
+            'client_id': event['client_id'],
+            'client_name': event['client_name'],
+            'category_id': event['category_id'],
+            'category_name': event['category_name'],
+            'location': event['event_location'] or event['location_name'],
+            'location_id': event['location_id'],
+            'status': event['status'],
+            'is_recurring': bool(event['is_recurring']),
+            'has_conflicts': bool(event['has_conflicts']),
+            'parent_event_id': event['parent_event_id']
+        }
+        events_list.append(event_dict)
+    return jsonify(events_list).get_data()
+
+def columnar(db):
+    """The current api_events path"""
+    return dump_json(serialize_event_feed(fetch_event_feed(db)))
+
+def best_time(func, db, repeat):
+    """Best wall-clock time of repeat runs, plus the last result"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(db)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the calendar feed serializer')
+    parser.add_argument('--events', type=int, default=5000, help='Number of generated events')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per implementation')
+    args = parser.parse_args()
+
+    print("⏱️  Calendar Feed Benchmark")
+    print("=" * 50)
+    db = build_database(args.events)
+
+    with app.test_request_context():
+        baseline, expected = best_time(row_at_a_time, db, args.repeat)
+        current, actual = best_time(columnar, db, args.repeat)
+
+    if json.loads(expected) != json.loads(actual):
+        print("❌ Serializers disagree")
+        sys.exit(1)
+
+    print(f"Events:          {args.events}")
+    print(f"JSON encoder:    {'orjson' if orjson else 'json'}")
+    print(f"Row-at-a-time:   {baseline * 1000:.1f} ms ({len(expected)} bytes)")
+    print(f"Columnar:        {current * 1000:.1f} ms ({len(actual)} bytes)")
+    print(f"✅ Speedup:       {baseline / current:.1f}x, identical payload")
+
+if __name__ == "__main__":
+    main()
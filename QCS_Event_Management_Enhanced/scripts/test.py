@@ -18,7 +18,8 @@ sys.path.insert(0, app_dir)
 
 # Import the Flask app
 from app import app
-from helpers import get_db
+from helpers import get_db, epoch_day, overlap_condition
+from migrations import migrate, schema_version, LATEST_VERSION
 
 class QCSTestSuite:
     def __init__(self):
@@ -276,6 +277,1000 @@ class QCSTestSuite:
         else:
             self.log_test("XSS Protection", "FAIL", "Possible XSS vulnerability")
 
+    def test_connection_pool(self):
+        """Test pooled, tuned database connections"""
+        print("\n🔌 Testing Connection Pool")
+        print("-" * 40)
+
+        try:
+            with self.app.app_context():
+                first = get_db()
+                journal_mode = first.execute('PRAGMA journal_mode').fetchone()[0]
+                busy_timeout = first.execute('PRAGMA busy_timeout').fetchone()[0]
+            with self.app.app_context():
+                second = get_db()
+
+            if journal_mode.lower() == 'wal' and busy_timeout == self.app.config['SQLITE_BUSY_TIMEOUT_MS']:
+                self.log_test("Connection Tuning", "PASS", f"journal_mode={journal_mode}, busy_timeout={busy_timeout}ms")
+            else:
+                self.log_test("Connection Tuning", "FAIL", f"journal_mode={journal_mode}, busy_timeout={busy_timeout}")
+
+            if first is second:
+                self.log_test("Connection Reuse", "PASS", "Connection returned to the pool and reused")
+            else:
+                self.log_test("Connection Reuse", "FAIL", "A new connection was opened for the second request")
+
+            # GET requests read through query_only connections, mutations use the writer
+            with self.app.test_request_context('/api/events', method='GET'):
+                read_only = get_db().execute('PRAGMA query_only').fetchone()[0]
+            with self.app.test_request_context('/api/events/quick_add', method='POST'):
+                writer_read_only = get_db().execute('PRAGMA query_only').fetchone()[0]
+            if read_only == 1 and writer_read_only == 0:
+                self.log_test("Read/Write Split", "PASS", "GET uses a read-only connection, POST the writer")
+            else:
+                self.log_test("Read/Write Split", "FAIL", f"query_only GET={read_only}, POST={writer_read_only}")
+        except Exception as e:
+            self.log_test("Connection Pool", "FAIL", f"Database error: {str(e)}")
+
+    def test_schema_migrations(self):
+        """Test in-place schema upgrades tracked by user_version"""
+        print("\n🧱 Testing Schema Migrations")
+        print("-" * 40)
+
+        db = sqlite3.connect(':memory:')
+        with open(os.path.join(app_dir, 'schema.sql')) as f:
+            db.executescript(f.read())
+
+        applied = migrate(db)
+        if schema_version(db) == LATEST_VERSION and len(applied) == LATEST_VERSION:
+            self.log_test("Migration Upgrade", "PASS", f"Upgraded baseline schema to version {LATEST_VERSION}")
+        else:
+            self.log_test("Migration Upgrade", "FAIL", f"Schema at version {schema_version(db)}")
+
+        if migrate(db) == []:
+            self.log_test("Migration Idempotence", "PASS", "No migrations re-applied")
+        else:
+            self.log_test("Migration Idempotence", "FAIL", "Migrations applied twice")
+
+        plan = ' '.join(row[3] for row in db.execute(
+            'EXPLAIN QUERY PLAN SELECT event_id FROM events WHERE client_id = ? ORDER BY event_date', (1,)))
+        if 'idx_events_client' in plan:
+            self.log_test("Index Pack", "PASS", "Client event lookups use idx_events_client")
+        else:
+            self.log_test("Index Pack", "FAIL", f"Unexpected query plan: {plan}")
+
+        # Month views compare integer day columns through an index range scan
+        cursor = db.execute("INSERT INTO events (event_name, client_id, event_date, end_date, drop_off_time) "
+                            "VALUES ('Test', 1, '2025-07-10', '2025-07-12', '15:30')")
+        day_columns = tuple(db.execute("SELECT start_day, end_day, start_minute FROM events WHERE event_id = ?",
+                                       (cursor.lastrowid,)).fetchone())
+        condition, params = overlap_condition(db, epoch_day('2025-07-01'), epoch_day('2025-07-31'))
+        try:
+            # INDEXED BY fails unless the predicate can be answered from the index
+            matched = db.execute(f'SELECT e.event_id FROM events e INDEXED BY idx_events_day_range '
+                                 f'WHERE {condition}', params).fetchall()
+        except sqlite3.OperationalError as e:
+            matched = str(e)
+        if day_columns == (epoch_day('2025-07-10'), epoch_day('2025-07-12'), 930) \
+                and matched == [(cursor.lastrowid,)]:
+            self.log_test("Day Range Columns", "PASS", "Overlap filter is an idx_events_day_range scan")
+        else:
+            self.log_test("Day Range Columns", "FAIL", f"Columns {day_columns}, matched: {matched}")
+
+    def test_events_conditional_get(self):
+        """Test ETag revalidation of the calendar feed"""
+        print("\n🏷️  Testing Events Conditional GET")
+        print("-" * 40)
+
+        self.client.post('/login', data={'username': 'admin', 'password': 'admin'})
+        url = '/api/events?start=2025-07-01&end=2025-08-01'
+
+        first = self.client.get(url)
+        etag = first.headers.get('ETag')
+        repeat = self.client.get(url, headers={'If-None-Match': etag})
+        if etag and repeat.status_code == 304 and not repeat.data:
+            self.log_test("Events ETag", "PASS", "Unchanged feed answered with 304")
+        else:
+            self.log_test("Events ETag", "FAIL", f"ETag {etag}, status {repeat.status_code}")
+
+        other = self.client.get(url + '&statuses=booked', headers={'If-None-Match': etag})
+        self.client.post('/api/events/quick_add', data={
+            'event_name': 'ETag Test', 'event_date': '2025-07-15', 'client_id': '1'
+        })
+        after_write = self.client.get(url, headers={'If-None-Match': etag})
+        if other.status_code == 200 and after_write.status_code == 200 \
+                and after_write.headers.get('ETag') != etag:
+            self.log_test("Events ETag Invalidation", "PASS", "Filters and writes change the ETag")
+        else:
+            self.log_test("Events ETag Invalidation", "FAIL",
+                          f"Statuses {other.status_code}/{after_write.status_code}")
+
+        # Open-ended series expand up to a horizon that moves daily, so an unbounded feed's ETag moves with it
+        from unittest import mock
+        from werkzeug.datastructures import MultiDict
+        from revisions import events_etag
+        tags = {}
+        for day in (20000, 20001):
+            with mock.patch('revisions.horizon_day', return_value=day):
+                tags[day] = (events_etag(7, MultiDict()),
+                             events_etag(7, MultiDict({'start': '2025-07-01', 'end': '2025-08-01'})))
+        if tags[20000][0] != tags[20001][0] and tags[20000][1] == tags[20001][1]:
+            self.log_test("Events ETag Horizon", "PASS", "Unbounded feeds revalidate when the horizon moves")
+        else:
+            self.log_test("Events ETag Horizon", "FAIL", f"ETags {tags}")
+
+    def test_event_feed_serializer(self):
+        """Test the columnar calendar feed serializer"""
+        print("\n🧾 Testing Event Feed Serializer")
+        print("-" * 40)
+
+        from event_feed import fetch_event_feed, serialize_event_feed, dump_json
+
+        db = self._scratch_db()
+        db.executemany(
+            "INSERT INTO events (event_id, event_name, client_id, event_date, end_date, "
+            "drop_off_time, pickup_time, is_all_day, status, has_conflicts) VALUES (?, ?, 1, ?, ?, ?, ?, ?, ?, ?)",
+            [(50, 'Festival', '2025-07-30', '2025-08-01', None, None, 1, 'booked', 0),
+             (51, 'Party', '2025-07-31', None, '09:30', '17:00', 0, 'confirmed', 1)]
+        )
+        with self.app.test_request_context():
+            feed = serialize_event_feed(fetch_event_feed(db, ['e.event_id >= ?'], [50]))
+        festival, party = feed
+        if festival['end'] == '2025-08-02' and festival['allDay'] and festival['url'] == '/events/50' \
+                and party['start'] == '2025-07-31T09:30:00' and party['end'] == '2025-07-31T17:00:00' \
+                and party['classNames'] == ['event-confirmed', 'event-conflict'] \
+                and json.loads(dump_json(feed)) == feed:
+            self.log_test("Feed Serializer", "PASS", "All-day ends, padded times and URLs are correct")
+        else:
+            self.log_test("Feed Serializer", "FAIL", f"Unexpected feed: {feed}")
+
+        self.client.post('/login', data={'username': 'admin', 'password': 'admin'})
+        url = '/api/events?start=2025-01-01&end=2026-01-01'
+        buffered = self.client.get(url + '&stream=0')
+        threshold = self.app.config.get('EVENTS_STREAM_THRESHOLD')
+        self.app.config['EVENTS_STREAM_THRESHOLD'] = 0
+        try:
+            streamed = self.client.get(url)
+        finally:
+            self.app.config['EVENTS_STREAM_THRESHOLD'] = threshold
+        if 'Content-Length' not in streamed.headers and 'Content-Length' in buffered.headers \
+                and streamed.get_json() == buffered.get_json():
+            self.log_test("Streamed Feed", "PASS", f"{len(streamed.get_json())} events streamed above the threshold")
+        else:
+            self.log_test("Streamed Feed", "FAIL", f"Headers {dict(streamed.headers)}")
+
+    def test_event_delta_sync(self):
+        """Test the revision-based calendar change feed"""
+        print("\n🔄 Testing Event Delta Sync")
+        print("-" * 40)
+
+        self.client.post('/login', data={'username': 'admin', 'password': 'admin'})
+        url = '/api/events/changes?start=2025-07-01&end=2025-08-01&since='
+
+        since = int(self.client.get('/api/events?start=2025-07-01&end=2025-08-01')
+                    .headers.get('X-Events-Revision', '-1'))
+        added = self.client.post('/api/events/quick_add', data={
+            'event_name': 'Delta Test', 'event_date': '2025-07-20', 'client_id': '1'
+        }).get_json()
+        event_id = added['event']['id']
+
+        changes = self.client.get(url + str(since)).get_json()
+        if not changes['reset'] and event_id in [e['id'] for e in changes['events']] \
+                and changes['revision'] > since:
+            self.log_test("Delta Changes", "PASS", f"{len(changes['events'])} changed events since {since}")
+        else:
+            self.log_test("Delta Changes", "FAIL", f"Unexpected changes: {changes}")
+
+        self.client.post(f'/events/{event_id}/delete')
+        after_delete = self.client.get(url + str(changes['revision'])).get_json()
+        stale = self.client.get(url + str(after_delete['revision'] + 1000)).get_json()
+        if event_id in after_delete['deleted'] and stale['reset']:
+            self.log_test("Delta Tombstones", "PASS", "Deleted events reported, unknown revisions reset")
+        else:
+            self.log_test("Delta Tombstones", "FAIL", f"Deleted {after_delete['deleted']}, reset {stale['reset']}")
+
+    def test_live_updates(self):
+        """Test the change notification bus and its SSE stream"""
+        print("\n📡 Testing Live Updates")
+        print("-" * 40)
+
+        from event_bus import EventBus, bus
+
+        local_bus = EventBus(queue_size=1)
+        subscriber = local_bus.subscribe()
+        delivered = local_bus.publish('updated', {3, 1})
+        overflow = local_bus.publish('updated', {2})
+        message = subscriber.get_nowait()
+        local_bus.unsubscribe(subscriber)
+        if delivered == 1 and overflow == 0 and message['event_ids'] == [1, 3] \
+                and local_bus.subscriber_count() == 0:
+            self.log_test("Event Bus", "PASS", "Fan-out, bounded queues and unsubscribe work")
+        else:
+            self.log_test("Event Bus", "FAIL", f"Delivered {delivered}/{overflow}, message {message}")
+
+        self.client.post('/login', data={'username': 'admin', 'password': 'admin'})
+        response = self.client.get('/api/events/stream', buffered=False)
+        chunks = iter(response.response)
+        ready = next(chunks).decode()
+        added = self.client.post('/api/events/quick_add', data={
+            'event_name': 'Live Test', 'event_date': '2025-07-21', 'client_id': '1'
+        }).get_json()
+        pushed = next(chunks).decode()
+        response.close()
+        if response.mimetype == 'text/event-stream' and 'event: ready' in ready \
+                and 'event: created' in pushed and str(added['event']['id']) in pushed \
+                and bus.subscriber_count() == 0:
+            self.log_test("Event Stream", "PASS", "Writes are pushed to open streams")
+        else:
+            self.log_test("Event Stream", "FAIL", f"Received {ready!r} / {pushed!r}")
+
+    def test_recurring_events(self):
+        """Test lazy expansion of recurring series"""
+        print("\n🔁 Testing Recurring Events")
+        print("-" * 40)
+
+        from recurrence import occurrence_days, series_condition, single_condition, window_condition
+        from conflicts import check_event_conflicts, recompute_conflicts
+
+        iso = lambda value: epoch_day(value)
+        weekly = occurrence_days(iso('2025-07-01'), 0, 'weekly', iso('2025-07-29'),
+                                 iso('2025-07-10'), iso('2025-08-31'))
+        monthly = occurrence_days(iso('2025-01-31'), 0, 'monthly', None, iso('2025-01-01'), iso('2025-05-31'))
+        yearly = occurrence_days(iso('2024-02-29'), 0, 'yearly', None, iso('2024-01-01'), iso('2028-12-31'))
+        if weekly == [iso(d) for d in ('2025-07-15', '2025-07-22', '2025-07-29')] \
+                and monthly == [iso(d) for d in ('2025-01-31', '2025-03-31', '2025-05-31')] \
+                and yearly == [iso('2024-02-29'), iso('2028-02-29')]:
+            self.log_test("Recurrence Expansion", "PASS", "Weekly, monthly and yearly rules expand in the window")
+        else:
+            self.log_test("Recurrence Expansion", "FAIL", f"{weekly} / {monthly} / {yearly}")
+
+        db = self._scratch_db()
+        db.execute("INSERT INTO locations (id, name) VALUES (1, 'Hall A')")
+        db.execute("INSERT INTO events (event_id, event_name, client_id, event_date, location_id, "
+                   "is_recurring, recurrence_pattern) VALUES (60, 'Weekly Class', 1, '2025-07-01', 1, 1, 'weekly')")
+        db.execute("INSERT INTO events (event_id, event_name, client_id, event_date, location_id) "
+                   "VALUES (61, 'Gala', 1, '2025-07-15', 1)")
+        conflicts = check_event_conflicts(db, 61, '2025-07-15')
+        recompute_conflicts(db)
+        flags = dict(db.execute('SELECT event_id, has_conflicts FROM events WHERE event_id IN (60, 61)').fetchall())
+        if [c['conflict_event_id'] for c in conflicts] == [60] and flags == {60: 1, 61: 1} \
+                and check_event_conflicts(db, 61, '2025-07-16') == []:
+            self.log_test("Recurring Conflicts", "PASS", "Occurrences collide with other bookings")
+        else:
+            self.log_test("Recurring Conflicts", "FAIL", f"Conflicts {conflicts}, flags {flags}")
+
+        self.client.post('/login', data={'username': 'admin', 'password': 'admin'})
+        self.client.post('/events/new', data={
+            'event_name': 'Recurring Test', 'client_id': '1', 'event_date': '2025-08-04',
+            'drop_off_time': '09:00', 'pickup_time': '11:00', 'status': 'booked',
+            'is_recurring': '1', 'recurrence_pattern': 'weekly', 'recurrence_end_date': '2025-09-30'
+        })
+        url = '/api/events?start=2025-08-01&end=2025-08-31'
+        occurrences = [e for e in self.client.get(url).get_json() if e['title'] == 'Recurring Test']
+        series_id = occurrences[0]['extendedProps']['series_id'] if occurrences else None
+        moved = self.client.post('/api/events/update_dates', data={
+            'event_id': f'{series_id}_2025-08-11', 'start_date': '2025-08-12',
+            'start_time': '09:00:00', 'end_time': '11:00:00', 'recurrence_edit': 'single'
+        }).get_json()
+        after = [e for e in self.client.get(url).get_json() if e['title'] == 'Recurring Test']
+        starts = sorted(e['start'][:10] for e in after)
+        if [e['id'] for e in occurrences] == [f'{series_id}_2025-08-{day}' for day in ('04', '11', '18', '25')] \
+                and moved.get('success') and moved['event_id'] in [e['id'] for e in after] \
+                and starts == ['2025-08-04', '2025-08-12', '2025-08-18', '2025-08-25']:
+            self.log_test("Recurring Feed", "PASS", "One series row expands per window, moved occurrences become exceptions")
+        else:
+            self.log_test("Recurring Feed", "FAIL", f"Occurrences {[e['id'] for e in occurrences]}, after move {starts}")
+
+        ics_export = self.client.get('/export-calendar/ics').get_data(as_text=True)
+        if 'RRULE:FREQ=WEEKLY;UNTIL=20250930T235959Z' in ics_export and 'EXDATE:20250811T090000Z' in ics_export:
+            self.log_test("Recurring ICS Export", "PASS", "Series exported with RRULE and EXDATE")
+        else:
+            self.log_test("Recurring ICS Export", "FAIL", "Recurrence rule missing from the export")
+
+        # Moving this and future occurrences splits the series and shifts the rest relatively
+        future = self.client.post('/api/events/update_dates', data={
+            'event_id': f'{series_id}_2025-08-18', 'start_date': '2025-08-19',
+            'start_time': '10:00:00', 'end_time': '12:00:00', 'recurrence_edit': 'future'
+        }).get_json()
+        everything = self.client.post('/api/events/update_dates', data={
+            'event_id': f'{series_id}_2025-08-04', 'start_date': '2025-08-05',
+            'start_time': '09:00:00', 'end_time': '11:00:00', 'recurrence_edit': 'all'
+        }).get_json()
+        after = [e for e in self.client.get(url).get_json() if e['title'] == 'Recurring Test']
+        starts = sorted(e['start'][:16] for e in after)
+        if future.get('success') and everything.get('success') and future['event_id'] != series_id \
+                and starts == ['2025-08-05T09:00', '2025-08-13T09:00', '2025-08-19T10:00', '2025-08-26T10:00']:
+            self.log_test("Recurring Series Move", "PASS", "All and future edits shift occurrences by the same delta")
+        else:
+            self.log_test("Recurring Series Move", "FAIL", f"Occurrences after the moves {starts}")
+
+        # Series lookups must match the partial index's WHERE clause to use it
+        db = self._scratch_db()
+        db.executemany(
+            "INSERT INTO events (event_name, client_id, event_date, is_recurring, recurrence_pattern) "
+            "VALUES ('Plan Test', 1, date('2020-01-01', ?), ?, ?)",
+            [(f'+{n % 2000} days', int(n % 100 == 0), 'weekly' if n % 100 == 0 else None) for n in range(3000)]
+        )
+        db.execute('ANALYZE')
+        condition, params = window_condition(iso('2021-01-01'), iso('2030-12-31'))
+        plan = ' '.join(row[3] for row in db.execute(
+            f'EXPLAIN QUERY PLAN SELECT e.event_id FROM events e WHERE {condition}', params))
+        # Single and series conditions split the table, rows with NULL recurrence columns included
+        singles, series, total = db.execute(
+            f'SELECT SUM({single_condition()}), SUM({series_condition()}), COUNT(*) FROM events e').fetchone()
+        if 'idx_events_series' in plan and series == 30 and singles + series == total:
+            self.log_test("Series Index", "PASS", "Series lookups use idx_events_series")
+        else:
+            self.log_test("Series Index", "FAIL", f"Plan {plan}, {singles} single and {series} series of {total}")
+
+    def test_csv_import(self):
+        """Test the staged CSV import pipeline"""
+        print("\n📥 Testing CSV Import")
+        print("-" * 40)
+
+        from csv_import import parse_csv_rows, import_csv_events
+
+        db = self._scratch_db()
+        db.execute("INSERT INTO equipment (id, name) VALUES (1, 'Popup tent')")
+        db.execute("INSERT INTO events (event_name, client_id, event_date) VALUES ('Health Fair', 2, '2025-09-01')")
+        text = "event_name,event_date,client_name,category_name,items_needed\n" \
+               "Health Fair,2025-09-01,Horizon,Medical,\n" \
+               "Wellness Walk,2025-09-02,RWJ,Medical,Popup tent #A; Yeti Cooler\n" \
+               "Wellness Walk,2025-09-02,RWJ,,\n" \
+               "Bike Rodeo,2025-09-03,Unknown Client,,\n" \
+               "Lunch Talk,2025-09-04,Horizon,Social,Yeti Cooler (large)\n" \
+               ",2025-09-05,Horizon,,\n"
+        rows, messages = parse_csv_rows(text)
+        result = import_csv_events(db, rows, batch_size=2)
+        imported = [tuple(row) for row in db.execute(
+            "SELECT event_name, client_id, category_id FROM events WHERE event_id IN ({}) ORDER BY event_id"
+            .format(','.join('?' * len(result['imported_ids']))), result['imported_ids'])]
+        assignments = sorted(tuple(row) for row in db.execute(
+            "SELECT e.event_name, q.name FROM equipment_assignments a "
+            "JOIN events e ON e.event_id = a.event_id JOIN equipment q ON q.id = a.equipment_id"))
+        skipped = [category for _, category in messages + result['messages']]
+        if imported == [('Wellness Walk', 1, 2), ('Lunch Talk', 2, 3)] \
+                and assignments == [('Lunch Talk', 'Yeti Cooler'), ('Wellness Walk', 'Popup tent'),
+                                    ('Wellness Walk', 'Yeti Cooler')] \
+                and skipped.count('warning') == 2 and skipped.count('info') == 3:
+            self.log_test("CSV Import", "PASS", "Rows staged, duplicates skipped and equipment matched in batches")
+        else:
+            self.log_test("CSV Import", "FAIL", f"Imported {imported}, assignments {assignments}, messages {skipped}")
+
+        from equipment_matcher import EquipmentMatcher
+        matcher = EquipmentMatcher([(1, 'Tent'), (2, 'Popup tent #A'), (3, 'Cooler')])
+        before = [matcher.find(text) for text in ('popup tent #a', 'Large tent, blue', 'Yeti Cooler', 'Easel')]
+        matcher.add('Easel', 4)
+        if before == [2, 1, 3, None] and matcher.find('1 Easel') == 4 \
+                and matcher.find_all('Bring the cooler and an easel for the tent') == [3, 4, 1]:
+            self.log_test("Equipment Matcher", "PASS", "Exact names win, then the first catalogue name in the text")
+        else:
+            self.log_test("Equipment Matcher", "FAIL", f"Matches {before}")
+
+        from client_index import ClientIndex, set_client_aliases, parse_aliases
+        from revisions import current_revision
+
+        revision = current_revision(db, 'clients')
+        error = set_client_aliases(db, 2, parse_aliases('Horizon BCBS, horizon bcbs,\nBlue Cross'))
+        conflict = set_client_aliases(db, 2, ['rwj'])
+        index = ClientIndex.from_db(db)
+        resolved = [index.resolve(name) for name in
+                    ('ROBERT WOOD  JOHNSON', 'rwj', 'Horizon BCBS', 'hbc', 'blue cross', 'Unknown')]
+        if error is None and conflict and resolved == [1, 1, 2, 2, 2, None] \
+                and current_revision(db, 'clients') > revision:
+            self.log_test("Client Aliases", "PASS", "Names, initials and aliases resolve through one index")
+        else:
+            self.log_test("Client Aliases", "FAIL", f"Resolved {resolved}, errors {error!r} {conflict!r}")
+
+    def test_ics_import(self):
+        """Test the streaming ICS reader and calendar import"""
+        print("\n📆 Testing ICS Import")
+        print("-" * 40)
+
+        import io
+        from ics_reader import read_vevents, IcsError
+
+        text = ("BEGIN:VCALENDAR\r\nVERSION:2.0\r\n"
+                "BEGIN:VEVENT\r\nUID:ics-test-1@qcs\r\nSUMMARY:Health Fair\\, Day\r\n  One\r\n"
+                "DTSTART;TZID=America/Chicago:20250901T080000\r\nDURATION:PT3H\r\nSTATUS:TENTATIVE\r\n"
+                "BEGIN:VALARM\r\nDESCRIPTION:Reminder\r\nEND:VALARM\r\nEND:VEVENT\r\n"
+                "BEGIN:VEVENT\r\nUID:ics-test-2@qcs\r\nSUMMARY:Expo\r\n"
+                "DTSTART;VALUE=DATE:20250905\r\nDTEND;VALUE=DATE:20250907\r\nEND:VEVENT\r\n"
+                "END:VCALENDAR\r\n")
+        first, second = read_vevents(text)
+        converted = next(read_vevents(io.BytesIO(text.encode()), tz='America/New_York'))
+        try:
+            list(read_vevents('not a calendar'))
+            rejected = False
+        except IcsError:
+            rejected = True
+        if first.summary == 'Health Fair, Day One' and first.description is None and first.status == 'TENTATIVE' \
+                and (first.start_time, first.end_time) == ('08:00:00', '11:00:00') \
+                and (converted.start_time, converted.end_time) == ('09:00:00', '12:00:00') \
+                and second.all_day and (second.start_date, second.end_date) == ('2025-09-05', '2025-09-06') \
+                and rejected:
+            self.log_test("ICS Reader", "PASS", "Folded lines, TZID, durations and all-day events read")
+        else:
+            self.log_test("ICS Reader", "FAIL", f"Read {first}, {converted}, {second}")
+
+        # A 75-octet fold may split a multi-byte character; bytes are joined before decoding
+        summary = 'Café Opening – Día Uno'.encode('utf-8')
+        split = summary.index('é'.encode('utf-8')) + 1
+        folded = (b"BEGIN:VCALENDAR\r\nBEGIN:VEVENT\r\nUID:ics-test-fold@qcs\r\nSUMMARY:" + summary[:split]
+                  + b"\r\n " + summary[split:] + b"\r\nDTSTART;VALUE=DATE:20250910\r\nEND:VEVENT\r\nEND:VCALENDAR\r\n")
+        unfolded = next(read_vevents(io.BytesIO(folded)))
+        if unfolded.summary == 'Café Opening – Día Uno':
+            self.log_test("ICS Split Character", "PASS", "Character split across a fold read intact")
+        else:
+            self.log_test("ICS Split Character", "FAIL", f"Read {unfolded.summary!r}")
+
+        self.client.post('/login', data={'username': 'admin', 'password': 'admin'})
+        self.client.post('/import-calendar', data={
+            'import_type': 'ics_file', 'ics_file': (io.BytesIO(text.encode()), 'test.ics')
+        }, content_type='multipart/form-data')
+        with self.app.app_context():
+            imported = [tuple(row) for row in get_db().execute(
+                "SELECT event_name, event_date, end_date, drop_off_time, is_all_day FROM events "
+                "WHERE ics_uid LIKE 'ics-test-%' ORDER BY ics_uid")]
+        if imported == [('Health Fair, Day One', '2025-09-01', None, '08:00:00', 0),
+                        ('Expo', '2025-09-05', '2025-09-06', None, 1)]:
+            self.log_test("ICS Upload Import", "PASS", "Uploaded calendar streamed into events")
+        else:
+            self.log_test("ICS Upload Import", "FAIL", f"Imported {imported}")
+
+    def test_ics_export(self):
+        """Test the streaming ICS writer and its VEVENT cache"""
+        print("\n📤 Testing ICS Export")
+        print("-" * 40)
+
+        from ics_reader import read_vevents
+        from ics_writer import VeventCache, calendar_cursor, stream_calendar
+
+        db = self._scratch_db()
+        notes = 'Tables, chairs; and a café banner\n' + 'x' * 120
+        db.executemany(
+            "INSERT INTO events (event_id, event_name, client_id, event_date, drop_off_time, pickup_time, "
+            "event_location, notes, status) VALUES (?, ?, 1, '2025-09-01', '08:00', '12:30', ?, ?, ?)",
+            [(70, 'Health Fair', 'Main St, Newark', notes, 'booked'),
+             (71, 'Expo', None, None, 'confirmed'),
+             (72, 'Cancelled Fair', None, None, 'cancelled')]
+        )
+        text = ''.join(stream_calendar(db, '/events/{}', ['e.event_id >= ?'], [70], batch_size=1))
+        events = list(read_vevents(text))
+        lines = text.split('\r\n')
+        if [e.summary for e in events] == ['Health Fair', 'Expo'] \
+                and events[0].description.endswith(notes) and events[0].location == 'Main St, Newark' \
+                and (events[0].start_time, events[0].end_time) == ('08:00:00', '12:30:00') \
+                and events[1].uid == 'event-71@qcs-event-management' and events[1].status == 'TENTATIVE' \
+                and all(len(line.encode('utf-8')) <= 75 for line in lines):
+            self.log_test("ICS Writer", "PASS", "Escaped, folded VEVENTs read back unchanged")
+        else:
+            self.log_test("ICS Writer", "FAIL", f"Read back {events}")
+
+        cache = VeventCache(size=10)
+        rows = calendar_cursor(db, ['e.event_id >= ?'], [70]).fetchall()
+        first = cache.render('scratch', rows, '/events/{}')
+        db.execute("UPDATE events SET event_name = 'Expo 2025' WHERE event_id = 71")
+        rows = calendar_cursor(db, ['e.event_id >= ?'], [70]).fetchall()
+        second = cache.render('scratch', rows, '/events/{}')
+        if second[0] is first[0] and second[1] is not first[1] and 'SUMMARY:Expo 2025' in second[1]:
+            self.log_test("VEVENT Cache", "PASS", "Only the changed event was re-rendered")
+        else:
+            self.log_test("VEVENT Cache", "FAIL", "Cached VEVENTs not reused or not refreshed")
+
+    def test_exporters(self):
+        """Test the CSV, JSON Lines and XLSX exporters"""
+        print("\n📦 Testing Exporters")
+        print("-" * 40)
+
+        import io
+        import zipfile
+        from csv_import import CSV_COLUMNS, parse_csv_rows
+
+        self.client.post('/login', data={'username': 'admin', 'password': 'admin'})
+        with self.app.app_context():
+            expected = get_db().execute("SELECT COUNT(*) FROM events WHERE status != 'cancelled'").fetchone()[0]
+
+        exported = self.client.get('/export-calendar/csv')
+        text = exported.get_data(as_text=True)
+        rows, skipped = parse_csv_rows(text)
+        if exported.mimetype == 'text/csv' and tuple(text.splitlines()[0].split(',')) == CSV_COLUMNS \
+                and len(rows) + len(skipped) == expected:
+            self.log_test("CSV Export", "PASS", f"{expected} events exported with the importer's columns")
+        else:
+            self.log_test("CSV Export", "FAIL", f"Header {text.splitlines()[:1]}, {len(rows)}/{expected} rows")
+
+        lines = self.client.get('/export-calendar/jsonl?columns=event_id,event_name').get_data(as_text=True).splitlines()
+        workbook = zipfile.ZipFile(io.BytesIO(self.client.get('/export-calendar/xlsx?columns=event_name,boxes_from_pi').data))
+        sheet = workbook.read('xl/worksheets/sheet1.xml').decode('utf-8')
+        if len(lines) == expected and set(json.loads(lines[0])) == {'event_id', 'event_name'} \
+                and workbook.testzip() is None and '<t xml:space="preserve">boxes_from_pi</t>' in sheet \
+                and sheet.count('<row ') == expected + 1 \
+                and self.client.get('/export-calendar/xml').status_code == 400 \
+                and self.client.get('/export-calendar/csv?columns=password_hash').status_code == 400:
+            self.log_test("Streaming Exporters", "PASS", "JSON Lines and XLSX honour the column selection")
+        else:
+            self.log_test("Streaming Exporters", "FAIL", f"{len(lines)} JSON lines, {sheet.count('<row ')} sheet rows")
+
+    def test_calendar_subscriptions(self):
+        """Test token-authenticated, filtered subscription feeds"""
+        print("\n📡 Testing Calendar Subscriptions")
+        print("-" * 40)
+
+        self.client.post('/login', data={'username': 'admin', 'password': 'admin'})
+        with self.app.app_context():
+            db = get_db()
+            db.executemany(
+                "INSERT INTO events (event_name, client_id, event_date, drop_off_time, pickup_time, status) "
+                "VALUES (?, ?, date('now'), '09:00', '12:00', 'booked')",
+                [('Subscribed Event', 1), ('Other Client Event', 2)]
+            )
+            db.commit()
+            mine, other = [row[0] for row in db.execute(
+                "SELECT event_id FROM events WHERE event_name IN ('Subscribed Event', 'Other Client Event') "
+                "ORDER BY event_name DESC")]
+
+        created = self.client.post('/calendar-subscriptions', json={'client_id': 1, 'days_back': 7, 'days_ahead': 30}).get_json()
+        url = created['url'].replace('http://localhost', '')
+        anonymous = self.app.test_client()
+        first = anonymous.get(url)
+        etag = first.headers.get('ETag')
+        repeat = anonymous.get(url, headers={'If-None-Match': etag})
+        since = anonymous.get(url, headers={'If-Modified-Since': first.headers.get('Last-Modified')})
+        body = first.get_data(as_text=True)
+        if first.status_code == 200 and first.mimetype == 'text/calendar' and 'Subscribed Event' in body \
+                and 'Other Client Event' not in body and repeat.status_code == 304 and since.status_code == 304 \
+                and anonymous.get('/subscriptions/not-a-token.ics').status_code == 404:
+            self.log_test("Subscription Feed", "PASS", "Filtered feed served by token, repeat polls get 304")
+        else:
+            self.log_test("Subscription Feed", "FAIL", f"Status {first.status_code}/{repeat.status_code}")
+
+        with self.app.app_context():
+            db = get_db()
+            db.execute("UPDATE events SET notes = 'moved' WHERE event_id = ?", (other,))
+            db.commit()
+            unrelated = anonymous.get(url, headers={'If-None-Match': etag}).status_code
+            db.execute("UPDATE events SET event_name = 'Subscribed Event (renamed)' WHERE event_id = ?", (mine,))
+            db.commit()
+        changed = anonymous.get(url, headers={'If-None-Match': etag})
+        subscription_id = self.client.get('/api/calendar-subscriptions').get_json()[0]['id']
+
+        # One bump per edit; flags, re-stamps and events outside the horizon do not bump
+        with self.app.app_context():
+            db = get_db()
+
+            def bumps(sql, params=()):
+                before = db.execute('SELECT revision FROM calendar_subscriptions WHERE id = ?',
+                                    (subscription_id,)).fetchone()[0]
+                cursor = db.execute(sql, params)
+                db.commit()
+                return db.execute('SELECT revision FROM calendar_subscriptions WHERE id = ?',
+                                  (subscription_id,)).fetchone()[0] - before, cursor.lastrowid
+
+            insert = ("INSERT INTO events (event_name, client_id, event_date, is_recurring, recurrence_pattern, "
+                      "recurrence_end_date, status) VALUES ('Horizon Test', 1, ?, ?, ?, ?, 'booked')")
+            day = lambda offset: (datetime.now() + timedelta(days=offset)).date().isoformat()
+            counts = {
+                'edit': bumps("UPDATE events SET notes = 'edited' WHERE event_id = ?", (mine,))[0],
+                'flag': bumps("UPDATE events SET has_conflicts = 1 WHERE event_id = ?", (mine,))[0],
+                'rename': bumps("UPDATE clients SET name = name WHERE id = 1")[0],
+            }
+            counts['ahead'], far = bumps(insert, (day(90), 0, None, None))
+            counts['moved_in'] = bumps("UPDATE events SET event_date = ? WHERE event_id = ?",
+                                       (day(5), far))[0]
+            counts['past'], _ = bumps(insert, (day(-20), 0, None, None))
+            counts['ended_series'], _ = bumps(insert, (day(-60), 1, 'weekly', day(-30)))
+            counts['open_series'], _ = bumps(insert, (day(-60), 1, 'weekly', None))
+            db.execute("DELETE FROM events WHERE event_name = 'Horizon Test'")
+            db.commit()
+        expected = {'edit': 1, 'flag': 0, 'rename': 1, 'ahead': 0, 'moved_in': 1,
+                    'past': 0, 'ended_series': 0, 'open_series': 1}
+        if counts == expected:
+            self.log_test("Subscription Horizon", "PASS", "Only changes inside the horizon bump, once each")
+        else:
+            self.log_test("Subscription Horizon", "FAIL", f"Bumps {counts}")
+        self.client.post(f'/calendar-subscriptions/{subscription_id}/delete')
+        if unrelated == 304 and changed.status_code == 200 and 'Subscribed Event (renamed)' in changed.get_data(as_text=True) \
+                and anonymous.get(url).status_code == 404:
+            self.log_test("Subscription Invalidation", "PASS", "Only matching changes rebuild the feed; revoked tokens stop working")
+        else:
+            self.log_test("Subscription Invalidation", "FAIL", f"Unrelated {unrelated}, changed {changed.status_code}")
+        with self.app.app_context():
+            db = get_db()
+            db.execute('DELETE FROM events WHERE event_id IN (?, ?)', (mine, other))
+            db.commit()
+
+    def test_background_jobs(self):
+        """Test the SQLite-backed job queue"""
+        print("\n⏳ Testing Background Jobs")
+        print("-" * 40)
+
+        import io
+        from jobs import JobError, job_handler, enqueue, run_next
+
+        # Run jobs synchronously here instead of on worker threads
+        self.app.config['JOBS_WORKERS'] = 0
+        self.app.config['JOBS_RETRY_SECONDS'] = 0
+        attempts = []
+
+        @job_handler('test_flaky')
+        def flaky(job):
+            attempts.append(job.attempt)
+            job.progress(50, 'Halfway')
+            if job.attempt < 2:
+                raise RuntimeError('Temporary failure')
+            return {'echo': job.payload['value']}
+
+        @job_handler('test_invalid')
+        def invalid(job):
+            raise JobError('Bad input')
+
+        @job_handler('test_half_applied')
+        def half_applied(job):
+            db = get_db(write=True)
+            db.execute("INSERT INTO events (event_name, client_id, event_date) VALUES ('Half Applied', 1, '2025-10-02')")
+            job.progress(80, 'Imported')
+            raise RuntimeError('Conflict refresh failed')
+
+        with self.app.app_context():
+            db = get_db()
+            flaky_id = enqueue(db, 'test_flaky', {'value': 42}, user_id=1)
+            invalid_id = enqueue(db, 'test_invalid', user_id=1)
+            half_id = enqueue(db, 'test_half_applied', user_id=1, max_attempts=1)
+        while run_next(self.app) is not None:
+            pass
+
+        self.client.post('/login', data={'username': 'admin', 'password': 'admin'})
+        flaky_status = self.client.get(f'/jobs/{flaky_id}').get_json()
+        invalid_status = self.client.get(f'/jobs/{invalid_id}').get_json()
+        if attempts == [1, 2] and flaky_status['status'] == 'succeeded' and flaky_status['result'] == {'echo': 42} \
+                and flaky_status['progress'] == 100 and invalid_status['status'] == 'failed' \
+                and invalid_status['attempts'] == 1 and invalid_status['error'] == 'Bad input':
+            self.log_test("Job Retries", "PASS", "Failed jobs are retried, permanent errors are not")
+        else:
+            self.log_test("Job Retries", "FAIL", f"Attempts {attempts}, statuses {flaky_status} / {invalid_status}")
+
+        half_status = self.client.get(f'/jobs/{half_id}').get_json()
+        with self.app.app_context():
+            leftover = get_db().execute("SELECT COUNT(*) FROM events WHERE event_name = 'Half Applied'").fetchone()[0]
+        if half_status['status'] == 'failed' and leftover == 0:
+            self.log_test("Job Progress Transaction", "PASS", "Progress did not commit work a later failure rolled back")
+        else:
+            self.log_test("Job Progress Transaction", "FAIL", f"Status {half_status['status']}, {leftover} events kept")
+
+        # The invoice PDF job renders from the real invoices schema and finishes with its file
+        import app as app_module
+        with self.app.app_context():
+            db = get_db()
+            event_id = db.execute("SELECT event_id FROM events ORDER BY event_id LIMIT 1").fetchone()[0]
+            invoice_id = db.execute(
+                "INSERT INTO invoices (event_id, client_id, amount, status) VALUES (?, 1, 250.0, 'unpaid')",
+                (event_id,)).lastrowid
+            db.commit()
+        with self.app.test_request_context():
+            invoice_html = app_module.invoice_pdf_html(invoice_id)
+        if app_module.weasyprint_available:
+            queued = self.client.get(f'/invoices/{invoice_id}/pdf?background=1',
+                                     headers={'Accept': 'application/json'}).get_json()
+            run_next(self.app)
+            pdf_status = self.client.get(queued['status_url']).get_json()
+            pdf = self.client.get(f"/jobs/{queued['job_id']}/output")
+            if pdf_status['status'] == 'succeeded' and pdf.data.startswith(b'%PDF'):
+                self.log_test("Invoice PDF Job", "PASS", f"Job rendered a {pdf_status['result']['size']} byte PDF")
+            else:
+                self.log_test("Invoice PDF Job", "FAIL", f"Status {pdf_status}")
+        elif invoice_html and f'INVOICE #{invoice_id}' in invoice_html and '250.00' in invoice_html:
+            self.log_test("Invoice PDF Job", "WARN", "Invoice HTML renders; WeasyPrint is not installed to run the job")
+        else:
+            self.log_test("Invoice PDF Job", "FAIL", "Invoice HTML could not be rendered")
+        with self.app.app_context():
+            db = get_db()
+            db.execute('DELETE FROM invoices WHERE id = ?', (invoice_id,))
+            db.commit()
+
+        csv_file = (io.BytesIO(b"event_name,event_date,client_name\nJob Import Test,2025-10-01,Horizon\n"), 'jobs.csv')
+        response = self.client.post('/import-calendar', data={
+            'import_type': 'csv_file', 'csv_file': csv_file, 'background': '1'
+        }, headers={'Accept': 'application/json'}, content_type='multipart/form-data')
+        queued = response.get_json()
+        run_next(self.app)
+        status = self.client.get(queued['status_url']).get_json()
+        if response.status_code == 202 and status['status'] == 'succeeded' and status['result']['imported'] == 1:
+            self.log_test("Background Import", "PASS", "Import queued with 202 and completed by a worker")
+        else:
+            self.log_test("Background Import", "FAIL", f"Response {response.status_code}, status {status}")
+
+    def test_feed_sync(self):
+        """Test conditional-GET and concurrent calendar feed sync against a local stub server"""
+        print("\n🔄 Testing Feed Sync")
+        print("-" * 40)
+
+        import threading
+        import time
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from feed_sync import schedule_due_feeds
+        from jobs import job_status, run_next
+        from blueprints.calendar_bp import _run_calendar_import, sync_calendar_feeds
+
+        def calendar(*events):
+            return "BEGIN:VCALENDAR\r\n" + "".join(
+                f"BEGIN:VEVENT\r\nUID:{uid}\r\nSUMMARY:{summary}\r\n"
+                f"DTSTART:20251101T090000\r\nDTEND:20251101T100000\r\nEND:VEVENT\r\n"
+                for uid, summary in events) + "END:VCALENDAR\r\n"
+
+        def plain_calendar(*events):
+            """A feed whose events have no UID, with a STATUS each"""
+            return "BEGIN:VCALENDAR\r\n" + "".join(
+                f"BEGIN:VEVENT\r\nSUMMARY:{summary}\r\nSTATUS:{status}\r\n"
+                f"DTSTART:20251102T090000\r\nDTEND:20251102T100000\r\nEND:VEVENT\r\n"
+                for summary, status in events) + "END:VCALENDAR\r\n"
+
+        stub = {'body': calendar(('feed-test-1', 'Open House'), ('feed-test-2', 'Gala')), 'etag': '"v1"',
+                'validators': [], 'flaky_calls': 0,
+                'plain': plain_calendar(('UID-less Fair', 'CONFIRMED'), ('UID-less Parade', 'CANCELLED'))}
+
+        class StubFeed(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith('/slow/') or self.path == '/flaky.ics':
+                    # Slow feeds take 0.4s each; the flaky one fails once first
+                    if self.path == '/flaky.ics':
+                        stub['flaky_calls'] += 1
+                        if stub['flaky_calls'] == 1:
+                            self.send_response(503)
+                            self.end_headers()
+                            return
+                    time.sleep(0.4)
+                    body = calendar((f'feed-test-{self.path.strip("/").replace("/", "-")}', 'Slow')).encode()
+                    self.send_response(200)
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                if self.path == '/plain.ics':
+                    body = stub['plain'].encode()
+                    self.send_response(200)
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                stub['validators'].append(self.headers.get('If-None-Match'))
+                if self.headers.get('If-None-Match') == stub['etag']:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                body = stub['body'].encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/calendar')
+                self.send_header('ETag', stub['etag'])
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StubFeed)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{server.server_port}'
+        self.app.config.update(JOBS_WORKERS=0, FEEDS_PER_HOST=8, FEEDS_BACKOFF_SECONDS=0)
+        try:
+            with self.app.app_context():
+                db = get_db()
+                feed_id = db.execute('INSERT INTO calendar_feeds (url, auto_sync) VALUES (?, 1)',
+                                     (f'{base_url}/feed.ics',)).lastrowid
+                db.commit()
+
+            def sync():
+                """Make the feed due, let the scheduler queue it and run the job"""
+                with self.app.app_context():
+                    db = get_db()
+                    db.execute('UPDATE calendar_feeds SET next_sync_at = NULL WHERE id = ?', (feed_id,))
+                    db.commit()
+                job_ids = schedule_due_feeds(self.app)
+                while run_next(self.app) is not None:
+                    pass
+                with self.app.app_context():
+                    return [job_status(get_db(), job_id)['result'][str(feed_id)] for job_id in job_ids]
+
+            first = sync()
+            unchanged = sync()
+            stub['body'], stub['etag'] = calendar(('feed-test-2', 'Gala Night')), '"v2"'
+            changed = sync()
+            stub['etag'] = '"v3"'
+            same_content = sync()
+            with self.app.app_context():
+                db = get_db()
+                events = [tuple(row) for row in db.execute(
+                    "SELECT ics_uid, event_name, status FROM events WHERE ics_uid LIKE 'feed-test-_' ORDER BY ics_uid")]
+                feed = db.execute('SELECT * FROM calendar_feeds WHERE id = ?', (feed_id,)).fetchone()
+
+                # Six slow feeds (one failing once) in one scheduled batch
+                slow_ids = [db.execute('INSERT INTO calendar_feeds (url, auto_sync) VALUES (?, 1)', (url,)).lastrowid
+                            for url in [f'{base_url}/slow/{n}.ics' for n in range(5)] + [f'{base_url}/flaky.ics']]
+                db.commit()
+            started = time.monotonic()
+            batch_jobs = schedule_due_feeds(self.app)
+            while run_next(self.app) is not None:
+                pass
+            elapsed = time.monotonic() - started
+            with self.app.app_context():
+                batch = [job_status(get_db(), job_id)['result'] for job_id in batch_jobs]
+
+            # A saved URL import of UID-less events, then a sync after one left the feed
+            plain_sql = "SELECT event_name, status FROM events WHERE event_name LIKE 'UID-less %' ORDER BY event_name"
+            with self.app.app_context():
+                _run_calendar_import({'import_type': 'ics_url', 'url': f'{base_url}/plain.ics', 'auto_sync': True}, 1)
+                db = get_db()
+                plain_imported = [tuple(row) for row in db.execute(plain_sql)]
+                plain_id = db.execute('SELECT id FROM calendar_feeds WHERE url = ?',
+                                      (f'{base_url}/plain.ics',)).fetchone()[0]
+            plain_both = stub['plain']
+            stub['plain'] = plain_calendar(('UID-less Parade', 'CANCELLED'))
+            with self.app.app_context():
+                plain_result = sync_calendar_feeds([plain_id])[plain_id]
+                plain_synced = [tuple(row) for row in get_db().execute(plain_sql)]
+            # The event comes back with its upstream status instead of staying cancelled
+            stub['plain'] = plain_both
+            with self.app.app_context():
+                plain_back = sync_calendar_feeds([plain_id])[plain_id]
+                plain_restored = [tuple(row) for row in get_db().execute(plain_sql)]
+        finally:
+            server.shutdown()
+
+        if [result['changed'] for result in first] == [2] and unchanged[0]['status'] == 'not_modified' \
+                and stub['validators'][:2] == [None, '"v1"']:
+            self.log_test("Feed Conditional GET", "PASS", "Unchanged feed answered with 304 via its ETag")
+        else:
+            self.log_test("Feed Conditional GET", "FAIL", f"Results {first} / {unchanged}, sent {stub['validators']}")
+        if (changed[0]['changed'], changed[0]['removed'], same_content[0]['changed']) == (1, 1, 0) \
+                and events == [('feed-test-1', 'Open House', 'cancelled'), ('feed-test-2', 'Gala Night', 'booked')] \
+                and feed['etag'] == '"v3"' and feed['last_status'] == 'updated' and feed['last_fetch_ms'] is not None:
+            self.log_test("Feed Change Sync", "PASS", "Only changed and removed events were applied")
+        else:
+            self.log_test("Feed Change Sync", "FAIL", f"Results {changed} / {same_content}, events {events}")
+        if len(batch) == 1 and all(batch[0][str(slow_id)].get('changed') == 1 for slow_id in slow_ids) \
+                and stub['flaky_calls'] == 2 and elapsed < 1.2:
+            self.log_test("Concurrent Feed Fetch", "PASS", f"6 feeds of 0.4s synced in {elapsed:.2f}s, with a retry")
+        else:
+            self.log_test("Concurrent Feed Fetch", "FAIL", f"Batch {batch} in {elapsed:.2f}s")
+        if plain_imported == [('UID-less Fair', 'confirmed'), ('UID-less Parade', 'cancelled')] \
+                and (plain_result['changed'], plain_result['removed']) == (0, 1) \
+                and plain_synced == [('UID-less Fair', 'cancelled'), ('UID-less Parade', 'cancelled')] \
+                and plain_back['changed'] == 1 and plain_restored == plain_imported:
+            self.log_test("Feed Events Without UID", "PASS", "Removed event cancelled, restored with its feed status")
+        else:
+            self.log_test("Feed Events Without UID", "FAIL",
+                          f"Imported {plain_imported}, synced {plain_synced}, restored {plain_restored}")
+
+    def _scratch_db(self):
+        """Create an in-memory database with the application schema"""
+        db = sqlite3.connect(':memory:')
+        db.row_factory = sqlite3.Row
+        with open(os.path.join(app_dir, 'schema.sql')) as f:
+            db.executescript(f.read())
+        migrate(db)
+        return db
+
+    def test_conflict_detection(self):
+        """Test the sweep-line conflict engine"""
+        print("\n⚔️  Testing Conflict Detection")
+        print("-" * 40)
+
+        from conflicts import check_event_conflicts, recompute_conflicts, refresh_event_conflicts
+
+        db = self._scratch_db()
+        db.execute("INSERT INTO locations (id, name) VALUES (1, 'Hall A')")
+        db.execute("INSERT INTO equipment (id, name, quantity) VALUES (1, 'Tent', 1)")
+        events = [
+            (10, '2025-07-01', '2025-07-03', 1),
+            (11, '2025-07-02', None, 1),
+            (12, '2025-06-20', None, 1),
+            (13, '2025-07-03', None, None),
+        ]
+        for event_id, event_date, end_date, location_id in events:
+            db.execute(
+                "INSERT INTO events (event_id, event_name, client_id, event_date, end_date, location_id) "
+                "VALUES (?, 'Test', 1, ?, ?, ?)",
+                (event_id, event_date, end_date, location_id)
+            )
+        db.executemany("INSERT INTO equipment_assignments (event_id, equipment_id) VALUES (?, 1)",
+                       [(10,), (13,)])
+
+        conflicts = check_event_conflicts(db, 10, '2025-07-01', '2025-07-03')
+        expected = [
+            {'conflict_event_id': 13, 'conflict_type': 'equipment', 'equipment_id': 1},
+            {'conflict_event_id': 11, 'conflict_type': 'location', 'location_id': 1},
+        ]
+        if conflicts == expected:
+            self.log_test("Conflict Sweep", "PASS", f"{len(conflicts)} conflicts found")
+        else:
+            self.log_test("Conflict Sweep", "FAIL", f"Unexpected conflicts: {conflicts}")
+
+        if check_event_conflicts(db, 10, '2025-07-05') == []:
+            self.log_test("Conflict Window", "PASS", "No conflicts outside the event window")
+        else:
+            self.log_test("Conflict Window", "FAIL", "Conflicts reported outside the event window")
+
+        # Bulk recompute replaces stale rows and sets the has_conflicts flags
+        db.execute("INSERT INTO event_conflicts (event_id, conflicting_event_id, conflict_type) "
+                   "VALUES (12, 10, 'location')")
+        summary = recompute_conflicts(db)
+        rows = sorted(tuple(row) for row in db.execute(
+            "SELECT event_id, conflicting_event_id, conflict_type FROM event_conflicts"))
+        flagged = [row[0] for row in db.execute(
+            "SELECT event_id FROM events WHERE has_conflicts = 1 ORDER BY event_id")]
+        expected_rows = [(10, 11, 'location'), (10, 13, 'equipment'),
+                         (11, 10, 'location'), (13, 10, 'equipment')]
+        if rows == expected_rows and flagged == [10, 11, 13] and summary['removed'] == 1:
+            self.log_test("Conflict Recompute", "PASS", f"{summary['conflicts']} conflict rows stored")
+        else:
+            self.log_test("Conflict Recompute", "FAIL", f"Unexpected rows {rows} / flags {flagged}")
+
+        # Moving an event away clears the stale rows on both sides
+        db.execute("UPDATE events SET event_date = '2025-08-01' WHERE event_id = 11")
+        refreshed = refresh_event_conflicts(db, [11])
+        rows = sorted(tuple(row) for row in db.execute(
+            "SELECT event_id, conflicting_event_id, conflict_type FROM event_conflicts"))
+        flagged = [row[0] for row in db.execute(
+            "SELECT event_id FROM events WHERE has_conflicts = 1 ORDER BY event_id")]
+        if refreshed == {11: []} and rows == [(10, 13, 'equipment'), (13, 10, 'equipment')] \
+                and flagged == [10, 13]:
+            self.log_test("Incremental Conflicts", "PASS", "Stale conflict rows removed")
+        else:
+            self.log_test("Incremental Conflicts", "FAIL", f"Unexpected rows {rows} / flags {flagged}")
+
+    def test_equipment_availability(self):
+        """Test the time-windowed equipment availability engine"""
+        print("\n📦 Testing Equipment Availability")
+        print("-" * 40)
+
+        from availability import AvailabilityIndex, occurrence_windows
+        from helpers import day_to_iso
+        from recurrence import horizon_day
+
+        db = self._scratch_db()
+        db.execute("INSERT INTO equipment (id, name, quantity) VALUES (1, 'Tent', 5)")
+        events = [
+            (20, '2025-07-01', '2025-07-03', 'booked', 2),
+            (21, '2025-07-03', None, 'booked', 2),
+            (22, '2025-07-10', None, 'booked', 5),
+            (23, '2025-07-02', None, 'cancelled', 5),
+        ]
+        for event_id, event_date, end_date, status, quantity in events:
+            db.execute(
+                "INSERT INTO events (event_id, event_name, client_id, event_date, end_date, status) "
+                "VALUES (?, 'Test', 1, ?, ?, ?)",
+                (event_id, event_date, end_date, status)
+            )
+            db.execute("INSERT INTO equipment_assignments (event_id, equipment_id, quantity) VALUES (?, 1, ?)",
+                       (event_id, quantity))
+
+        index = AvailabilityIndex.load(db)
+        checks = {
+            ('2025-07-01', '2025-07-02'): 3,
+            ('2025-07-01', '2025-07-05'): 1,
+            ('2025-07-04', '2025-07-09'): 5,
+            ('2025-07-10', None): 0,
+            ('2025-06-01', '2025-06-30'): 5,
+        }
+        failures = [(window, index.free(1, *window)) for window, expected in checks.items()
+                    if index.free(1, *window) != expected]
+        if not failures:
+            self.log_test("Availability Windows", "PASS", f"{len(checks)} windows answered correctly")
+        else:
+            self.log_test("Availability Windows", "FAIL", f"Unexpected free units: {failures}")
+
+        # A series gets only the units free on every occurrence; open-ended ones up to the horizon
+        weekly = occurrence_windows('2025-06-26', None, 'weekly', '2025-07-10')
+        open_ended = occurrence_windows(datetime.now().strftime('%Y-%m-%d'), None, 'daily')
+        series_index = AvailabilityIndex.load_windows(db, weekly)
+        if [day_to_iso(start) for start, _ in weekly] == ['2025-06-26', '2025-07-03', '2025-07-10'] \
+                and series_index.free(1, '2025-06-26') == 5 and series_index.free_during(1, weekly) == 0 \
+                and series_index.free_during(1, weekly[:2]) == 1 and open_ended[-1][0] == horizon_day():
+            self.log_test("Series Availability", "PASS", f"Checked {len(weekly)} occurrences, open series to the horizon")
+        else:
+            self.log_test("Series Availability", "FAIL", f"Windows {weekly}, free {series_index.free_during(1, weekly)}")
+
     def test_performance(self):
         """Test basic performance metrics"""
         print("\n⚡ Testing Performance")
@@ -315,10 +1310,26 @@ class QCSTestSuite:
             self.test_authentication,
             self.test_authorization,
             self.test_database_operations,
+            self.test_connection_pool,
+            self.test_schema_migrations,
             self.test_client_management,
             self.test_event_management,
             self.test_inventory_management,
             self.test_blueprint_functionality,
+            self.test_conflict_detection,
+            self.test_equipment_availability,
+            self.test_events_conditional_get,
+            self.test_event_feed_serializer,
+            self.test_event_delta_sync,
+            self.test_live_updates,
+            self.test_recurring_events,
+            self.test_csv_import,
+            self.test_ics_import,
+            self.test_ics_export,
+            self.test_calendar_subscriptions,
+            self.test_exporters,
+            self.test_background_jobs,
+            self.test_feed_sync,
             self.test_security_features,
             self.test_performance,
         ]
@@ -14,6 +14,31 @@ document.addEventListener('DOMContentLoaded', function() {
     const calendarLoading = document.getElementById('calendarLoading');
     const showConflictsOnly = document.getElementById('showConflictsOnly'); // Assuming this still exists in filter panel
 
+    // Last /api/events payload per URL, revalidated with its ETag
+    const eventsCache = new Map();
+    const EVENTS_CACHE_LIMIT = 24;
+    // Feed revision the displayed events are current to (X-Events-Revision)
+    let syncRevision = null;
+
+    // Append the filter panel selections to a feed URL
+    function appendFilterParams(url) {
+        var categoryFilters = Array.from(document.querySelectorAll('.category-filter:checked')).map(cb => cb.value);
+        var statusFilters = Array.from(document.querySelectorAll('.status-filter:checked')).map(cb => cb.value);
+        var clientFilter = document.querySelector('.client-filter')?.value;
+        var showOnlyConflicts = document.getElementById('showConflictsOnly')?.checked;
+
+        if (categoryFilters.length > 0) url.searchParams.append('categories', categoryFilters.join(','));
+        if (statusFilters.length > 0) url.searchParams.append('statuses', statusFilters.join(','));
+        if (clientFilter && clientFilter !== 'all') url.searchParams.append('client_id', clientFilter);
+        if (showOnlyConflicts) url.searchParams.append('conflicts_only', 'true');
+        return url;
+    }
+
+    function trackRevision(response) {
+        var revision = parseInt(response.headers.get('X-Events-Revision'), 10);
+        if (!isNaN(revision)) syncRevision = revision;
+    }
+
     // Helper function to format duration
     function formatDuration(start, end) {
         const diffMs = end - start;
@@ -49,25 +74,36 @@ document.addEventListener('DOMContentLoaded', function() {
             // Show loading indicator
             if (calendarLoading) calendarLoading.classList.add('show');
 
-            var categoryFilters = Array.from(document.querySelectorAll('.category-filter:checked')).map(cb => cb.value);
-            var statusFilters = Array.from(document.querySelectorAll('.status-filter:checked')).map(cb => cb.value);
-            var clientFilter = document.querySelector('.client-filter')?.value;
-            var showOnlyConflicts = document.getElementById('showConflictsOnly')?.checked;
-
             var url = new URL('/api/events', window.location.origin);
             url.searchParams.append('start', fetchInfo.startStr);
             url.searchParams.append('end', fetchInfo.endStr);
-            if (categoryFilters.length > 0) url.searchParams.append('categories', categoryFilters.join(','));
-            if (statusFilters.length > 0) url.searchParams.append('statuses', statusFilters.join(','));
-            if (clientFilter && clientFilter !== 'all') url.searchParams.append('client_id', clientFilter);
-            if (showOnlyConflicts) url.searchParams.append('conflicts_only', 'true');
+            appendFilterParams(url);
+
+            var cacheKey = url.toString();
+            var cached = eventsCache.get(cacheKey);
+            var headers = {};
+            if (cached) headers['If-None-Match'] = cached.etag;
 
             fetch(url, {
-                credentials: 'same-origin'  // Include cookies with the request
+                credentials: 'same-origin',  // Include cookies with the request
+                cache: 'no-store',  // Revalidation is handled here, not by the HTTP cache
+                headers: headers
             })
                 .then(response => {
+                    trackRevision(response);
+                    if (response.status === 304 && cached) return cached.data;
                     if (!response.ok) throw new Error('Network response was not ok');
-                    return response.json();
+                    var etag = response.headers.get('ETag');
+                    return response.json().then(data => {
+                        if (etag) {
+                            eventsCache.delete(cacheKey);
+                            eventsCache.set(cacheKey, { etag: etag, data: data });
+                            if (eventsCache.size > EVENTS_CACHE_LIMIT) {
+                                eventsCache.delete(eventsCache.keys().next().value);
+                            }
+                        }
+                        return data;
+                    });
                 })
                 .then(data => successCallback(data))
                 .catch(error => {
@@ -88,7 +124,8 @@ document.addEventListener('DOMContentLoaded', function() {
             info.jsEvent.preventDefault(); // Prevent browser navigation
 
             const event = info.event;
-            const eventId = event.id;
+            // Occurrences of a recurring series link to the series itself
+            const eventId = (event.extendedProps && event.extendedProps.series_id) || event.id;
             const extendedProps = event.extendedProps || {};
 
             // Format dates/times nicely
@@ -257,7 +294,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 .then(data => {
                     if (data.success) {
                         bootstrap.Modal.getInstance(document.getElementById('quickEventModal'))?.hide();
-                        calendar.refetchEvents();
+                        scheduleSync();
                         showToast('Event created successfully', 'success');
                         quickEventForm.reset();
                     } else {
@@ -300,7 +337,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 .then(data => {
                     if (data.success) {
                         bootstrap.Modal.getInstance(document.getElementById('moveEventModal'))?.hide();
-                        calendar.refetchEvents();
+                        scheduleSync();
                         showToast('Event updated successfully', 'success');
                         if (data.has_conflicts) {
                             showToast(`Event "${document.getElementById('moveEventTitle').textContent}" now has conflicts.`, 'warning');
@@ -431,7 +468,7 @@ document.addEventListener('DOMContentLoaded', function() {
             .then(response => response.json())
             .then(data => {
                 if (data.success) {
-                    calendar.refetchEvents();
+                    scheduleSync();
                     showToast('Event updated successfully', 'success');
                     if (data.has_conflicts) {
                          showToast(`Event update caused conflicts.`, 'warning');
@@ -448,6 +485,82 @@ document.addEventListener('DOMContentLoaded', function() {
             });
     }
 
+    // Patch the displayed events with what changed since syncRevision
+    // instead of reloading the whole range; falls back to a full refetch.
+    function applyEventChanges() {
+        if (syncRevision === null) {
+            calendar.refetchEvents();
+            return Promise.resolve();
+        }
+
+        var url = new URL('/api/events/changes', window.location.origin);
+        url.searchParams.append('since', syncRevision);
+        url.searchParams.append('start', calendar.formatIso(calendar.view.activeStart));
+        url.searchParams.append('end', calendar.formatIso(calendar.view.activeEnd));
+        appendFilterParams(url);
+
+        return fetch(url, { credentials: 'same-origin', cache: 'no-store' })
+            .then(response => {
+                if (!response.ok) throw new Error('Network response was not ok');
+                return response.json();
+            })
+            .then(data => {
+                if (data.reset) {
+                    calendar.refetchEvents();
+                    return;
+                }
+                // Changed and deleted ids; a recurring series is replaced with all its occurrences
+                var replaced = new Set(data.deleted.map(String));
+                data.events.forEach(ev => replaced.add(String(ev.extendedProps.series_id ?? ev.id)));
+                var source = calendar.getEventSources()[0];
+                calendar.batchRendering(() => {
+                    calendar.getEvents().forEach(ev => {
+                        if (replaced.has(String(ev.extendedProps.series_id ?? ev.id))) ev.remove();
+                    });
+                    data.events.forEach(ev => calendar.addEvent(ev, source));
+                });
+                syncRevision = Math.max(syncRevision, data.revision);
+            })
+            .catch(error => {
+                console.error('Error syncing events:', error);
+                calendar.refetchEvents();
+            });
+    }
+
+    // Live updates: the server pushes a notification after every committed change
+    // and the calendar pulls the delta; syncs are coalesced while one is running.
+    let syncInFlight = null;
+    let syncPending = false;
+
+    function scheduleSync() {
+        if (syncInFlight) {
+            syncPending = true;
+            return;
+        }
+        syncInFlight = applyEventChanges().finally(() => {
+            syncInFlight = null;
+            if (syncPending) {
+                syncPending = false;
+                scheduleSync();
+            }
+        });
+    }
+
+    if (window.EventSource) {
+        const liveUpdates = new EventSource('/api/events/stream');
+        const onChange = e => {
+            var message = JSON.parse(e.data);
+            // Nothing to patch until the first feed load, or if already current
+            if (syncRevision === null || (message.revision !== null && message.revision <= syncRevision)) return;
+            scheduleSync();
+        };
+        // 'ready' arrives on every (re)connect and catches up on anything missed meanwhile
+        ['ready', 'created', 'updated', 'deleted', 'conflicts'].forEach(type => {
+            liveUpdates.addEventListener(type, onChange);
+        });
+        window.addEventListener('beforeunload', () => liveUpdates.close());
+    }
+
     // --- Sidebar Management ---
     function openSidebar(sidebar) {
         sidebar.classList.add('show');
@@ -0,0 +1,202 @@
+# Calendar Subscriptions
+#
+# A subscription is a filtered ICS feed that Outlook, Google or Apple
+# Calendar poll at /subscriptions/<token>.ics without logging in; the
+# random token in the URL is the credential and is revoked by deleting the
+# subscription.  Filters (client, category, location, manager and a
+# horizon of days before and after today) are optional and combine with AND.
+#
+# Calendar apps poll every few minutes, so a poll must cost next to
+# nothing.  Triggers on events (migrations 9 and 10) bump the revision of
+# every subscription whose filters and horizon the inserted, changed or
+# deleted event passes, before or after the change, once per change to a
+# column the feed shows; renaming a client or location bumps the
+# subscriptions showing its events.  The subscription row therefore carries
+# its own validators.  A poll is one token lookup: an If-None-Match or
+# If-Modified-Since that still matches gets a 304, anything else gets the
+# feed body kept in memory for that revision.  Only the first poll after a
+# matching change renders the feed again, mostly from the VEVENT cache.
+import hashlib
+import secrets
+import threading
+from collections import OrderedDict
+from datetime import datetime, time, timezone
+
+from helpers import epoch_day, overlap_condition
+from ics_writer import stream_calendar
+from recurrence import single_condition, window_condition
+
+# Bump when the feed body format changes so cached copies and client validators are dropped
+SUBSCRIPTION_FORMAT = 1
+
+SUBSCRIPTION_COLUMNS = ('id, token, name, user_id, client_id, category_id, location_id, manager, '
+                        'days_back, days_ahead, revision, changed_at, created_at')
+
+# Longest horizon, in days either side of today
+MAX_HORIZON_DAYS = 3650
+
+# Stand-ins for an open end of the horizon
+_FIRST_DAY = -10 ** 6
+_LAST_DAY = 10 ** 6
+
+
+def _optional_id(db, table, value, label):
+    if not value:
+        return None
+    row = db.execute(f'SELECT id FROM {table} WHERE id = ?', (value,)).fetchone()
+    if row is None:
+        raise ValueError(f'Unknown {label} {value}')
+    return row[0]
+
+
+def _optional_days(value, label):
+    if value in (None, ''):
+        return None
+    try:
+        days = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{label} must be a number of days')
+    if not 0 <= days <= MAX_HORIZON_DAYS:
+        raise ValueError(f'{label} must be between 0 and {MAX_HORIZON_DAYS} days')
+    return days
+
+
+def subscription_filters(db, form, user):
+    """Validated subscription fields from a form or JSON dict.
+
+    'mine' limits the feed to events managed by user.  Raises ValueError
+    with a message for the user when a value is invalid.
+    """
+    filters = {
+        'client_id': _optional_id(db, 'clients', form.get('client_id'), 'client'),
+        'category_id': _optional_id(db, 'event_categories', form.get('category_id'), 'category'),
+        'location_id': _optional_id(db, 'locations', form.get('location_id'), 'location'),
+        'manager': user['full_name'] if str(form.get('mine', '')).lower() in ('1', 'true', 'on') else None,
+        'days_back': _optional_days(form.get('days_back'), 'Days back'),
+        'days_ahead': _optional_days(form.get('days_ahead'), 'Days ahead'),
+    }
+    filters['name'] = (form.get('name') or '').strip() or _default_name(db, filters)
+    return filters
+
+
+def _default_name(db, filters):
+    """'QCS Events - RWJ' style title naming the filters"""
+    parts = []
+    for column, table in (('client_id', 'clients'), ('category_id', 'event_categories'), ('location_id', 'locations')):
+        if filters[column] is not None:
+            parts.append(db.execute(f'SELECT name FROM {table} WHERE id = ?', (filters[column],)).fetchone()[0])
+    if filters['manager']:
+        parts.append(filters['manager'])
+    return ' - '.join(['QCS Events'] + parts)
+
+
+def create_subscription(db, user_id, filters):
+    """Insert a subscription and return its token; the caller commits"""
+    token = secrets.token_urlsafe(24)
+    db.execute(
+        '''INSERT INTO calendar_subscriptions
+               (token, name, user_id, client_id, category_id, location_id, manager, days_back, days_ahead)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+        (token, filters['name'], user_id, filters['client_id'], filters['category_id'],
+         filters['location_id'], filters['manager'], filters['days_back'], filters['days_ahead'])
+    )
+    return token
+
+
+def find_subscription(db, token):
+    """The subscription row for a feed token, or None"""
+    return db.execute(f'SELECT {SUBSCRIPTION_COLUMNS} FROM calendar_subscriptions WHERE token = ?',
+                      (token,)).fetchone()
+
+
+def _has_horizon(subscription):
+    return subscription['days_back'] is not None or subscription['days_ahead'] is not None
+
+
+def subscription_conditions(db, subscription, today):
+    """WHERE conditions and params selecting the events of a subscription on the given day"""
+    conditions = []
+    params = []
+    for column in ('client_id', 'category_id', 'location_id'):
+        if subscription[column] is not None:
+            conditions.append(f'e.{column} = ?')
+            params.append(subscription[column])
+    if subscription['manager'] is not None:
+        conditions.append('e.manager = ? COLLATE NOCASE')
+        params.append(subscription['manager'])
+    if _has_horizon(subscription):
+        day = epoch_day(today)
+        start = _FIRST_DAY if subscription['days_back'] is None else day - subscription['days_back']
+        end = _LAST_DAY if subscription['days_ahead'] is None else day + subscription['days_ahead']
+        # Stored events overlapping the horizon, and series with occurrences in it
+        overlap, overlap_params = overlap_condition(db, start, end)
+        series, series_params = window_condition(start, end)
+        conditions.append(f'(({single_condition()} AND {overlap}) OR ({series}))')
+        params += overlap_params + series_params
+    return conditions, params
+
+
+def subscription_validators(subscription, url_template, today):
+    """(ETag, Last-Modified) of a subscription's feed, from its row alone.
+
+    A horizon moves with the date, so its feed also changes at midnight.
+    """
+    day = today.isoformat() if _has_horizon(subscription) else ''
+    digest = hashlib.sha1(f'{url_template}|{day}'.encode('utf-8')).hexdigest()[:12]
+    etag = f"sub-{SUBSCRIPTION_FORMAT}-{subscription['id']}-{subscription['revision']}-{digest}"
+    last_modified = datetime.fromisoformat(subscription['changed_at']).replace(tzinfo=timezone.utc)
+    if day:
+        last_modified = max(last_modified, datetime.combine(today, time(), timezone.utc))
+    return etag, last_modified
+
+
+class FeedBodyCache:
+    """LRU of rendered feed bodies: (database, subscription id) -> (ETag, body)"""
+
+    def __init__(self, size=256):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, etag):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != etag:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, etag, body):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (etag, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Shared by every subscription poll in this process
+feed_body_cache = FeedBodyCache()
+
+
+def subscription_body(db, subscription, url_template, etag, today, batch_size=500):
+    """The encoded feed of a subscription, rendered only when its ETag has moved.
+
+    The row was read before the events, so a body is never older than the
+    ETag it is stored under.
+    """
+    path = db.execute('PRAGMA database_list').fetchone()[2]
+    key = (path, subscription['id'])
+    body = feed_body_cache.get(key, etag) if path else None
+    if body is None:
+        conditions, params = subscription_conditions(db, subscription, today)
+        body = ''.join(stream_calendar(db, url_template, conditions, params, batch_size,
+                                       name=subscription['name'])).encode('utf-8')
+        if path:
+            feed_body_cache.put(key, etag, body)
+    return body